@@ -14,6 +14,7 @@ LOG = logging.getLogger(__name__)
 
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import tensorflow as tf
 import wandb
 from keras.callbacks import EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
@@ -104,27 +105,36 @@ class ConditionPrediction:
     def __post_init__(self) -> None:
         pass
 
-    def run_model_arguments(self) -> None:
-        train_df = pd.read_parquet(self.train_data_path)
-        test_df = pd.read_parquet(self.test_data_path)
-        train_fp = None
-        test_fp = None
-        if not self.generate_fingerprints:
-            train_fp = np.load(self.train_fp_path)
-            test_fp = np.load(self.test_fp_path)
+    @staticmethod
+    def read_molecule_columns(data_path: pathlib.Path) -> pd.DataFrame:
+        """Reads the columns of the cleaned data the model uses, the rest (e.g. the procedure details, most of the size of the file) are not read"""
         unnecessary_columns = [
             "date_of_experiment",
             "extracted_from_file",
             "grant_date",
             "is_mapped",
             "procedure_details",
+            "row_id",
             "rxn_str",
             "rxn_time",
             "temperature",
             "yield_000",
         ]
-        train_df.drop(columns=unnecessary_columns, inplace=True)
-        test_df.drop(columns=unnecessary_columns, inplace=True)
+        columns = [
+            name
+            for name in pq.read_schema(data_path).names
+            if name not in unnecessary_columns
+        ]
+        return pd.read_parquet(data_path, columns=columns)
+
+    def run_model_arguments(self) -> None:
+        train_df = ConditionPrediction.read_molecule_columns(self.train_data_path)
+        test_df = ConditionPrediction.read_molecule_columns(self.test_data_path)
+        train_fp = None
+        test_fp = None
+        if not self.generate_fingerprints:
+            train_fp = np.load(self.train_fp_path)
+            test_fp = np.load(self.test_fp_path)
         self.run_model(
             train_val_df=train_df,
             test_df=test_df,
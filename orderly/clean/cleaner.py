@@ -9,6 +9,7 @@ from typing import Dict, List, Optional, Tuple
 import click
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import tqdm
 import tqdm.contrib.logging
 from numpy.typing import NDArray
@@ -20,6 +21,9 @@ from orderly.types import *
 LOG = logging.getLogger(__name__)
 
 import orderly.data.util
+import orderly.extract.dataset
+import orderly.extract.names
+import orderly.extract.procedures
 
 
 @dataclasses.dataclass(kw_only=True)
@@ -58,6 +62,7 @@ class Cleaner:
         map_rare_molecules_to_other (bool): Will map rare molecules (see above) to the string 'other' rather than removing the reactions with rare molecules
         molecules_to_remove (list[str]: Remove reactions that are represented by a name instead of a SMILES string
         disable_tqdm (bool, optional): Controls the use of tqdm progress bar. Defaults to False.
+        include_procedure_details (bool, optional): Keep the procedure details of the reactions in the cleaned data. They are most of the size of the extracted data and unused by the cleaning, so they are only read for the reactions that are kept, once the cleaning is done. If the extraction wrote them to a sidecar (orderly.extract --procedure_details_sidecar) they are joined from it. Defaults to True.
     """
 
     ord_extraction_path: pathlib.Path
@@ -82,6 +87,7 @@ class Cleaner:
     drop_duplicates: bool
     scramble: bool
     disable_tqdm: bool
+    include_procedure_details: bool = True
 
     def __post_init__(self) -> None:
         LOG.info("Entered post_init")
@@ -100,14 +106,27 @@ class Cleaner:
 
         LOG.info("Getting merged dataframe from extracted ord files")
 
-        dfs = []
-        for file in sorted(self.ord_extraction_path.glob("*.parquet")):
-            LOG.debug(f"Reading {file=}")
-            extracted_df = pd.read_parquet(file)
-            dfs.append(extracted_df)
-            LOG.debug(f"Read {file=}")
+        # only the columns that are used are read, the procedure details are most of the bytes of the files (see _read_procedure_details)
+        exclude_columns = orderly.extract.procedures.TEXT_COLUMNS
+        if orderly.extract.dataset.is_dataset(self.ord_extraction_path):
+            # the extraction wrote a partitioned dataset, which we read in one scan
+            df = orderly.extract.dataset.read_dataset(
+                self.ord_extraction_path, exclude_columns=exclude_columns
+            ).to_pandas()
+        else:
+            dfs = []
+            for file in sorted(self.ord_extraction_path.glob("*.parquet")):
+                LOG.debug(f"Reading {file=}")
+                columns = [
+                    name
+                    for name in pq.read_schema(file).names
+                    if name not in exclude_columns
+                ]
+                extracted_df = pd.read_parquet(file, columns=columns)
+                dfs.append(extracted_df)
+                LOG.debug(f"Read {file=}")
+            df = pd.concat(dfs, ignore_index=True)
         LOG.info("Successfully read all data")
-        df = pd.concat(dfs, ignore_index=True)
 
         # create a new "original_index" col
         df = df.reset_index()
@@ -134,6 +153,46 @@ class Cleaner:
         LOG.debug("Unified missing data to None")
         return df
 
+    def _read_procedure_details(self, df: pd.DataFrame) -> pd.Series:
+        """
+        The procedure details of the reactions of df, which are read once the cleaning is done so the text of the reactions that are removed is never held in memory.
+        If the extraction wrote them to a sidecar they are joined on the row ids, else they are read in the order of _merge_extracted_ords and matched on the original_index.
+        """
+        column = orderly.extract.procedures.PROCEDURE_DETAILS_COLUMN
+        if orderly.extract.procedures.ROW_ID_COLUMN in df.columns:
+            return orderly.extract.procedures.join_procedure_details(
+                df,
+                self.ord_extraction_path.parent
+                / orderly.extract.procedures.PROCEDURE_DETAILS_FOLDER,
+            )[column]
+        original_index = set(df["original_index"])
+        if orderly.extract.dataset.is_dataset(self.ord_extraction_path):
+            procedure_details = (
+                orderly.extract.dataset.read_dataset(
+                    self.ord_extraction_path, columns=[column]
+                )
+                .column(column)
+                .to_pandas()
+            )
+            procedure_details = procedure_details[
+                procedure_details.index.isin(original_index)
+            ]
+        else:
+            parts = []
+            offset = 0
+            for file in sorted(self.ord_extraction_path.glob("*.parquet")):
+                file_procedure_details = pd.read_parquet(file, columns=[column])[column]
+                file_procedure_details.index += offset
+                offset += len(file_procedure_details)
+                # filtered file by file, so only the text of the reactions that are kept is held in memory
+                parts.append(
+                    file_procedure_details[
+                        file_procedure_details.index.isin(original_index)
+                    ]
+                )
+            procedure_details = pd.concat(parts)
+        return df["original_index"].map(procedure_details).replace("<missing>", None)
+
     def _get_number_of_columns_to_keep(self) -> Dict[str, int]:
         return {
             "reactant": self.num_reactant,
@@ -874,6 +933,10 @@ class Cleaner:
             df = Cleaner._scramble(df, components)
             df = Cleaner._move_none_to_after_data(df, components)
             df = Cleaner._replace_None_with_NA(df, components)
+        if self.include_procedure_details:
+            df[
+                orderly.extract.procedures.PROCEDURE_DETAILS_COLUMN
+            ] = self._read_procedure_details(df)
         df = df.sort_index(axis=1)
         # move "original_index" to the front
         df = df[
@@ -963,7 +1026,7 @@ def get_matching_indices(
     "--molecules_to_remove_path",
     default="data/orderly/all_molecule_names.csv",
     type=str,
-    help="The path to the file than contains the molecules_names",
+    help="The path to the file than contains the molecules_names (the csv list or the .parquet name index written by the extraction)",
 )
 @click.option(
     "--remove_reactions_with_no_reactants",
@@ -1095,6 +1158,13 @@ def get_matching_indices(
     help="If True, applies random split to create train and test set (90/10); a dict of the train and test indices will be saved to the output_path (instead of a df)",
 )
 @click.option("--disable_tqdm", type=bool, default=False, show_default=True)
+@click.option(
+    "--include_procedure_details",
+    type=bool,
+    default=True,
+    show_default=True,
+    help="If True, the procedure details of the reactions are kept in the cleaned data (read once the cleaning is done, or joined from the sidecar if the extraction used --procedure_details_sidecar), else they are not read",
+)
 @click.option(
     "--overwrite",
     type=bool,
@@ -1134,6 +1204,7 @@ def main_click(
     scramble: bool,
     train_size: float,
     disable_tqdm: bool,
+    include_procedure_details: bool,
     overwrite: bool,
     log_file: str,
 ) -> None:
@@ -1193,6 +1264,7 @@ def main_click(
         disable_tqdm=disable_tqdm,
         overwrite=overwrite,
         log_file=_log_file,
+        include_procedure_details=include_procedure_details,
     )
 
 
@@ -1224,6 +1296,7 @@ def main(
     overwrite: bool,
     log_file: pathlib.Path = pathlib.Path("cleaning.log"),
     log_level: int = logging.INFO,
+    include_procedure_details: bool = True,
 ) -> None:
     """
     After running orderly.extract, this script will merge and apply further cleaning to the data.
@@ -1283,7 +1356,9 @@ def main(
 
     start_time = datetime.datetime.now()
 
-    molecules_to_remove = orderly.data.util.load_list(molecules_to_remove_path)
+    molecules_to_remove = orderly.extract.names.load_molecule_names(
+        molecules_to_remove_path
+    )
 
     extract_config_path = ord_extraction_path / ".." / "extract_config.json"
 
@@ -1320,6 +1395,7 @@ def main(
         "drop_duplicates": drop_duplicates,
         "scramble": scramble,
         "train_size": train_size,
+        "include_procedure_details": include_procedure_details,
     }
 
     file_name = pathlib.Path(output_path).name
@@ -1370,6 +1446,7 @@ def main(
         drop_duplicates=drop_duplicates,
         scramble=scramble,
         disable_tqdm=disable_tqdm,
+        include_procedure_details=include_procedure_details,
     )
 
     if train_size not in [0.0, 1.0]:
@@ -1,31 +1,115 @@
-from typing import Dict, Set, Optional
+from typing import Dict, List, Set, Optional
 import io
+import logging
 import pathlib
 import pkgutil
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import rdkit
 
+import orderly.data.util
 import orderly.extract.canonicalise
 from orderly.types import *
 
+LOG = logging.getLogger(__name__)
 
-def get_solvents(path: Optional[pathlib.Path] = None) -> pd.DataFrame:
-    """reads the solvent csv data stored in the package"""
+# canonical smiles of the rows of a solvents csv, keyed by the hash of the csv and the RDKit version
+_CANONICAL_SMILES: Dict[str, List[Optional[CANON_SMILES]]] = {}
+
+
+def _read_solvents_csv(path: Optional[pathlib.Path] = None) -> bytes:
     if path is None:
         data = pkgutil.get_data("orderly.data", "solvents.csv")
-        data = io.BytesIO(data)  # type: ignore
-        solvents = pd.read_csv(data)
-    else:
-        solvents = pd.read_csv(path)
+        assert data is not None
+        return data
+    return pathlib.Path(path).read_bytes()
 
-    solvents["canonical_smiles"] = solvents["smiles"].apply(
-        orderly.extract.canonicalise.get_canonicalised_smiles
-    )
+
+def get_solvents_cache_path(
+    cache_key: str, cache_dir: Optional[pathlib.Path] = None
+) -> pathlib.Path:
+    if cache_dir is None:
+        cache_dir = orderly.data.util.get_cache_dir()
+    return cache_dir / f"solvents_{cache_key}.parquet"
+
+
+def _load_canonical_smiles(
+    cache_path: pathlib.Path, num_rows: int
+) -> Optional[List[Optional[CANON_SMILES]]]:
+    if not cache_path.exists():
+        return None
+    try:
+        canonical_smiles: List[Optional[CANON_SMILES]] = (
+            pq.read_table(cache_path).column("canonical_smiles").to_pylist()
+        )
+    except (OSError, KeyError, pa.ArrowException) as e:
+        LOG.warning(f"Ignoring the unreadable solvents cache {cache_path}: {e}")
+        return None
+    if len(canonical_smiles) != num_rows:
+        return None
+    return canonical_smiles
+
+
+def _save_canonical_smiles(
+    cache_path: pathlib.Path, canonical_smiles: List[Optional[CANON_SMILES]]
+) -> None:
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        pq.write_table(
+            pa.table(
+                {"canonical_smiles": pa.array(canonical_smiles, type=pa.string())}
+            ),
+            tmp_path,
+        )
+        tmp_path.replace(cache_path)
+    except OSError as e:
+        LOG.warning(f"Could not write the solvents cache {cache_path}: {e}")
+
+
+def get_solvents(
+    path: Optional[pathlib.Path] = None,
+    canonicalisation_store_path: Optional[pathlib.Path] = None,
+    cache_dir: Optional[pathlib.Path] = None,
+) -> pd.DataFrame:
+    """
+    reads the solvent csv data stored in the package, canonical smiles are looked up in the canonicalisation store if a path is given
+    The canonical smiles are only computed once per csv (and RDKit version): they are kept in memory and in a parquet file in cache_dir (default orderly.data.util.get_cache_dir()).
+    """
+    if canonicalisation_store_path is not None:
+        orderly.extract.canonicalise.attach_store(canonicalisation_store_path)
+    data = _read_solvents_csv(path)
+    solvents = pd.read_csv(io.BytesIO(data))
+
+    cache_key = orderly.data.util.hash_cache_key(data, rdkit.__version__)
+    canonical_smiles = _CANONICAL_SMILES.get(cache_key)
+    if canonical_smiles is None:
+        cache_path = get_solvents_cache_path(cache_key, cache_dir=cache_dir)
+        canonical_smiles = _load_canonical_smiles(cache_path, len(solvents))
+        if canonical_smiles is None:
+            canonical_smiles = [
+                orderly.extract.canonicalise.get_canonicalised_smiles(smiles)
+                for smiles in solvents["smiles"]
+            ]
+            if canonicalisation_store_path is not None:
+                orderly.extract.canonicalise.flush_store()
+            _save_canonical_smiles(cache_path, canonical_smiles)
+            LOG.debug(f"Cached the canonical smiles of the solvents at {cache_path}")
+        _CANONICAL_SMILES[cache_key] = canonical_smiles
+
+    solvents["canonical_smiles"] = canonical_smiles
     return solvents
 
 
-def get_solvents_set(path: Optional[pathlib.Path] = None) -> Set[SOLVENT]:
-    solvents = get_solvents(path=path)
+def get_solvents_set(
+    path: Optional[pathlib.Path] = None,
+    canonicalisation_store_path: Optional[pathlib.Path] = None,
+) -> Set[SOLVENT]:
+    solvents = get_solvents(
+        path=path, canonicalisation_store_path=canonicalisation_store_path
+    )
     return set(solvents["canonical_smiles"])
 
 
@@ -0,0 +1,528 @@
+import bisect
+import collections
+import dataclasses
+import gzip
+import json
+import logging
+import pathlib
+import random
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import click
+
+from ord_schema.proto import dataset_pb2 as ord_dataset_pb2
+from ord_schema.proto import reaction_pb2 as ord_reaction_pb2
+
+from rdkit import Chem as rdkit_Chem
+from rdkit.rdBase import BlockLogs as rdkit_BlockLogs
+
+import orderly.data.test_data
+
+LOG = logging.getLogger(__name__)
+
+# the roles of the molecules of a reaction, the products are taken from the outcomes
+INPUT_ROLES = {
+    "reactant": ord_reaction_pb2.ReactionRole.REACTANT,
+    "reagent": ord_reaction_pb2.ReactionRole.REAGENT,
+    "solvent": ord_reaction_pb2.ReactionRole.SOLVENT,
+    "catalyst": ord_reaction_pb2.ReactionRole.CATALYST,
+}
+ROLES = tuple(INPUT_ROLES) + ("product",)
+
+SMILES = ord_reaction_pb2.CompoundIdentifier.SMILES
+NAME = ord_reaction_pb2.CompoundIdentifier.NAME
+
+# the key of the reactions without a temperature or reaction time
+MISSING = "missing"
+
+# (type, value) of a compound identifier, type is SMILES or NAME
+IDENTIFIER = Tuple[int, str]
+
+
+def _get_identifier(
+    identifiers: Sequence[ord_reaction_pb2.CompoundIdentifier],
+) -> Optional[IDENTIFIER]:
+    """The SMILES of a compound, or its name if it has no SMILES (as preferred by OrdExtractor.find_smiles)"""
+    for identifier_type in (SMILES, NAME):
+        for identifier in identifiers:
+            if identifier.type == identifier_type:
+                return identifier_type, identifier.value
+    return None
+
+
+class _Sampler:
+    """Draws values with the frequencies they were counted with"""
+
+    def __init__(self, counts: Dict[Any, int]) -> None:
+        self.values = list(counts)
+        self.cum_weights: List[int] = []
+        total = 0
+        for value in self.values:
+            total += counts[value]
+            self.cum_weights.append(total)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def sample(self, rng: random.Random) -> Any:
+        return self.values[
+            bisect.bisect_right(self.cum_weights, rng.random() * self.cum_weights[-1])
+        ]
+
+
+@dataclasses.dataclass
+class ReactionDistribution:
+    """
+    The frequencies, counted over a set of ORD datasets, of what the extraction reads from a reaction: the identifiers of the molecules of each role (SMILES or name only), the number of molecules of each role per reaction, the share of reactions with a (mapped) reaction CXSMILES and of products with a yield, the yields, temperatures and reaction times, and a sample of the procedure texts.
+    Keys are strings so the distribution can be saved as json: identifiers are "{type}:{value}", temperatures "{units}:{value}:{control type}" and times "{units}:{value}" (MISSING if the reaction has none).
+    """
+
+    molecules: Dict[str, Dict[str, int]]
+    num_molecules: Dict[str, Dict[str, int]]
+    num_reactions: int = 0
+    num_rxn_str: int = 0
+    num_mapped: int = 0
+    num_products: int = 0
+    num_yields: int = 0
+    yields: Dict[str, int] = dataclasses.field(default_factory=dict)
+    temperatures: Dict[str, int] = dataclasses.field(default_factory=dict)
+    times: Dict[str, int] = dataclasses.field(default_factory=dict)
+    procedures: List[str] = dataclasses.field(default_factory=list)
+
+    @staticmethod
+    def from_ord_files(
+        files: Optional[List[pathlib.Path]] = None,
+        max_procedures: int = 1000,
+        seed: int = 0,
+    ) -> "ReactionDistribution":
+        """Counts the distribution over the ORD files (the test data by default), keeping a uniform sample of max_procedures procedure texts"""
+        # somewhat dangerous imports so keeping localised
+        import orderly.extract.extractor
+        import orderly.extract.main
+
+        if files is None:
+            files = orderly.extract.main.get_file_names(
+                orderly.data.test_data.get_path_of_test_ords()
+            )
+        molecules: Dict[str, collections.Counter[str]] = {
+            role: collections.Counter() for role in ROLES
+        }
+        num_molecules: Dict[str, collections.Counter[str]] = {
+            role: collections.Counter() for role in ROLES
+        }
+        yields: collections.Counter[str] = collections.Counter()
+        temperatures: collections.Counter[str] = collections.Counter()
+        times: collections.Counter[str] = collections.Counter()
+        distribution = ReactionDistribution(molecules={}, num_molecules={})
+        rng = random.Random(seed)
+        procedures: List[str] = []
+
+        for file in files:
+            for rxn in orderly.extract.extractor.OrdExtractor.iter_reactions(file):
+                distribution.num_reactions += 1
+                counts: collections.Counter[str] = collections.Counter()
+                for key in rxn.inputs:
+                    for component in rxn.inputs[key].components:
+                        role = next(
+                            (
+                                name
+                                for name, value in INPUT_ROLES.items()
+                                if value == component.reaction_role
+                            ),
+                            None,
+                        )
+                        identifier = _get_identifier(component.identifiers)
+                        if role is None or identifier is None:
+                            continue
+                        molecules[role][f"{identifier[0]}:{identifier[1]}"] += 1
+                        counts[role] += 1
+                for outcome in rxn.outcomes[:1]:
+                    for product in outcome.products:
+                        identifier = _get_identifier(product.identifiers)
+                        if identifier is None:
+                            continue
+                        molecules["product"][f"{identifier[0]}:{identifier[1]}"] += 1
+                        counts["product"] += 1
+                        distribution.num_products += 1
+                        for measurement in product.measurements:
+                            if (
+                                measurement.type
+                                == ord_reaction_pb2.ProductMeasurement.YIELD
+                            ):
+                                distribution.num_yields += 1
+                                yields[str(round(measurement.percentage.value, 1))] += 1
+                                break
+                    time = outcome.reaction_time
+                    times[
+                        f"{time.units}:{round(time.value, 2)}"
+                        if outcome.HasField("reaction_time")
+                        else MISSING
+                    ] += 1
+                for role in ROLES:
+                    num_molecules[role][str(counts[role])] += 1
+
+                for identifier in rxn.identifiers:
+                    if (
+                        identifier.type
+                        == ord_reaction_pb2.ReactionIdentifier.REACTION_CXSMILES
+                    ):
+                        distribution.num_rxn_str += 1
+                        distribution.num_mapped += int(identifier.is_mapped)
+                        break
+                temperature = rxn.conditions.temperature
+                temperatures[
+                    f"{temperature.setpoint.units}:{round(temperature.setpoint.value, 1)}:{temperature.control.type}"
+                    if rxn.conditions.HasField("temperature")
+                    else MISSING
+                ] += 1
+
+                # reservoir sample of the procedures
+                procedure = rxn.notes.procedure_details
+                if len(procedures) < max_procedures:
+                    procedures.append(procedure)
+                else:
+                    i = rng.randrange(distribution.num_reactions)
+                    if i < max_procedures:
+                        procedures[i] = procedure
+
+        distribution.molecules = {role: dict(molecules[role]) for role in ROLES}
+        distribution.num_molecules = {role: dict(num_molecules[role]) for role in ROLES}
+        distribution.yields = dict(yields)
+        distribution.temperatures = dict(temperatures)
+        distribution.times = dict(times)
+        distribution.procedures = procedures
+        LOG.info(
+            f"Counted the distribution of {distribution.num_reactions} reactions in {len(files)} files: "
+            + ", ".join(
+                f"{len(distribution.molecules[role])} {role}s" for role in ROLES
+            )
+        )
+        return distribution
+
+    def save(self, path: pathlib.Path) -> None:
+        with open(path, "w") as f:
+            json.dump(dataclasses.asdict(self), f)
+
+    @staticmethod
+    def load(path: pathlib.Path) -> "ReactionDistribution":
+        with open(path) as f:
+            return ReactionDistribution(**json.load(f))
+
+
+class SyntheticReactionGenerator:
+    """
+    Generates ORD reactions with the frequencies of a ReactionDistribution: each reaction draws the number of molecules of each role and then the molecules (with name only identifiers as often as in the data), a reaction CXSMILES (atom mapped as often as in the data, with the reactants and products mapped and the other inputs as unmapped agents, and the fragments of salts grouped with |f:...|), yields, a temperature, a reaction time and a procedure text.
+    The molecules are real, but the reactions are not chemically meaningful (the products are not made from the reactants). The reactions only depend on the seed.
+    """
+
+    def __init__(self, distribution: ReactionDistribution, seed: int = 0) -> None:
+        self.distribution = distribution
+        self.rng = random.Random(seed)
+        self.molecules = {
+            role: _Sampler(distribution.molecules[role]) for role in ROLES
+        }
+        self.num_molecules = {
+            role: _Sampler(distribution.num_molecules[role]) for role in ROLES
+        }
+        self.yields = _Sampler(distribution.yields)
+        self.temperatures = _Sampler(distribution.temperatures)
+        self.times = _Sampler(distribution.times)
+        self._mols: Dict[str, Optional[rdkit_Chem.Mol]] = {}
+
+    def _sample_identifiers(self, role: str) -> List[IDENTIFIER]:
+        if len(self.molecules[role]) == 0:
+            return []
+        num = int(self.num_molecules[role].sample(self.rng))
+        identifiers = []
+        for _ in range(num):
+            identifier_type, value = self.molecules[role].sample(self.rng).split(":", 1)
+            identifiers.append((int(identifier_type), value))
+        return identifiers
+
+    def _get_mol(self, smiles: str) -> Optional[rdkit_Chem.Mol]:
+        if smiles not in self._mols:
+            _ = rdkit_BlockLogs()
+            mol = rdkit_Chem.MolFromSmiles(smiles)
+            if mol is not None:
+                for atom in mol.GetAtoms():
+                    atom.SetAtomMapNum(0)
+            self._mols[smiles] = mol
+        return self._mols[smiles]
+
+    def _map(self, smiles: str, start: int, end: int) -> Tuple[List[str], int]:
+        """The fragments of the molecule with its atoms numbered from start (up to end, the rest are unmapped), and the next atom map number"""
+        mol = self._get_mol(smiles)
+        if mol is None:
+            return smiles.split("."), start
+        mol = rdkit_Chem.Mol(mol)
+        for atom in mol.GetAtoms():
+            if start < end:
+                atom.SetAtomMapNum(start)
+                start += 1
+        return rdkit_Chem.MolToSmiles(mol, canonical=False).split("."), start
+
+    def _rxn_str(
+        self,
+        reactants: List[str],
+        agents: List[str],
+        products: List[str],
+        is_mapped: bool,
+    ) -> str:
+        """The reaction CXSMILES, with the fragments of each molecule grouped"""
+        sides: List[List[List[str]]] = [[], [], []]
+        if is_mapped:
+            num_product_atoms = sum(
+                mol.GetNumAtoms()
+                for mol in (self._get_mol(product) for product in products)
+                if mol is not None
+            )
+            next_map = 1
+            for product in products:
+                fragments, next_map = self._map(
+                    product, next_map, num_product_atoms + 1
+                )
+                sides[2].append(fragments)
+            next_map = 1
+            for reactant in reactants:
+                fragments, next_map = self._map(
+                    reactant, next_map, num_product_atoms + 1
+                )
+                sides[0].append(fragments)
+        else:
+            sides[0] = [reactant.split(".") for reactant in reactants]
+            sides[2] = [product.split(".") for product in products]
+        sides[1] = [agent.split(".") for agent in agents]
+
+        groups = []
+        index = 0
+        for side in sides:
+            for fragments in side:
+                if len(fragments) > 1:
+                    groups.append(
+                        ".".join(str(i) for i in range(index, index + len(fragments)))
+                    )
+                index += len(fragments)
+        rxn_str = ">".join(
+            ".".join(fragment for fragments in side for fragment in fragments)
+            for side in sides
+        )
+        if len(groups) > 0:
+            rxn_str += f" |f:{','.join(groups)}|"
+        return rxn_str
+
+    def generate_reaction(self, reaction_id: str) -> ord_reaction_pb2.Reaction:
+        distribution = self.distribution
+        rng = self.rng
+        rxn = ord_reaction_pb2.Reaction(reaction_id=reaction_id)
+
+        inputs = {role: self._sample_identifiers(role) for role in INPUT_ROLES}
+        products = self._sample_identifiers("product")
+        for role, identifiers in inputs.items():
+            for i, (identifier_type, value) in enumerate(identifiers):
+                component = rxn.inputs[f"{role} {i}"].components.add()
+                component.reaction_role = INPUT_ROLES[role]  # type: ignore
+                component.identifiers.add(type=identifier_type, value=value)  # type: ignore
+
+        outcome = rxn.outcomes.add()
+        for identifier_type, value in products:
+            product = outcome.products.add()
+            product.identifiers.add(type=identifier_type, value=value)  # type: ignore
+            product.is_desired_product = True
+            if (
+                len(self.yields) > 0
+                and rng.random() * distribution.num_products < distribution.num_yields
+            ):
+                measurement = product.measurements.add(
+                    type=ord_reaction_pb2.ProductMeasurement.YIELD
+                )
+                measurement.percentage.value = float(self.yields.sample(rng))
+        time = self.times.sample(rng) if len(self.times) > 0 else MISSING
+        if time != MISSING:
+            units, value = time.split(":")
+            outcome.reaction_time.units = int(units)
+            outcome.reaction_time.value = float(value)
+        temperature = (
+            self.temperatures.sample(rng) if len(self.temperatures) > 0 else MISSING
+        )
+        if temperature != MISSING:
+            units, value, control = temperature.split(":")
+            rxn.conditions.temperature.setpoint.units = int(units)
+            rxn.conditions.temperature.setpoint.value = float(value)
+            rxn.conditions.temperature.control.type = int(control)
+        if len(distribution.procedures) > 0:
+            rxn.notes.procedure_details = rng.choice(distribution.procedures)
+
+        if rng.random() * distribution.num_reactions < distribution.num_rxn_str:
+            is_mapped = (
+                rng.random() * distribution.num_rxn_str < distribution.num_mapped
+            )
+            # only the molecules with a SMILES can be in the reaction string
+            smiles = {
+                role: [
+                    value
+                    for identifier_type, value in identifiers
+                    if identifier_type == SMILES
+                ]
+                for role, identifiers in list(inputs.items()) + [("product", products)]
+            }
+            agents = smiles["reagent"] + smiles["solvent"] + smiles["catalyst"]
+            rxn.identifiers.add(
+                type=ord_reaction_pb2.ReactionIdentifier.REACTION_CXSMILES,
+                value=self._rxn_str(
+                    smiles["reactant"], agents, smiles["product"], is_mapped
+                ),
+                is_mapped=is_mapped,
+            )
+        return rxn
+
+    def generate_reactions(
+        self, num_reactions: int, prefix: str = "ord-synthetic"
+    ) -> Iterator[ord_reaction_pb2.Reaction]:
+        for i in range(num_reactions):
+            yield self.generate_reaction(f"{prefix}-{i:08d}")
+
+
+def write_dataset(
+    path: pathlib.Path,
+    reactions: Iterator[ord_reaction_pb2.Reaction],
+    name: str,
+    dataset_id: str,
+) -> int:
+    """
+    Writes the reactions as a gzipped binary Dataset, one reaction at a time (a serialised Dataset is its fields one after the other, so the header and each reaction are serialised on their own), so the memory doesn't grow with the number of reactions. Returns the number of reactions.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    num_reactions = 0
+    # a fixed mtime in the gzip header, so the files only depend on the reactions
+    with gzip.GzipFile(path, "wb", mtime=0) as f:
+        f.write(
+            ord_dataset_pb2.Dataset(
+                name=name,
+                description="Synthetic reactions, see orderly.data.synthetic",
+                dataset_id=dataset_id,
+            ).SerializeToString()
+        )
+        for rxn in reactions:
+            f.write(ord_dataset_pb2.Dataset(reactions=[rxn]).SerializeToString())
+            num_reactions += 1
+    return num_reactions
+
+
+def generate_ord_data(
+    output_path: pathlib.Path,
+    num_reactions: int,
+    reactions_per_file: int = 100000,
+    distribution: Optional[ReactionDistribution] = None,
+    seed: int = 0,
+    name: str = "synthetic",
+) -> List[pathlib.Path]:
+    """
+    Writes num_reactions synthetic reactions (see SyntheticReactionGenerator) to files of up to reactions_per_file reactions, in the layout of the ORD data (output_path/{2 characters of the id}/ord_dataset-{id}.pb.gz) so it can be extracted with orderly.extract --data_path=output_path. The datasets are named {name}_{seed}_{index}, so they can be selected with name_contains_substring. Returns the files.
+    The distribution is counted from the test data if not given.
+    """
+    if num_reactions < 1 or reactions_per_file < 1:
+        e = ValueError(
+            f"Expect a positive number of reactions: got {num_reactions=} and {reactions_per_file=}"
+        )
+        LOG.error(e)
+        raise e
+    if distribution is None:
+        distribution = ReactionDistribution.from_ord_files(seed=seed)
+    generator = SyntheticReactionGenerator(distribution, seed=seed)
+    rng = random.Random(seed)
+    files = []
+    for index, start in enumerate(range(0, num_reactions, reactions_per_file)):
+        dataset_id = f"ord_dataset-{rng.getrandbits(128):032x}"
+        path = output_path / dataset_id[12:14] / f"{dataset_id}.pb.gz"
+        written = write_dataset(
+            path,
+            generator.generate_reactions(
+                min(reactions_per_file, num_reactions - start),
+                prefix=f"ord-{name}-{seed}-{index}",
+            ),
+            name=f"{name}_{seed}_{index}",
+            dataset_id=dataset_id,
+        )
+        LOG.info(f"Wrote {written} reactions to {path}")
+        files.append(path)
+    return files
+
+
+@click.command()
+@click.option(
+    "--output_path",
+    type=str,
+    default="data/synthetic_ord/",
+    show_default=True,
+    help="The folder the ORD files are written to (in the layout of the ORD data, so it can be used as the data_path of orderly.extract)",
+)
+@click.option(
+    "--num_reactions",
+    type=int,
+    default=100000,
+    show_default=True,
+    help="The number of reactions to generate, e.g. from 1000 to 1000000",
+)
+@click.option(
+    "--reactions_per_file",
+    type=int,
+    default=100000,
+    show_default=True,
+    help="The maximum number of reactions per file",
+)
+@click.option(
+    "--distribution_path",
+    type=str,
+    default="",
+    show_default=True,
+    help="Path to a json file with a ReactionDistribution, if it doesn't exist the distribution is counted from the test data and saved there. If left empty the distribution is counted from the test data",
+)
+@click.option(
+    "--seed",
+    type=int,
+    default=0,
+    show_default=True,
+    help="The random seed, the files only depend on the seed and the distribution",
+)
+@click.option(
+    "--name",
+    type=str,
+    default="synthetic",
+    show_default=True,
+    help="The datasets are named {name}_{seed}_{index}",
+)
+def generate_ord_data_click(
+    output_path: str,
+    num_reactions: int,
+    reactions_per_file: int,
+    distribution_path: str,
+    seed: int,
+    name: str,
+) -> None:
+    """
+    Generates synthetic ORD files with the molecules, conditions and reaction strings distributed as in the test data, to benchmark the extraction at scale, e.g.
+
+        python -m orderly.data.synthetic --output_path=data/synthetic_ord --num_reactions=1000000
+        python -m orderly.extract --data_path=data/synthetic_ord --output_path=data/orderly/synthetic --name_contains_substring=synthetic
+    """
+    logging.basicConfig(level=logging.INFO)
+    distribution: Optional[ReactionDistribution] = None
+    if distribution_path != "":
+        _distribution_path = pathlib.Path(distribution_path)
+        if _distribution_path.exists():
+            distribution = ReactionDistribution.load(_distribution_path)
+        else:
+            distribution = ReactionDistribution.from_ord_files(seed=seed)
+            distribution.save(_distribution_path)
+    generate_ord_data(
+        output_path=pathlib.Path(output_path),
+        num_reactions=num_reactions,
+        reactions_per_file=reactions_per_file,
+        distribution=distribution,
+        seed=seed,
+        name=name,
+    )
+
+
+if __name__ == "__main__":
+    generate_ord_data_click()
@@ -1,4 +1,6 @@
 from typing import List
+import hashlib
+import os
 import pathlib
 import logging
 
@@ -19,3 +21,20 @@ def save_list(x: List[str], path: pathlib.Path) -> None:
 
 def load_list(path: pathlib.Path) -> List[str]:
     return pd.read_csv(path).squeeze("columns").tolist()  # type: ignore
+
+
+def get_cache_dir() -> pathlib.Path:
+    """The directory of the on-disk caches of prebuilt lookup tables: $ORDERLY_CACHE_DIR, or ~/.cache/orderly"""
+    cache_dir = os.environ.get("ORDERLY_CACHE_DIR")
+    if cache_dir is not None:
+        return pathlib.Path(cache_dir)
+    return pathlib.Path.home() / ".cache" / "orderly"
+
+
+def hash_cache_key(*parts: str | bytes) -> str:
+    """A hash of the inputs of a cached table (e.g. the source csv and the RDKit version), used in its file name"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode() if isinstance(part, str) else part)
+        h.update(b"\0")
+    return h.hexdigest()[:16]
@@ -0,0 +1,228 @@
+import collections
+import dataclasses
+import logging
+import pathlib
+from typing import Any, Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import rdkit
+from rdkit import Chem as rdkit_Chem
+from rdkit.rdBase import BlockLogs as rdkit_BlockLogs
+
+import orderly.extract.defaults
+from orderly.types import *
+
+LOG = logging.getLogger(__name__)
+
+MOLECULE_COLUMN_PREFIXES = (
+    "reactant",
+    "agent",
+    "reagent",
+    "solvent",
+    "catalyst",
+    "product",
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class MoleculeAnnotation:
+    """Per-molecule properties, elements is the sorted tuple of the element symbols in the molecule (including implicit hydrogens)"""
+
+    elements: Tuple[str, ...]
+    has_transition_metal: bool
+    num_heavy_atoms: int
+    formal_charge: int
+
+
+def annotate_mol(mol: rdkit_Chem.Mol) -> MoleculeAnnotation:
+    elements = set()
+    has_transition_metal = False
+    for atom in mol.GetAtoms():
+        elements.add(atom.GetSymbol())
+        if atom.GetTotalNumHs() > 0:
+            elements.add("H")
+        if orderly.extract.defaults._is_transition_metal(atom):
+            has_transition_metal = True
+    return MoleculeAnnotation(
+        elements=tuple(sorted(elements)),
+        has_transition_metal=has_transition_metal,
+        num_heavy_atoms=mol.GetNumHeavyAtoms(),
+        formal_charge=rdkit_Chem.GetFormalCharge(mol),
+    )
+
+
+class MoleculeAnnotationTable:
+    """
+    A table of MoleculeAnnotation keyed by SMILES (typically the canonical SMILES in the extracted data), filled lazily by get() or in bulk by annotate_many().
+    Identifiers RDKit can't parse (e.g. english names) are remembered as None, but are not persisted.
+    If maxsize (negative_maxsize for the None entries) is set the table is a bounded LRU cache, as the process-wide table of the extraction workers is, otherwise it keeps every molecule.
+    The table is saved as a parquet file with the RDKit version in its metadata; a file written by another RDKit version is ignored on load.
+    """
+
+    def __init__(
+        self, maxsize: Optional[int] = None, negative_maxsize: Optional[int] = None
+    ) -> None:
+        self.maxsize = maxsize
+        self.negative_maxsize = negative_maxsize
+        self._annotations: collections.OrderedDict[
+            SMILES, MoleculeAnnotation
+        ] = collections.OrderedDict()
+        self._unparsable: collections.OrderedDict[
+            SMILES, None
+        ] = collections.OrderedDict()
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._annotations) + len(self._unparsable)
+
+    def __contains__(self, smiles: SMILES) -> bool:
+        return smiles in self._annotations or smiles in self._unparsable
+
+    def add(self, smiles: SMILES, annotation: Optional[MoleculeAnnotation]) -> None:
+        if annotation is None:
+            entries: collections.OrderedDict[Any, Any] = self._unparsable
+            maxsize = self.negative_maxsize
+        else:
+            entries = self._annotations
+            maxsize = self.maxsize
+        entries[smiles] = annotation
+        entries.move_to_end(smiles)
+        if maxsize is not None:
+            while len(entries) > maxsize:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, smiles: SMILES) -> Optional[MoleculeAnnotation]:
+        """Returns the annotation of the molecule, parsing it if it isn't in the table yet, None if RDKit can't parse it"""
+        if smiles in self._annotations:
+            self._annotations.move_to_end(smiles)
+            return self._annotations[smiles]
+        if smiles in self._unparsable:
+            self._unparsable.move_to_end(smiles)
+            return None
+        self.misses += 1
+        _ = rdkit_BlockLogs()
+        mol = rdkit_Chem.MolFromSmiles(smiles)
+        annotation = None if mol is None else annotate_mol(mol)
+        self.add(smiles, annotation)
+        return annotation
+
+    def has_transition_metal(self, smiles: SMILES) -> bool:
+        annotation = self.get(smiles)
+        return annotation is not None and annotation.has_transition_metal
+
+    def annotate_many(self, smiles: Iterable[SMILES]) -> int:
+        """Annotates the molecules that aren't in the table yet, returns the number annotated"""
+        misses = self.misses
+        for smi in smiles:
+            self.get(smi)
+        return self.misses - misses
+
+    def to_arrow(self) -> pa.Table:
+        rows = sorted(self._annotations.items())
+        return pa.table(
+            {
+                "smiles": pa.array([smiles for smiles, _ in rows], pa.string()),
+                "elements": pa.array(
+                    [list(annotation.elements) for _, annotation in rows],
+                    pa.list_(pa.string()),
+                ),
+                "has_transition_metal": pa.array(
+                    [annotation.has_transition_metal for _, annotation in rows],
+                    pa.bool_(),
+                ),
+                "num_heavy_atoms": pa.array(
+                    [annotation.num_heavy_atoms for _, annotation in rows], pa.int32()
+                ),
+                "formal_charge": pa.array(
+                    [annotation.formal_charge for _, annotation in rows], pa.int32()
+                ),
+            }
+        ).replace_schema_metadata({"rdkit_version": rdkit.__version__})
+
+    def save(self, path: pathlib.Path) -> None:
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table = self.to_arrow()
+        pq.write_table(table, path)
+        LOG.info(f"Saved {table.num_rows} molecule annotations to {path}")
+
+    @staticmethod
+    def load(path: pathlib.Path) -> "MoleculeAnnotationTable":
+        annotation_table = MoleculeAnnotationTable()
+        path = pathlib.Path(path)
+        if not path.exists():
+            return annotation_table
+        table = pq.read_table(path)
+        metadata = table.schema.metadata or {}
+        rdkit_version = metadata.get(b"rdkit_version", b"").decode()
+        if rdkit_version != rdkit.__version__:
+            LOG.info(
+                f"Ignoring molecule annotations in {path} written with RDKit {rdkit_version}"
+            )
+            return annotation_table
+        for (
+            smiles,
+            elements,
+            has_transition_metal,
+            num_heavy_atoms,
+            formal_charge,
+        ) in zip(*[table.column(name).to_pylist() for name in table.column_names]):
+            annotation_table.add(
+                smiles,
+                MoleculeAnnotation(
+                    elements=tuple(elements),
+                    has_transition_metal=has_transition_metal,
+                    num_heavy_atoms=num_heavy_atoms,
+                    formal_charge=formal_charge,
+                ),
+            )
+        LOG.debug(f"Loaded {len(annotation_table)} molecule annotations from {path}")
+        return annotation_table
+
+
+_TABLE = MoleculeAnnotationTable(maxsize=2**17, negative_maxsize=2**15)
+
+
+def get_table() -> MoleculeAnnotationTable:
+    """The process-wide annotation table used during extraction, bounded as it lives as long as the worker"""
+    return _TABLE
+
+
+def has_transition_metal(smiles: SMILES) -> bool:
+    """As orderly.extract.defaults.has_transition_metal, but looked up in the process-wide annotation table"""
+    return _TABLE.has_transition_metal(smiles)
+
+
+def get_molecules_from_parquet(
+    path: pathlib.Path, missing_value: Optional[str] = "<missing>"
+) -> List[SMILES]:
+    """The distinct molecules in the reactant, agent, solvent, ... columns of an extracted parquet file (wide or list columns)"""
+    schema = pq.read_schema(path)
+    columns = [
+        name for name in schema.names if name.split("_")[0] in MOLECULE_COLUMN_PREFIXES
+    ]
+    table = pq.read_table(path, columns=columns)
+    molecules = set()
+    for column in table.columns:
+        if pa.types.is_list(column.type):
+            column = pc.list_flatten(column)
+        molecules.update(pc.unique(column.drop_null()).to_pylist())
+    molecules.discard(missing_value)
+    return sorted(molecules)
+
+
+def annotate_extracted_ords(
+    extracted_ords_path: pathlib.Path,
+    output_file_path: pathlib.Path,
+) -> MoleculeAnnotationTable:
+    """Builds (or updates) the annotation table of all the molecules in the extracted parquet files, and saves it to output_file_path"""
+    annotation_table = MoleculeAnnotationTable.load(output_file_path)
+    # the files are either directly in extracted_ords_path or in the partitions of a dataset
+    for file in sorted(pathlib.Path(extracted_ords_path).glob("**/*.parquet")):
+        annotation_table.annotate_many(get_molecules_from_parquet(file))
+    annotation_table.save(output_file_path)
+    return annotation_table
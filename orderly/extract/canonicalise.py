@@ -1,39 +1,298 @@
-from typing import Optional
+from typing import Optional, Callable, Dict, Tuple, Any, NamedTuple
+import collections
+import dataclasses
 import logging
+import pathlib
+import re
 
 from rdkit import Chem as rdkit_Chem
 from rdkit.rdBase import BlockLogs as rdkit_BlockLogs
 
+import orderly.extract.annotations
+import orderly.extract.defaults
+import orderly.extract.store
 from orderly.types import *
 
 LOG = logging.getLogger(__name__)
 
 
-def remove_mapping_info_and_canonicalise_smiles(
-    molecule_identifier: MOLECULE_IDENTIFIER,
-) -> Optional[SMILES]:
+@dataclasses.dataclass
+class CacheStats:
+    """Counters for the canonicalisation cache, a negative entry is a molecule identifier that could not be canonicalised. over_length, over_atoms and over_ring_closures count the identifiers that were not parsed as they are over a CostLimits"""
+
+    positive_hits: int = 0
+    negative_hits: int = 0
+    misses: int = 0
+    positive_evictions: int = 0
+    negative_evictions: int = 0
+    store_hits: int = 0
+    over_length: int = 0
+    over_atoms: int = 0
+    over_ring_closures: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.positive_hits + self.negative_hits
+
+    @property
+    def evictions(self) -> int:
+        return self.positive_evictions + self.negative_evictions
+
+    @property
+    def guarded(self) -> int:
+        return self.over_length + self.over_atoms + self.over_ring_closures
+
+    def __sub__(self, other: "CacheStats") -> "CacheStats":
+        return CacheStats(
+            **{
+                field.name: getattr(self, field.name) - getattr(other, field.name)
+                for field in dataclasses.fields(self)
+            }
+        )
+
+    def __str__(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups > 0 else 0.0
+        return (
+            f"hits={self.hits} (positive={self.positive_hits}, negative={self.negative_hits}), "
+            f"misses={self.misses}, evictions={self.evictions}, store_hits={self.store_hits}, {hit_rate=:.3f}, "
+            f"guarded={self.guarded} (length={self.over_length}, atoms={self.over_atoms}, ring_closures={self.over_ring_closures})"
+        )
+
+
+_CACHE_KEY = Tuple[str, MOLECULE_IDENTIFIER, bool]
+
+
+class CanonicalisationCache:
+    """
+    A bounded LRU cache of canonicalisation results.
+    Positive entries (canonical SMILES) and negative entries (identifiers RDKit can't parse, typically english names) are stored separately so a flood of unique names can't evict the common molecules.
+    """
+
+    def __init__(self, maxsize: int = 2**20, negative_maxsize: int = 2**18) -> None:
+        self.maxsize = maxsize
+        self.negative_maxsize = negative_maxsize
+        self._positive: collections.OrderedDict[
+            _CACHE_KEY, Any
+        ] = collections.OrderedDict()
+        self._negative: collections.OrderedDict[
+            _CACHE_KEY, None
+        ] = collections.OrderedDict()
+        self.stats = CacheStats()
+
+    def __len__(self) -> int:
+        return len(self._positive) + len(self._negative)
+
+    def lookup(self, key: _CACHE_KEY) -> Tuple[bool, Any]:
+        """Returns (found, value)"""
+        value = self._positive.get(key)
+        if value is not None:
+            self._positive.move_to_end(key)
+            self.stats.positive_hits += 1
+            return True, value
+        if key in self._negative:
+            self._negative.move_to_end(key)
+            self.stats.negative_hits += 1
+            return True, None
+        self.stats.misses += 1
+        return False, None
+
+    def insert(self, key: _CACHE_KEY, value: Any) -> None:
+        if value is None:
+            store: collections.OrderedDict[Any, Any] = self._negative
+            maxsize = self.negative_maxsize
+        else:
+            store = self._positive
+            maxsize = self.maxsize
+        if maxsize <= 0:
+            return
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > maxsize:
+            store.popitem(last=False)
+            if value is None:
+                self.stats.negative_evictions += 1
+            else:
+                self.stats.positive_evictions += 1
+
+    def clear(self, keep_stats: bool = False) -> None:
+        self._positive.clear()
+        self._negative.clear()
+        if not keep_stats:
+            self.stats = CacheStats()
+
+
+_CACHE = CanonicalisationCache()
+
+
+def get_cache() -> CanonicalisationCache:
+    return _CACHE
+
+
+def get_cache_stats() -> CacheStats:
+    """Returns a copy of the counters of the process-wide canonicalisation cache"""
+    return dataclasses.replace(_CACHE.stats)
+
+
+def clear_cache() -> None:
+    _CACHE.clear()
+
+
+def configure_cache(maxsize: int, negative_maxsize: Optional[int] = None) -> None:
+    """Resizes the process-wide canonicalisation cache, a maxsize of 0 disables caching"""
+    _CACHE.maxsize = maxsize
+    if negative_maxsize is not None:
+        _CACHE.negative_maxsize = negative_maxsize
+    _CACHE.clear()
+
+
+_STORE: Optional[orderly.extract.store.CanonicalisationStore] = None
+
+
+def attach_store(path: Optional[pathlib.Path]) -> None:
     """
-    Strips away mapping info and returns canonicalised SMILES.
+    Backs get_canonicalised_smiles with an on-disk CanonicalisationStore (shared across processes and runs), None detaches the current store.
+    Results that miss both the in-memory cache and the store are buffered and written by flush_store().
     """
+    global _STORE
+    if _STORE is not None:
+        if path is not None and _STORE.path == pathlib.Path(path):
+            return
+        _STORE.close()
+        _STORE = None
+    if path is not None:
+        _STORE = orderly.extract.store.CanonicalisationStore(pathlib.Path(path))
+        LOG.debug(f"Attached canonicalisation store at {path}")
+
+
+def get_store() -> Optional[orderly.extract.store.CanonicalisationStore]:
+    return _STORE
+
+
+def flush_store() -> int:
+    if _STORE is None:
+        return 0
+    return _STORE.flush()
+
+
+_BRACKET_ATOM = re.compile(r"\[[^\]]*\]")
+_ATOM_TOKEN = re.compile(r"\[[^\]]*\]|Br|Cl|[BCNOPSFI]|[bcnops]|\*")
+_RING_CLOSURE = re.compile(r"%\d\d|\d")
+
+
+@dataclasses.dataclass(frozen=True)
+class CostLimits:
+    """
+    Limits on the size of a molecule identifier that is parsed by RDKit: the length of the string, the number of atom tokens and the number of ring closure digits (outside of bracket atoms), None is no limit.
+    Polymers, large clusters and garbage strings can take orders of magnitude longer to canonicalise than a typical molecule, so identifiers over a limit are treated as unresolvable names without being parsed. The checks only scan the string, and the tokens are only counted for strings longer than the limit.
+    """
+
+    max_length: Optional[int] = 10000
+    max_atoms: Optional[int] = 1000
+    max_ring_closures: Optional[int] = 200
+
+    def exceeded(self, molecule_identifier: MOLECULE_IDENTIFIER) -> Optional[str]:
+        """The first limit the identifier is over ("length", "atoms" or "ring_closures"), None if it is within all of them"""
+        length = len(molecule_identifier)
+        if self.max_length is not None and length > self.max_length:
+            return "length"
+        # each atom token and ring closure is at least one character
+        if (
+            self.max_atoms is not None
+            and length > self.max_atoms
+            and len(_ATOM_TOKEN.findall(molecule_identifier)) > self.max_atoms
+        ):
+            return "atoms"
+        if (
+            self.max_ring_closures is not None
+            and length > self.max_ring_closures
+            and len(_RING_CLOSURE.findall(_BRACKET_ATOM.sub("", molecule_identifier)))
+            > self.max_ring_closures
+        ):
+            return "ring_closures"
+        return None
+
+    def to_config(self) -> Dict[str, Optional[int]]:
+        return dataclasses.asdict(self)
+
+
+_COST_LIMITS = CostLimits()
+
+
+def get_cost_limits() -> CostLimits:
+    return _COST_LIMITS
+
+
+def configure_cost_limits(cost_limits: CostLimits) -> None:
+    """Sets the CostLimits of the process, the cache entries are cleared if they change as they hold results under the previous limits (the counters are kept)"""
+    global _COST_LIMITS
+    if cost_limits == _COST_LIMITS:
+        return
+    _COST_LIMITS = cost_limits
+    _CACHE.clear(keep_stats=True)
+    LOG.debug(f"Canonicalisation cost limits: {cost_limits}")
+
+
+def _is_over_cost_limits(molecule_identifier: MOLECULE_IDENTIFIER) -> bool:
+    exceeded = _COST_LIMITS.exceeded(molecule_identifier)
+    if exceeded is None:
+        return False
+    field = f"over_{exceeded}"
+    setattr(_CACHE.stats, field, getattr(_CACHE.stats, field) + 1)
+    LOG.debug(
+        f"Not canonicalising an identifier of {len(molecule_identifier)} characters over the {exceeded} limit: {molecule_identifier[:100]}"
+    )
+    return True
+
+
+def _cached(
+    kind: str,
+    molecule_identifier: MOLECULE_IDENTIFIER,
+    is_mapped: bool,
+    func: Callable[[MOLECULE_IDENTIFIER, bool], Optional[SMILES]],
+) -> Optional[SMILES]:
+    key = (kind, molecule_identifier, is_mapped)
+    found, value = _CACHE.lookup(key)
+    if found:
+        return value
+    if _is_over_cost_limits(molecule_identifier):
+        # unresolvable without being parsed, and not recorded in the store, whose results don't depend on the limits
+        value = None
+    else:
+        value = func(molecule_identifier, is_mapped)
+    _CACHE.insert(key, value)
+    return value
+
+
+def _remove_atom_maps(m: rdkit_Chem.Mol) -> None:
+    # the stereochemistry was perceived with the atom maps, which can change it (e.g. for the ring stereo centres of 1,4-disubstituted cyclohexanes), so it is perceived again and the canonical SMILES is the same as for the unmapped molecule
+    has_atom_map = False
+    for atom in m.GetAtoms():
+        if atom.GetAtomMapNum() != 0:
+            atom.SetAtomMapNum(0)
+            has_atom_map = True
+    if has_atom_map:
+        rdkit_Chem.AssignStereochemistry(m, cleanIt=True, force=True)
+
+
+def _remove_mapping_info_and_canonicalise_smiles(
+    molecule_identifier: MOLECULE_IDENTIFIER, is_mapped: bool = True
+) -> Optional[SMILES]:
     # This function can handle smiles both with and without mapping info
     _ = rdkit_BlockLogs()
     # remove mapping info and canonicalsie the molecule_identifier at the same time
     # converting to mol and back canonicalises the molecule_identifier string
     try:
         m = rdkit_Chem.MolFromSmiles(molecule_identifier)
-        for atom in m.GetAtoms():
-            atom.SetAtomMapNum(0)
+        _remove_atom_maps(m)
         return str(rdkit_Chem.MolToSmiles(m))
     except AttributeError:
         return None
 
 
-def canonicalise_smiles(
-    molecule_identifier: MOLECULE_IDENTIFIER,
+def _canonicalise_smiles(
+    molecule_identifier: MOLECULE_IDENTIFIER, is_mapped: bool = False
 ) -> Optional[SMILES]:
-    """
-    Returns canonicalised SMILES, ignoring mapping info (ie if mapping info is present, it will be retained)
-    """
     _ = rdkit_BlockLogs()
     # remove mapping info and canonicalsie the molecule_identifier at the same time
     # converting to mol and back canonicalises the molecule_identifier string
@@ -46,27 +305,183 @@ def canonicalise_smiles(
         return None
 
 
-def get_canonicalised_smiles(
+def _get_canonicalised_smiles(
     molecule_identifier: MOLECULE_IDENTIFIER, is_mapped: bool = False
 ) -> Optional[SMILES]:
-    """
-    Returns canonicalised SMILES, stripping mapping info if is_mapped is True.
-    Removing mapping info and then canonicalising is slower than just canonicalising, so we only attempt to remove mapping if mapping info is present.
-    """
     # attempts to remove mapping info and canonicalise a smiles string and if it fails, returns the name whilst adding to a list of non smiles names
     # molecule_identifier: string, that is a smiles or an english name of the molecule
     if is_mapped:
-        attempted_canon_smiles = remove_mapping_info_and_canonicalise_smiles(
+        attempted_canon_smiles = _remove_mapping_info_and_canonicalise_smiles(
             molecule_identifier
         )
     else:
-        attempted_canon_smiles = canonicalise_smiles(molecule_identifier)
+        attempted_canon_smiles = _canonicalise_smiles(molecule_identifier)
     if attempted_canon_smiles is not None:
         return attempted_canon_smiles
     else:
         if molecule_identifier[0] == "[":
             if molecule_identifier[-1] == "]":
-                return canonicalise_smiles(molecule_identifier[1:-1])
+                return _canonicalise_smiles(molecule_identifier[1:-1])
         else:
-            return canonicalise_smiles(f"[{molecule_identifier}]")
+            return _canonicalise_smiles(f"[{molecule_identifier}]")
         return None
+
+
+def _get_canonicalised_smiles_from_store(
+    molecule_identifier: MOLECULE_IDENTIFIER, is_mapped: bool = False
+) -> Optional[SMILES]:
+    if _STORE is None:
+        return _get_canonicalised_smiles(molecule_identifier, is_mapped)
+    found, value = _STORE.get(molecule_identifier, is_mapped)
+    if found:
+        _CACHE.stats.store_hits += 1
+        return value
+    value = _get_canonicalised_smiles(molecule_identifier, is_mapped)
+    _STORE.put(molecule_identifier, is_mapped, value)
+    return value
+
+
+def remove_mapping_info_and_canonicalise_smiles(
+    molecule_identifier: MOLECULE_IDENTIFIER,
+) -> Optional[SMILES]:
+    """
+    Strips away mapping info and returns canonicalised SMILES, None for an identifier over the CostLimits of the process.
+    """
+    return _cached(
+        "remove_mapping",
+        molecule_identifier,
+        True,
+        _remove_mapping_info_and_canonicalise_smiles,
+    )
+
+
+def canonicalise_smiles(
+    molecule_identifier: MOLECULE_IDENTIFIER,
+) -> Optional[SMILES]:
+    """
+    Returns canonicalised SMILES, ignoring mapping info (ie if mapping info is present, it will be retained), None for an identifier over the CostLimits of the process.
+    """
+    return _cached("canonicalise", molecule_identifier, False, _canonicalise_smiles)
+
+
+def get_canonicalised_smiles(
+    molecule_identifier: MOLECULE_IDENTIFIER, is_mapped: bool = False
+) -> Optional[SMILES]:
+    """
+    Returns canonicalised SMILES, stripping mapping info if is_mapped is True.
+    Removing mapping info and then canonicalising is slower than just canonicalising, so we only attempt to remove mapping if mapping info is present.
+    If canonicalisation fails, we retry with the square brackets added or removed, so an unresolvable name costs up to three parse attempts; the result (including a failure) is cached, and recorded in the on-disk store if one is attached.
+    An identifier over the CostLimits of the process (see configure_cost_limits) is unresolvable without being parsed.
+    """
+    return _cached(
+        "get_canonicalised",
+        molecule_identifier,
+        bool(is_mapped),
+        _get_canonicalised_smiles_from_store,
+    )
+
+
+class MoleculeInfo(NamedTuple):
+    """
+    The result of parsing a molecule identifier once:
+        - canonical_smiles: as returned by get_canonicalised_smiles (None if unresolvable)
+        - has_atom_map: whether any atom of the identifier carries a mapping number, None if RDKit can't parse the identifier as given
+        - has_transition_metal: as returned by orderly.extract.defaults.has_transition_metal for the identifier as given
+    """
+
+    canonical_smiles: Optional[CANON_SMILES]
+    has_atom_map: Optional[bool]
+    has_transition_metal: bool
+
+    def to_flags(self) -> int:
+        """The flags recorded with the canonical SMILES in the CanonicalisationStore: 1 if the identifier parses as given, 2 if it has an atom map, 4 if it has a transition metal"""
+        return (
+            (self.has_atom_map is not None)
+            | (bool(self.has_atom_map) << 1)
+            | (self.has_transition_metal << 2)
+        )
+
+    @staticmethod
+    def from_flags(
+        canonical_smiles: Optional[CANON_SMILES], flags: int
+    ) -> "MoleculeInfo":
+        return MoleculeInfo(
+            canonical_smiles,
+            bool(flags & 2) if flags & 1 else None,
+            bool(flags & 4),
+        )
+
+
+def _get_molecule_info(
+    molecule_identifier: MOLECULE_IDENTIFIER, is_mapped: bool = False
+) -> MoleculeInfo:
+    if _is_over_cost_limits(molecule_identifier):
+        return MoleculeInfo(None, None, False)
+    found, canon_smi, flags = (
+        (False, None, None)
+        if _STORE is None
+        else _STORE.get_entry(molecule_identifier, is_mapped)
+    )
+    if found and (flags is not None or canon_smi is None):
+        # an unresolvable identifier doesn't parse as given either, so it has no flags to look up
+        _CACHE.stats.store_hits += 1
+        return MoleculeInfo.from_flags(canon_smi, 0 if flags is None else flags)
+
+    _ = rdkit_BlockLogs()
+    try:
+        m = rdkit_Chem.MolFromSmiles(molecule_identifier)
+    except Exception:
+        m = None
+    if m is None:
+        # the bracket retries only affect the canonical SMILES, the flags describe the identifier as given
+        if found:
+            _CACHE.stats.store_hits += 1
+        elif molecule_identifier[0] == "[":
+            if molecule_identifier[-1] == "]":
+                canon_smi = _canonicalise_smiles(molecule_identifier[1:-1])
+        else:
+            canon_smi = _canonicalise_smiles(f"[{molecule_identifier}]")
+        info = MoleculeInfo(canon_smi, None, False)
+    else:
+        has_atom_map = False
+        has_transition_metal = False
+        for atom in m.GetAtoms():
+            if atom.GetAtomMapNum() != 0:
+                has_atom_map = True
+            if orderly.extract.defaults._is_transition_metal(atom):
+                has_transition_metal = True
+        if is_mapped:
+            _remove_atom_maps(m)
+        canon_smi = str(rdkit_Chem.MolToSmiles(m))
+        info = MoleculeInfo(canon_smi, has_atom_map, has_transition_metal)
+        annotation_table = orderly.extract.annotations.get_table()
+        if canon_smi not in annotation_table:
+            # the same parse annotates the canonical molecule, so the extraction never has to parse it again
+            annotation_table.add(canon_smi, orderly.extract.annotations.annotate_mol(m))
+    if _STORE is not None:
+        # a new entry, or the flags of an entry that was written by get_canonicalised_smiles
+        _STORE.put(
+            molecule_identifier, is_mapped, info.canonical_smiles, info.to_flags()
+        )
+    return info
+
+
+def get_molecule_info(
+    molecule_identifier: MOLECULE_IDENTIFIER, is_mapped: bool = False
+) -> MoleculeInfo:
+    """
+    Returns the canonical SMILES (stripping mapping info if is_mapped is True), whether the identifier is atom mapped, and whether it contains a transition metal, from a single RDKit parse.
+    If a CanonicalisationStore is attached, the store is looked up first and the identifier is only parsed if it isn't there with its flags (see MoleculeInfo.to_flags).
+    The result is cached alongside get_canonicalised_smiles, which then returns the same canonical SMILES without parsing the identifier again. An identifier over the CostLimits is not parsed: it is unresolvable and has_atom_map is None.
+    """
+    key = ("molecule_info", molecule_identifier, bool(is_mapped))
+    found, info = _CACHE.lookup(key)
+    if found:
+        return info  # type: ignore
+    info = _get_molecule_info(molecule_identifier, bool(is_mapped))
+    _CACHE.insert(key, info)
+    _CACHE.insert(
+        ("get_canonicalised", molecule_identifier, bool(is_mapped)),
+        info.canonical_smiles,
+    )
+    return info
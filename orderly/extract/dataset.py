@@ -0,0 +1,163 @@
+import logging
+import pathlib
+import shutil
+from typing import Any, Dict, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.dataset as pa_ds
+import pyarrow.parquet as pq
+
+import orderly.extract.annotations
+import orderly.extract.extractor
+from orderly.types import *
+
+LOG = logging.getLogger(__name__)
+
+PARTITION_KEY = "source_file"
+ROW_GROUP_SIZE = 100_000
+
+
+def is_molecule_column(name: str) -> bool:
+    return name.split("_")[0] in orderly.extract.annotations.MOLECULE_COLUMN_PREFIXES
+
+
+def get_partition_path(dataset_path: pathlib.Path, filename: str) -> pathlib.Path:
+    """
+    The (hive style) partition directory of the reactions extracted from one ORD file.
+    The partitions are keyed by the name of the file rather than by the extracted_from_file column (the ORD dataset id), as the file name is known before the file is loaded.
+    """
+    return dataset_path / f"{PARTITION_KEY}={filename}"
+
+
+def get_partition_paths(dataset_path: pathlib.Path) -> List[pathlib.Path]:
+    return sorted(
+        path
+        for path in pathlib.Path(dataset_path).glob(f"{PARTITION_KEY}=*")
+        if path.is_dir()
+    )
+
+
+def is_dataset(path: pathlib.Path) -> bool:
+    return len(get_partition_paths(path)) > 0
+
+
+def get_write_options(
+    schema: pa.Schema, row_group_size: int = ROW_GROUP_SIZE
+) -> Dict[str, Any]:
+    """
+    Options for pq.write_table / pq.ParquetWriter: the molecule columns (few distinct values that repeat a lot) and the per-file columns are dictionary encoded, while the reaction strings and procedure details (mostly unique) are not, and min/max statistics are written so readers can skip row groups.
+    """
+    return {
+        "use_dictionary": [
+            field.name
+            for field in schema
+            if is_molecule_column(field.name) or field.name == "extracted_from_file"
+        ],
+        "write_statistics": True,
+        "row_group_size": row_group_size,
+    }
+
+
+def write_partition(
+    instance: "orderly.extract.extractor.OrdExtractor",
+    dataset_path: pathlib.Path,
+    filename: str,
+    trust_labelling: Optional[bool] = None,
+    procedure_details_path: Optional[pathlib.Path] = None,
+) -> pathlib.Path:
+    """
+    Writes the reactions of one extracted file into its own partition of the dataset, so workers can append to the dataset without coordinating. Any previous output for the file is replaced.
+    trust_labelling selects the output of a dual_labelling extractor and procedure_details_path moves the procedure details to a sidecar (see OrdExtractor.to_parquet).
+    """
+    partition_path = get_partition_path(dataset_path, filename)
+    if partition_path.exists():
+        shutil.rmtree(partition_path)
+    partition_path.mkdir(parents=True)
+    part_path = partition_path / "part-0.parquet"
+    instance.to_parquet(
+        part_path,
+        dataset_format=True,
+        trust_labelling=trust_labelling,
+        procedure_details_path=procedure_details_path,
+    )
+    return part_path
+
+
+def get_dataset_schema(dataset_path: pathlib.Path) -> pa.Schema:
+    """The union of the columns of all the partitions (sorted by name, like the extracted tables)"""
+    schemas = [
+        pq.read_schema(file)
+        for partition_path in get_partition_paths(dataset_path)
+        for file in sorted(partition_path.glob("*.parquet"))
+    ]
+    schema = pa.unify_schemas(schemas)
+    return pa.schema(sorted(schema, key=lambda field: field.name))
+
+
+def compact_dataset(
+    dataset_path: pathlib.Path,
+    missing_value: Optional[str] = "<missing>",
+    row_group_size: int = ROW_GROUP_SIZE,
+) -> pa.Schema:
+    """
+    Rewrites every partition as a single file with the schema of the whole dataset, so a reader can scan the dataset in one go (in the wide format the partitions have different numbers of molecule columns, which are added as missing).
+    Partitions that already have one file with the dataset schema are left alone.
+    """
+    dataset_path = pathlib.Path(dataset_path)
+    schema = get_dataset_schema(dataset_path)
+    rewritten = 0
+    for partition_path in get_partition_paths(dataset_path):
+        files = sorted(partition_path.glob("*.parquet"))
+        if len(files) == 1 and pq.read_schema(files[0]).equals(schema):
+            continue
+        table = pa.concat_tables(
+            orderly.extract.extractor.OrdExtractor.pad_to_schema(
+                pq.read_table(file), schema, missing_value
+            )
+            for file in files
+        )
+        compacted_path = partition_path / "part-0.parquet.tmp"
+        pq.write_table(
+            table,
+            compacted_path,
+            **get_write_options(schema, row_group_size=row_group_size),
+        )
+        for file in files:
+            file.unlink()
+        compacted_path.rename(partition_path / "part-0.parquet")
+        rewritten += 1
+    LOG.info(
+        f"Compacted {rewritten} partitions of {dataset_path} to {len(schema)} columns"
+    )
+    return schema
+
+
+def read_dataset(
+    dataset_path: pathlib.Path,
+    filter: Optional[pa_ds.Expression] = None,
+    columns: Optional[List[str]] = None,
+    exclude_columns: Sequence[str] = (),
+) -> pa.Table:
+    """
+    Reads the (compacted) dataset in one scan, in the order of the partitions. Filters on source_file (the name of the ORD file) only read the matching partitions, and min/max statistics let other filters skip row groups.
+    By default the columns of the extracted tables are read, except exclude_columns (e.g. orderly.extract.procedures.TEXT_COLUMNS), source_file is only returned if it is asked for in columns.
+    """
+    dataset = pa_ds.dataset(
+        [
+            str(file)
+            for partition_path in get_partition_paths(dataset_path)
+            for file in sorted(partition_path.glob("*.parquet"))
+        ],
+        format="parquet",
+        partitioning=pa_ds.partitioning(
+            pa.schema([(PARTITION_KEY, pa.string())]), flavor="hive"
+        ),
+        partition_base_dir=str(dataset_path),
+    )
+    if columns is None:
+        columns = [
+            name
+            for name in dataset.schema.names
+            if name != PARTITION_KEY and name not in exclude_columns
+        ]
+    return dataset.to_table(filter=filter, columns=columns)
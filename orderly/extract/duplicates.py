@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import pathlib
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import orderly.extract.dataset
+import orderly.extract.extractor
+from orderly.types import *
+
+LOG = logging.getLogger(__name__)
+
+REACTION_HASH_COLUMN = "reaction_hash"
+# the columns the hash is computed from (with the products and their yields), the molecules of each type are sorted so their order doesn't matter
+REACTION_HASH_MOLECULE_COLUMNS = (
+    "reactant",
+    "agent",
+    "reagent",
+    "solvent",
+    "catalyst",
+)
+
+
+def hash_reaction(
+    molecules: Sequence[Sequence[MOLECULE_IDENTIFIER]],
+    products: PRODUCTS,
+    yields: YIELDS,
+    temperature: Optional[TEMPERATURE_CELCIUS],
+    rxn_time: Optional[RXN_TIME],
+) -> str:
+    """
+    An order invariant hash of the molecules of a reaction (one list per column of REACTION_HASH_MOLECULE_COLUMNS), the yield of each product and the conditions.
+    The rxn string is not hashed, as the same reaction is often mapped differently in different patents.
+    """
+    key = json.dumps(
+        [
+            [sorted(mols) for mols in molecules],
+            sorted(zip(products, yields), key=lambda item: (item[0], str(item[1]))),
+            temperature,
+            rxn_time,
+        ],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def get_reaction_hashes(
+    data_lists: "orderly.extract.extractor.RXN_LISTS",
+) -> List[str]:
+    """The hash_reaction of each reaction in the rxn lists of an extraction"""
+    return [
+        hash_reaction(
+            [data_lists[col][i] for col in REACTION_HASH_MOLECULE_COLUMNS],  # type: ignore
+            products=data_lists["product"][i],  # type: ignore
+            yields=data_lists["yield"][i],  # type: ignore
+            temperature=data_lists["temperature"][i],  # type: ignore
+            rxn_time=data_lists["rxn_time"][i],  # type: ignore
+        )
+        for i in range(len(data_lists["rxn_str"]))
+    ]
+
+
+def get_output_files(extracted_ords_path: pathlib.Path) -> List[pathlib.Path]:
+    """The parquet files of an extraction (a file per dataset, or the files of each partition of a dataset), sorted by name"""
+    extracted_ords_path = pathlib.Path(extracted_ords_path)
+    if orderly.extract.dataset.is_dataset(extracted_ords_path):
+        return [
+            file
+            for partition_path in orderly.extract.dataset.get_partition_paths(
+                extracted_ords_path
+            )
+            for file in sorted(partition_path.glob("*.parquet"))
+        ]
+    return sorted(extracted_ords_path.glob("*.parquet"))
+
+
+def drop_duplicate_reactions(
+    files: List[pathlib.Path],
+    report_path: Optional[pathlib.Path] = None,
+) -> Dict[str, int]:
+    """
+    Removes every reaction whose REACTION_HASH_COLUMN was seen before, in the order of files (and of the rows in each file), so the first occurrence is kept whatever order the files were extracted in.
+    Only the hash column is read to find the duplicates, and only the files with duplicates are rewritten (one row group at a time). Returns the number of duplicates removed from each file, which is also saved at report_path (json) if given.
+    """
+    seen: Set[str] = set()
+    duplicates: Dict[str, int] = {}
+    for file in files:
+        hashes = pq.read_table(file, columns=[REACTION_HASH_COLUMN]).column(
+            REACTION_HASH_COLUMN
+        )
+        keep = []
+        for reaction_hash in hashes.to_pylist():
+            keep.append(reaction_hash not in seen)
+            seen.add(reaction_hash)
+        num_duplicates = keep.count(False)
+        if num_duplicates == 0:
+            continue
+        duplicates[str(file)] = num_duplicates
+
+        parquet_file = pq.ParquetFile(file)
+        schema = parquet_file.schema_arrow
+        write_options: Dict[str, Any] = {}
+        if file.parent.name.startswith(f"{orderly.extract.dataset.PARTITION_KEY}="):
+            write_options = orderly.extract.dataset.get_write_options(schema)
+        deduplicated_path = file.with_suffix(".parquet.tmp")
+        writer = pq.ParquetWriter(deduplicated_path, schema, **write_options)
+        start = 0
+        for batch in parquet_file.iter_batches():
+            mask = pa.array(keep[start : start + batch.num_rows], type=pa.bool_())
+            writer.write_table(pa.Table.from_batches([batch]).filter(mask))
+            start += batch.num_rows
+        writer.close()
+        deduplicated_path.replace(file)
+
+    total = sum(duplicates.values())
+    LOG.info(
+        f"Removed {total} duplicate reactions from {len(duplicates)} of {len(files)} files, {len(seen)} distinct reactions"
+    )
+    if report_path is not None:
+        with open(report_path, "w") as f:
+            json.dump(
+                {"total": total, "distinct": len(seen), "files": duplicates},
+                f,
+                indent=4,
+            )
+    return duplicates
@@ -1,24 +1,182 @@
 import logging
-from typing import List, Dict, Tuple, Set, Optional, Union, Any
+from typing import (
+    List,
+    Dict,
+    Tuple,
+    Set,
+    Optional,
+    Union,
+    Any,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Sequence,
+)
+import gzip
+import hashlib
 import pathlib
+import pickle
 import dataclasses
 import warnings
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 from ord_schema import message_helpers as ord_message_helpers
 from ord_schema.proto import dataset_pb2 as ord_dataset_pb2
 from ord_schema.proto import reaction_pb2 as ord_reaction_pb2
 
-from rdkit import Chem as rdkit_Chem
 from rdkit.rdBase import BlockLogs as rdkit_BlockLogs
 
+import orderly.extract.annotations
 import orderly.extract.defaults
 import orderly.extract.canonicalise
+import orderly.extract.dataset
+import orderly.extract.duplicates
+import orderly.extract.manifest
+import orderly.extract.procedures
+import orderly.extract.profiling
+import orderly.extract.reaction_filter
+import orderly.extract.store
 from orderly.types import *
 
 LOG = logging.getLogger(__name__)
 
+RXN_LISTS = Dict[
+    str,
+    Union[
+        List[Optional[RXN_STR]],
+        List[REACTANTS],
+        List[AGENTS],
+        List[REAGENTS],
+        List[SOLVENTS],
+        List[CATALYSTS],
+        List[Optional[TEMPERATURE_CELCIUS]],
+        List[Optional[RXN_TIME]],
+        List[PRODUCTS],
+        List[YIELDS],
+        List[str],
+        List[Optional[pd.Timestamp]],
+        List[bool],
+        List[int],
+    ],
+]
+
+EXTRACTED_REACTION = Tuple[
+    REACTANTS,
+    AGENTS,
+    REAGENTS,
+    SOLVENTS,
+    CATALYSTS,
+    PRODUCTS,
+    YIELDS,
+    Optional[TEMPERATURE_CELCIUS],
+    Optional[RXN_TIME],
+    Optional[RXN_STR],
+    str,
+    Optional[pd.Timestamp],
+    bool,
+    List[MOLECULE_IDENTIFIER],
+]
+
+
+class ReactionSources(NamedTuple):
+    """The data of a reaction that doesn't depend on trust_labelling: the labelled molecules of rxn.inputs and rxn.outcomes, the rxn string and the conditions"""
+
+    labelled_reactants: REACTANTS
+    labelled_reagents: REAGENTS
+    labelled_solvents: SOLVENTS
+    labelled_catalysts: CATALYSTS
+    labelled_products: PRODUCTS
+    yields: YIELDS
+    ice_present: bool
+    rxn_str: Optional[RXN_STR]
+    is_mapped: bool
+    procedure_details: str
+    date_of_experiment: Optional[pd.Timestamp]
+    rxn_time: Optional[RXN_TIME]
+    temperature: Optional[TEMPERATURE_CELCIUS]
+    non_smiles_names_list: List[MOLECULE_IDENTIFIER]
+
+
+_DATASET_REACTIONS_FIELD = ord_dataset_pb2.Dataset.DESCRIPTOR.fields_by_name[
+    "reactions"
+].number
+_DATASET_NAME_FIELD = ord_dataset_pb2.Dataset.DESCRIPTOR.fields_by_name["name"].number
+
+
+def _read_varint(f: Any) -> Optional[int]:
+    """Reads a protobuf varint from a binary file, returns None at the end of the file"""
+    result = 0
+    shift = 0
+    while True:
+        b = f.read(1)
+        if len(b) == 0:
+            if shift == 0:
+                return None
+            raise ValueError("Truncated varint in protobuf message")
+        result |= (b[0] & 0x7F) << shift
+        if b[0] < 0x80:
+            return result
+        shift += 7
+
+
+def _encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _iter_serialised_dataset_fields(
+    ord_file_path: Union[str, pathlib.Path], skip_field: Optional[int] = None
+) -> Iterator[Tuple[int, int, Optional[bytes]]]:
+    """
+    Iterates over the top level fields of a binary (optionally gzipped) Dataset message without parsing the whole message.
+    Yields (field_number, wire_type, serialised value); the value is None for fields numbered skip_field, which are skipped over rather than read into memory.
+    """
+    ord_file_path = str(ord_file_path)
+    if not (ord_file_path.endswith(".pb.gz") or ord_file_path.endswith(".pb")):
+        e = ValueError(
+            f"Can only stream binary ORD files (.pb or .pb.gz), got {ord_file_path}"
+        )
+        LOG.error(e)
+        raise e
+    this_open = gzip.open if ord_file_path.endswith(".gz") else open
+    with this_open(ord_file_path, "rb") as f:
+        while True:
+            tag = _read_varint(f)
+            if tag is None:
+                return
+            field_number, wire_type = tag >> 3, tag & 0x7
+            if wire_type == 0:
+                yield field_number, wire_type, None
+                _read_varint(f)
+                continue
+            elif wire_type == 1:
+                length = 8
+            elif wire_type == 2:
+                length = _read_varint(f)  # type: ignore
+            elif wire_type == 5:
+                length = 4
+            else:
+                e = ValueError(f"Unsupported wire type {wire_type} in {ord_file_path}")
+                LOG.error(e)
+                raise e
+            if field_number == skip_field:
+                f.seek(length, 1)
+                yield field_number, wire_type, None
+            else:
+                yield field_number, wire_type, f.read(length)
+
 
 def strip_filename(filename: str, replacements: List[Tuple[str, str]]) -> str:
     for _from, _to in replacements:
@@ -42,33 +200,79 @@ class OrdExtractor:
     filename: Optional[str] = None
     contains_substring: Optional[str] = None  # typically: None or uspto
     inverse_contains_substring: bool = False
+    canonicalisation_store_path: Optional[pathlib.Path] = None
+    reaction_chunk_size: Optional[int] = None
+    # if set, the reactions are streamed and extracted batch_size at a time when writing with to_parquet
+    batch_size: Optional[int] = None
+    # folder with a cache of extracted reactions per dataset, only new or changed reactions are extracted
+    reaction_cache_path: Optional[pathlib.Path] = None
+    # one list column per molecule type (reactant, agent, ...) instead of one column per molecule (reactant_000, ...)
+    list_columns: bool = False
+    # the value of missing molecules in the output, None gives real nulls
+    missing_value: Optional[str] = "<missing>"
+    # also extract the reactions with the opposite trust_labelling in the same pass, see labelling_outputs
+    dual_labelling: bool = False
+    # drops the reactions that orderly.clean would drop while they are extracted, the counts are in reaction_filter.dropped
+    reaction_filter: Optional[orderly.extract.reaction_filter.ReactionFilter] = None
+    # adds the order invariant hash of each reaction, see orderly.extract.duplicates
+    reaction_hashes: bool = False
+    # the already loaded contents of ord_file_path (e.g. from an orderly.extract.prefetch.PrefetchingReader), ignored with batch_size
+    preloaded_data: Optional[ord_dataset_pb2.Dataset] = None
+    # limits on the identifiers that are canonicalised, see orderly.extract.canonicalise.CostLimits; None keeps the limits of the process
+    cost_limits: Optional[orderly.extract.canonicalise.CostLimits] = None
+    # adds the row id of each reaction, which keys the procedure details sidecar, see orderly.extract.procedures
+    row_ids: bool = False
 
     def __post_init__(self) -> None:
         """loads in the data from the file and runs the extraction code to build the dataframe"""
 
         LOG.debug(f"Extracting data from {self.ord_file_path}")
-        self.data = OrdExtractor.load_data(self.ord_file_path)
+        self.num_reactions: Optional[int] = None
+        self.non_smiles_names_list = None
+        self.full_table: Optional[pa.Table] = None
+        # trust_labelling -> (table, non-SMILES names), has both values with dual_labelling
+        self.labelling_outputs: Dict[
+            bool, Tuple[pa.Table, List[MOLECULE_IDENTIFIER]]
+        ] = {}
+        if self.dual_labelling and (
+            self.batch_size is not None or self.reaction_cache_path is not None
+        ):
+            e = ValueError(
+                "dual_labelling can't be combined with batch_size or reaction_cache_path"
+            )
+            LOG.error(e)
+            raise e
+        if self.reaction_filter is not None and self.reaction_cache_path is not None:
+            # the cache holds the extracted reactions, so the dropped reactions could not be counted
+            e = ValueError("reaction_filter can't be combined with reaction_cache_path")
+            LOG.error(e)
+            raise e
+        if self.reaction_filter is not None:
+            # the counts are per dataset
+            self.reaction_filter = self.reaction_filter.without_counts()
+
+        # filter on the name in the header before parsing the reactions
+        if self.contains_substring is not None:
+            filename = self.filename
+            if filename is None:
+                filename = OrdExtractor.peek_filename(self.ord_file_path)
+            if filename is not None and OrdExtractor.is_filtered_out(
+                filename, self.contains_substring, self.inverse_contains_substring
+            ):
+                self.filename = filename
+                self.filtered_out = True
+                LOG.debug(f"Skipping {self.ord_file_path}: {self.filename}")
+                return
+
+        if self.batch_size is None and self.preloaded_data is not None:
+            self.data = self.preloaded_data
+        elif self.batch_size is None:
+            self.data = OrdExtractor.load_data(self.ord_file_path)
+        else:
+            self.data, self.num_reactions = OrdExtractor.load_header(self.ord_file_path)
 
         if self.filename is None:
-            self.filename = str(self.data.name)
-
-            self.filename = strip_filename(
-                self.filename,
-                replacements=[
-                    ("/", "-fs-"),
-                    (":", ""),
-                    (" ", "_"),
-                    (".", "-"),
-                    ('"', ""),
-                    ("'", ""),
-                ],
-            ).lower()
-
-            if self.filename == "":
-                LOG.debug(
-                    f"No file name for dataset so using dataset_id={self.data.dataset_id}"
-                )
-                self.filename = str(self.data.dataset_id)
+            self.filename = OrdExtractor.get_filename(self.data)
 
             self.dataset_id = self.data.dataset_id
             if self.dataset_id is None:
@@ -80,27 +284,37 @@ class OrdExtractor:
         if len(_grant_date) > 1:
             self.grant_date = pd.to_datetime(_grant_date[1], format="%Y_%M")
 
-        self.non_smiles_names_list = self.full_df = None
-        if self.contains_substring is not None:
-            to_skip = self.contains_substring.lower() not in self.filename.lower()
-            reason = "contains"
-            if self.inverse_contains_substring:
-                to_skip = not to_skip
-                reason = "does not contain"
-            reason += f" {self.contains_substring.lower()}"
-            if to_skip:
-                LOG.debug(
-                    f"Skipping {self.ord_file_path}: {self.filename} as filename {reason}"
-                )
-                return
+        self.filtered_out = OrdExtractor.is_filtered_out(
+            self.filename, self.contains_substring, self.inverse_contains_substring
+        )
+        if self.filtered_out:
+            LOG.debug(f"Skipping {self.ord_file_path}: {self.filename}")
+            return
 
         if self.solvents_set is None:
             self.solvents_set = orderly.extract.defaults.get_solvents_set()
-        self.full_df, self.non_smiles_names_list = self.build_full_df()
+        if self.cost_limits is not None:
+            orderly.extract.canonicalise.configure_cost_limits(self.cost_limits)
+        if self.batch_size is not None:
+            LOG.debug(
+                f"Streaming {self.num_reactions} reactions from {self.ord_file_path} in batches of {self.batch_size}"
+            )
+            return
+
+        if self.canonicalisation_store_path is not None:
+            orderly.extract.canonicalise.attach_store(self.canonicalisation_store_path)
+        self.labelling_outputs = self.build_full_tables()
+        (
+            self.full_table,
+            self.non_smiles_names_list,
+        ) = self.labelling_outputs[self.trust_labelling]
+        if self.canonicalisation_store_path is not None:
+            orderly.extract.canonicalise.flush_store()
 
         LOG.debug(f"Got data from {self.ord_file_path}: {self.filename}")
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def load_data(ord_file_path: Union[str, pathlib.Path]) -> ord_dataset_pb2.Dataset:
         """
         Simply loads the ORD data.
@@ -109,28 +323,152 @@ class OrdExtractor:
             ord_file_path = str(ord_file_path)
         return ord_message_helpers.load_message(ord_file_path, ord_dataset_pb2.Dataset)
 
+    @staticmethod
+    def iter_reactions(
+        ord_file_path: Union[str, pathlib.Path]
+    ) -> Iterator[ord_reaction_pb2.Reaction]:
+        """
+        Yields the reactions of a binary ORD file one at a time, so the whole dataset is never held in memory.
+        """
+        for field_number, _, value in _iter_serialised_dataset_fields(ord_file_path):
+            if field_number == _DATASET_REACTIONS_FIELD:
+                assert value is not None
+                yield ord_reaction_pb2.Reaction.FromString(value)
+
+    @staticmethod
+    def load_header(
+        ord_file_path: Union[str, pathlib.Path]
+    ) -> Tuple[ord_dataset_pb2.Dataset, int]:
+        """
+        Loads a Dataset with everything but the reactions (name, description, dataset_id, ...) and the number of reactions, without parsing the reactions.
+        """
+        header_bytes = b""
+        num_reactions = 0
+        for field_number, wire_type, value in _iter_serialised_dataset_fields(
+            ord_file_path, skip_field=_DATASET_REACTIONS_FIELD
+        ):
+            if field_number == _DATASET_REACTIONS_FIELD:
+                num_reactions += 1
+            elif wire_type == 2:  # all the other fields of a Dataset are strings
+                assert value is not None
+                header_bytes += (
+                    _encode_varint((field_number << 3) | wire_type)
+                    + _encode_varint(len(value))
+                    + value
+                )
+        return ord_dataset_pb2.Dataset.FromString(header_bytes), num_reactions
+
+    @staticmethod
+    def peek_filename(ord_file_path: Union[str, pathlib.Path]) -> Optional[str]:
+        """
+        The filename (see get_filename) of a binary ORD file, read from its header without parsing the reactions. The dataset name is serialised before the reactions, so only the start of the file is read (unless the dataset has no name, then the reactions are skipped over to get the dataset_id).
+        Returns None if the file isn't a binary ORD file (e.g. .pbtxt), which can only be filtered after it is loaded.
+        """
+        ord_file_path = str(ord_file_path)
+        if not (ord_file_path.endswith(".pb.gz") or ord_file_path.endswith(".pb")):
+            return None
+        header = ord_dataset_pb2.Dataset()
+        for field_number, wire_type, value in _iter_serialised_dataset_fields(
+            ord_file_path, skip_field=_DATASET_REACTIONS_FIELD
+        ):
+            if field_number == _DATASET_REACTIONS_FIELD or wire_type != 2:
+                continue
+            assert value is not None
+            header.MergeFromString(
+                _encode_varint((field_number << 3) | wire_type)
+                + _encode_varint(len(value))
+                + value
+            )
+            if field_number == _DATASET_NAME_FIELD and header.name != "":
+                break
+        return OrdExtractor.get_filename(header)
+
+    @staticmethod
+    def get_filename(data: ord_dataset_pb2.Dataset) -> str:
+        """
+        The name used for the output files of a dataset, this is the dataset name made filesystem safe, or the dataset_id if there is no name.
+        """
+        filename = strip_filename(
+            str(data.name),
+            replacements=[
+                ("/", "-fs-"),
+                (":", ""),
+                (" ", "_"),
+                (".", "-"),
+                ('"', ""),
+                ("'", ""),
+            ],
+        ).lower()
+
+        if filename == "":
+            LOG.debug(f"No file name for dataset so using dataset_id={data.dataset_id}")
+            filename = str(data.dataset_id)
+        return filename
+
+    @staticmethod
+    def is_filtered_out(
+        filename: str,
+        contains_substring: Optional[str],
+        inverse_contains_substring: bool = False,
+    ) -> bool:
+        """
+        Whether a dataset should be skipped because its filename does (or with inverse_contains_substring, does not) contain contains_substring
+        """
+        if contains_substring is None:
+            return False
+        to_skip = contains_substring.lower() not in filename.lower()
+        reason = "does not contain"
+        if inverse_contains_substring:
+            to_skip = not to_skip
+            reason = "contains"
+        if to_skip:
+            LOG.debug(f"{filename} filtered out as it {reason} {contains_substring}")
+        return to_skip
+
+    @staticmethod
+    def canonicalise_molecules(
+        identifier: MOLECULE_IDENTIFIER, is_mapped: bool = False
+    ) -> Tuple[List[SMILES | MOLECULE_IDENTIFIER], List[MOLECULE_IDENTIFIER]]:
+        """
+        Splits an identifier of rxn.inputs or rxn.outcomes into its molecules from a single parse: the fragments of its canonical SMILES (stripping mapping info if is_mapped is True).
+        If the identifier is unresolvable, its own fragments are canonicalised instead, and kept as given if they are unresolvable too. Returns the molecules and the non-SMILES names (the unresolvable identifier and fragments).
+        """
+        with orderly.extract.profiling.stage("canonicalise"):
+            canon_smi = orderly.extract.canonicalise.get_molecule_info(
+                identifier, is_mapped=is_mapped
+            ).canonical_smiles
+            if canon_smi is not None:
+                return canon_smi.split("."), []
+            fragments = identifier.split(".")
+            if len(fragments) == 1:
+                return fragments, [identifier]
+            molecules: List[SMILES | MOLECULE_IDENTIFIER] = []
+            non_smiles_names_list = [identifier]
+            for fragment in fragments:
+                canon_fragment = orderly.extract.canonicalise.get_molecule_info(
+                    fragment, is_mapped=is_mapped
+                ).canonical_smiles
+                if canon_fragment is None:
+                    molecules.append(fragment)
+                    non_smiles_names_list.append(fragment)
+                else:
+                    molecules.append(canon_fragment)
+            return molecules, non_smiles_names_list
+
     @staticmethod
     def find_smiles(
         identifiers: REPEATEDCOMPOSITECONTAINER,
         consider_molecule_names: bool = False,
-    ) -> Tuple[Optional[SMILES | MOLECULE_IDENTIFIER], List[MOLECULE_IDENTIFIER]]:
+        is_mapped: bool = False,
+    ) -> Tuple[Optional[List[SMILES | MOLECULE_IDENTIFIER]], List[MOLECULE_IDENTIFIER]]:
         """
-        Search through the identifiers to return a smiles string, if this doesn't exist, search to return the English name, and if this doesn't exist, return None
+        Search through the identifiers to return the molecules of the smiles string (see canonicalise_molecules), if this doesn't exist, search to return the English name, and if this doesn't exist, return None
         """
 
-        non_smiles_names_list = (
-            []
-        )  # we dont require information on state of this object so can create a new one
         _ = rdkit_BlockLogs()
         for i in identifiers:
             if i.type == 2:
-                canon_smi = orderly.extract.canonicalise.get_canonicalised_smiles(
-                    i.value, is_mapped=False
-                )
-                if canon_smi is None:
-                    canon_smi = i.value
-                    non_smiles_names_list.append(i.value)
-                return canon_smi, non_smiles_names_list
+                return OrdExtractor.canonicalise_molecules(i.value, is_mapped)
 
         if consider_molecule_names:
             for ii in identifiers:  # if there's no smiles, return the name
@@ -145,17 +483,15 @@ class OrdExtractor:
                 ## non_smiles_names_list.append(name)
                 # However, at least once, in the case of "II" (diiodine), the smiles string was recorded as a name, which breaks everything downstream.
                 if ii.type == 6:
-                    canon_smi = orderly.extract.canonicalise.get_canonicalised_smiles(
-                        ii.value, is_mapped=False
-                    )
-                    if canon_smi is not None:
+                    (
+                        molecules,
+                        non_smiles_names_list,
+                    ) = OrdExtractor.canonicalise_molecules(ii.value, is_mapped)
+                    if len(non_smiles_names_list) == 0:
                         LOG.info(f"SMILES string found labelled as name: {ii.value}")
-                    else:
-                        canon_smi = ii.value
-                        non_smiles_names_list.append(ii.value)
-                    return canon_smi, non_smiles_names_list
+                    return molecules, non_smiles_names_list
 
-        return None, non_smiles_names_list
+        return None, []
 
     @staticmethod
     def get_rxn_string_and_is_mapped(
@@ -180,6 +516,7 @@ class OrdExtractor:
             return None
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def extract_info_from_rxn_str(
         rxn_str: RXN_STR, is_mapped: bool
     ) -> Tuple[REACTANTS, AGENTS, PRODUCTS, RXN_STR, List[MOLECULE_IDENTIFIER]]:
@@ -201,39 +538,37 @@ class OrdExtractor:
         del product_from_rxn
 
         non_smiles_names_list: List[MOLECULE_IDENTIFIER] = []
+
+        def canonicalise(
+            smiles_list: List[MOLECULE_IDENTIFIER],
+        ) -> Tuple[List[CANON_SMILES], List[Optional[bool]]]:
+            """Parses each molecule once, returning the canonical SMILES (or the identifier if unresolvable) and whether it is atom mapped"""
+            canon_smiles_list = []
+            has_atom_map_list = []
+            for smi in smiles_list:
+                with orderly.extract.profiling.stage("canonicalise"):
+                    info = orderly.extract.canonicalise.get_molecule_info(
+                        smi, is_mapped
+                    )
+                canon_smi = info.canonical_smiles
+                if canon_smi is None:
+                    canon_smi = smi
+                    non_smiles_names_list.append(smi)
+                canon_smiles_list.append(canon_smi)
+                has_atom_map_list.append(info.has_atom_map)
+            return canon_smiles_list, has_atom_map_list
+
         # We need molecules without maping info, so we can compare them to the products
-        reactants_from_rxn_without_mapping: CANON_REACTANTS = []
-        for smi in reactants_from_rxn:
-            canon_smi = orderly.extract.canonicalise.get_canonicalised_smiles(
-                smi, is_mapped
-            )
-            if canon_smi is None:
-                canon_smi = smi
-                non_smiles_names_list.append(smi)
-            reactants_from_rxn_without_mapping.append(canon_smi)
-        # assert len(reactants_from_rxn) == len(reactants_from_rxn_without_mapping)
-
-        products_from_rxn_without_mapping: CANON_PRODUCTS = []
-        for smi in products_from_rxn:
-            canon_smi = orderly.extract.canonicalise.get_canonicalised_smiles(
-                smi, is_mapped
-            )
-            if canon_smi is None:
-                canon_smi = smi
-                non_smiles_names_list.append(smi)
-            products_from_rxn_without_mapping.append(canon_smi)
-        # assert len(products_from_rxn) == len(products_from_rxn_without_mapping)
-
-        cleaned_agents: CANON_AGENTS = []
-        for smi in agents:
-            canon_smi = orderly.extract.canonicalise.get_canonicalised_smiles(
-                smi, is_mapped
-            )
-            if canon_smi is None:
-                canon_smi = smi
-                non_smiles_names_list.append(smi)
-            cleaned_agents.append(canon_smi)
-        # assert len(agents) == len(cleaned_agents)
+        reactants_from_rxn_without_mapping: CANON_REACTANTS
+        reactants_from_rxn_without_mapping, reactants_have_atom_map = canonicalise(
+            reactants_from_rxn
+        )
+        products_from_rxn_without_mapping: CANON_PRODUCTS
+        products_from_rxn_without_mapping, products_have_atom_map = canonicalise(
+            products_from_rxn
+        )
+        cleaned_agents: CANON_AGENTS
+        cleaned_agents, _ = canonicalise(agents)
 
         ############ Reaction participation logic
 
@@ -242,15 +577,12 @@ class OrdExtractor:
         # I.e. first check whether a reactant molecule has at least 1 mapped atom, and then check whether it appears in the products
         if is_mapped:
             reactants = []
-            for r_map, r_clean in zip(
-                reactants_from_rxn, reactants_from_rxn_without_mapping
+            for r_has_atom_map, r_clean in zip(
+                reactants_have_atom_map, reactants_from_rxn_without_mapping
             ):
-                # check reactant is mapped and also that it's not in the products
-                mol = rdkit_Chem.MolFromSmiles(r_map)
-                if mol != None:
-                    if any(
-                        atom.HasProp("molAtomMapNumber") for atom in mol.GetAtoms()
-                    ) and (  # any(generator)
+                # check reactant is mapped and also that it's not in the products (has_atom_map is None if the reactant couldn't be parsed)
+                if r_has_atom_map is not None:
+                    if r_has_atom_map and (
                         r_clean not in products_from_rxn_without_mapping
                     ):
                         reactants.append(r_clean)
@@ -261,15 +593,12 @@ class OrdExtractor:
             # Only the *mapped* products that also don't appear as reactants or agents should be trusted as products
             # I.e. first check whether a product molecule has at least 1 mapped atom, and then check whether it appears in the reactants or agents
             products = []
-            for p_map, p_clean in zip(
-                products_from_rxn, products_from_rxn_without_mapping
+            for p_has_atom_map, p_clean in zip(
+                products_have_atom_map, products_from_rxn_without_mapping
             ):
                 # check products is mapped and also that it's not already present in (reactants or agents)
-                mol = rdkit_Chem.MolFromSmiles(p_map)
-                if mol != None:
-                    if any(
-                        atom.HasProp("molAtomMapNumber") for atom in mol.GetAtoms()
-                    ) and (  # any(generator)
+                if p_has_atom_map is not None:
+                    if p_has_atom_map and (
                         (p_clean not in reactants_from_rxn_without_mapping)
                         and (p_clean not in cleaned_agents)
                     ):
@@ -306,8 +635,11 @@ class OrdExtractor:
         )
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def rxn_input_extractor(
-        rxn: ord_reaction_pb2.Reaction, consider_molecule_names: bool
+        rxn: ord_reaction_pb2.Reaction,
+        consider_molecule_names: bool,
+        is_mapped: bool = False,
     ) -> Tuple[
         REACTANTS,
         REAGENTS,
@@ -318,7 +650,7 @@ class OrdExtractor:
         List[MOLECULE_IDENTIFIER],
     ]:
         """
-        Extract reaction information from ORD input object (ord_reaction_pb2.Reaction.inputs)
+        Extract reaction information from ORD input object (ord_reaction_pb2.Reaction.inputs), the molecules are canonicalised (see find_smiles)
         """
         # loop through the keys (components) in the 'dict' style data struct. One key may contain multiple components/molecules.
         non_smiles_names_list = (
@@ -341,28 +673,29 @@ class OrdExtractor:
                 for identifier in identifiers:
                     if identifier.value.lower() in ["ice", "ice water"]:
                         ice_present = True
-                smiles, non_smiles_names_list_additions = OrdExtractor.find_smiles(
+                molecules, non_smiles_names_list_additions = OrdExtractor.find_smiles(
                     identifiers,
                     consider_molecule_names,
+                    is_mapped,
                 )
                 non_smiles_names_list += non_smiles_names_list_additions
-                if smiles is None:
+                if molecules is None:
                     LOG.debug(f"No smiles or english name found for {identifiers=}")
                     continue
                 if rxn_role == 1:  # NB: Reagents may be misclassified as reactants
-                    reactants += [r for r in smiles.split(".")]
+                    reactants += molecules
                 elif rxn_role == 2:  # reagent
-                    reagents += [r for r in smiles.split(".")]
+                    reagents += molecules
                 elif rxn_role == 3:  # solvent
-                    solvents += [r for r in smiles.split(".")]
+                    solvents += molecules
                 elif rxn_role == 4:  # catalyst
-                    catalysts += [r for r in smiles.split(".")]
+                    catalysts += molecules
                 elif rxn_role in [5, 6, 7]:
                     # 5=workup, 6=internal standard, 7=authentic standard. don't care about these
                     continue
                 elif rxn_role == 8:  # product
                     # there are typically no products recorded in rxn_role == 8, they're all stored in "outcomes"
-                    products += [r for r in smiles.split(".")]
+                    products += molecules
 
         return (
             sorted(reactants),
@@ -375,12 +708,14 @@ class OrdExtractor:
         )
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def rxn_outcomes_extractor(
         rxn: ord_reaction_pb2.Reaction,
         consider_molecule_names: bool,
+        is_mapped: bool = False,
     ) -> Tuple[PRODUCTS, YIELDS, List[MOLECULE_IDENTIFIER]]:
         """
-        Extract reaction information from ORD output object (ord_reaction_pb2.Reaction.outcomes)
+        Extract reaction information from ORD output object (ord_reaction_pb2.Reaction.outcomes), the products are canonicalised (see find_smiles)
         """
         # products & yield
         yields: YIELDS = []
@@ -392,11 +727,13 @@ class OrdExtractor:
             y = None
             identifiers = product.identifiers
             (
-                product_smiles,
+                product_molecules,
                 non_smiles_names_list_additions,
-            ) = OrdExtractor.find_smiles(identifiers, consider_molecule_names)
+            ) = OrdExtractor.find_smiles(
+                identifiers, consider_molecule_names, is_mapped
+            )
 
-            if product_smiles is None:
+            if product_molecules is None:
                 continue
 
             non_smiles_names_list += non_smiles_names_list_additions
@@ -410,7 +747,7 @@ class OrdExtractor:
             # We'll resolve this by moving the longest smiles string to the front of the list, then appending the yield to the front of the list, and padding with None to ensure that the lists are the same length
 
             # split the product string by dot and sort by descending length
-            product_list = sorted(product_smiles.split("."), key=len, reverse=True)
+            product_list = sorted(product_molecules, key=len, reverse=True)
 
             # create a list of the same length as product_list with y as the first value and None as the other values
             y_list = [y] + [None] * (len(product_list) - 1)
@@ -421,6 +758,7 @@ class OrdExtractor:
         return products, yields, non_smiles_names_list
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def temperature_extractor(
         rxn: ord_reaction_pb2.Reaction,
     ) -> Optional[TEMPERATURE_CELCIUS]:
@@ -455,6 +793,7 @@ class OrdExtractor:
         return None  # No temperature found
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def rxn_time_extractor(rxn: ord_reaction_pb2.Reaction) -> Optional[RXN_TIME]:
         if rxn.outcomes[0].reaction_time.units == 1:  # hour
             return RXN_TIME(round(float(rxn.outcomes[0].reaction_time.value), 2))
@@ -474,6 +813,7 @@ class OrdExtractor:
             return None  # no time found
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def procedure_details_extractor(
         rxn: ord_reaction_pb2.Reaction,
     ) -> str:  # TODO check does it return empty string or none
@@ -481,6 +821,7 @@ class OrdExtractor:
         return str(procedure_details)
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def date_of_experiment_extractor(
         rxn: ord_reaction_pb2.Reaction,
     ) -> Optional[pd.Timestamp]:
@@ -499,6 +840,7 @@ class OrdExtractor:
         return date_of_experiment
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def apply_replacements_dict(
         smiles_list: List[MOLECULE_IDENTIFIER],
         manual_replacements_dict: MANUAL_REPLACEMENTS_DICT,
@@ -516,6 +858,7 @@ class OrdExtractor:
         return smiles_list
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def match_yield_with_product(
         rxn_str_products: PRODUCTS,
         labelled_products: PRODUCTS,
@@ -543,6 +886,7 @@ class OrdExtractor:
             return rxn_str_products, reordered_yields
 
     @staticmethod
+    @orderly.extract.profiling.profiled
     def merge_to_agents(
         rxn_string_agents: Optional[AGENTS],
         catalysts: Optional[CATALYSTS],
@@ -585,7 +929,7 @@ class OrdExtractor:
         # Instead, let's move all agents that contain a transition metal centre to the front of the list
         agents = sorted(
             agents,
-            key=lambda x: orderly.extract.defaults.has_transition_metal(x),
+            key=orderly.extract.annotations.has_transition_metal,
             reverse=True,
         )
         # This way, we can decide in the cleaning script whether we want to scramble the order or use the fact that transition metals are first in the list to identify them as catalysts
@@ -593,49 +937,22 @@ class OrdExtractor:
         return agents, solvents
 
     @staticmethod
-    def handle_reaction_object(
-        rxn: ord_reaction_pb2.Reaction,
-        manual_replacements_dict: MANUAL_REPLACEMENTS_DICT,
-        solvents_set: Set[SOLVENT],
-        trust_labelling: bool = False,
-        consider_molecule_names: bool = False,
-        use_labelling_if_extract_fails: bool = True,
-        include_unadded_labelled_molecules_as_agents: bool = True,
-    ) -> Optional[
-        Tuple[
-            REACTANTS,
-            AGENTS,
-            REAGENTS,
-            SOLVENTS,
-            CATALYSTS,
-            PRODUCTS,
-            YIELDS,
-            Optional[TEMPERATURE_CELCIUS],
-            Optional[RXN_TIME],
-            Optional[RXN_STR],
-            str,
-            Optional[pd.Timestamp],
-            bool,
-            List[MOLECULE_IDENTIFIER],
-        ]
-    ]:
+    @orderly.extract.profiling.profiled
+    def get_reaction_sources(
+        rxn: ord_reaction_pb2.Reaction, consider_molecule_names: bool = False
+    ) -> ReactionSources:
         """
-        An ORD rxn object has 3 sources of rxn data: the rxn string, rxn.inputs, and rxn.outcomes.
-        If trust_labelling is True, we trust the labelling of the rxn.inputs and rxn.outcomes, and don't use the rxn string.
-        If trust_labelling is False (default), we determine reactants, agents, solvents, and products, from the rxn string by looking at the mapping of the reaction (hence why we trust the rxn string more than the inputs/outcomes labelling, and this behaviour is set to default). However, the rxn.inputs and rxn.outcomes may contain info not contained in the rxn string:
-            - If use_labelling_if_extract_fails is True, we use the labelling of the rxn.inputs and rxn.outcomes instead of simply returning None
-            - If include_unadded_labelled_molecules_as_agents is True, we look through the rxn.inputs for any agents that were not added to the reactants, agents, solvents, or products, and add them to the agents list
+        Extracts the labelled molecules (rxn.inputs and rxn.outcomes), the rxn string and the conditions of a reaction; these are the same whatever the value of trust_labelling, so they can be shared by handle_reaction_object calls for both values.
         """
-        # handle rxn inputs: reactants, reagents etc
-
-        # initilise empty
-        reactants: REACTANTS = []
-        reagents: REAGENTS = []
-        solvents: SOLVENTS = []
-        catalysts: CATALYSTS = []
-        labelled_products: PRODUCTS = []
         rxn_non_smiles_names_list = []
 
+        # A reaction object has 3 data-sources: rxn_string, rxn_inputs, and rxn_outcomes; these sources should be in agreement, but it's still important to have a robust idea of how to resolve any disagreements
+        _rxn_str = OrdExtractor.get_rxn_string_and_is_mapped(rxn)
+        if _rxn_str is None:
+            rxn_str, is_mapped = None, False
+        else:
+            rxn_str, is_mapped = _rxn_str
+
         (
             labelled_reactants,
             labelled_reagents,
@@ -644,14 +961,14 @@ class OrdExtractor:
             labelled_products_from_input,  # I'm not sure what to do with this, it doesn't make sense for people to have put a product as an input, so this list should be empty anyway
             ice_present,
             non_smiles_names_list_additions,
-        ) = OrdExtractor.rxn_input_extractor(rxn, consider_molecule_names)
+        ) = OrdExtractor.rxn_input_extractor(rxn, consider_molecule_names, is_mapped)
         rxn_non_smiles_names_list += non_smiles_names_list_additions
 
         (
             labelled_products,
             yields,
             non_smiles_names_list_additions,
-        ) = OrdExtractor.rxn_outcomes_extractor(rxn, consider_molecule_names)
+        ) = OrdExtractor.rxn_outcomes_extractor(rxn, consider_molecule_names, is_mapped)
         rxn_non_smiles_names_list += non_smiles_names_list_additions
 
         # This whole block is just to raise warnings incase the products in the input object look weird.
@@ -662,28 +979,78 @@ class OrdExtractor:
                 warnings.warn(
                     "The number of products in rxn.inputs and rxn.outcomes do not match"
                 )
-            for idx, (mol_id_from_input, mol_id_from_outcomes) in enumerate(
+            # both lists are canonical already (see find_smiles)
+            for idx, (smi_from_input, smi_from_outcomes) in enumerate(
                 zip(sorted(labelled_products_from_input), sorted(labelled_products))
             ):
-                smi_from_input = orderly.extract.canonicalise.get_canonicalised_smiles(
-                    mol_id_from_input, is_mapped=False
-                )
-                smi_from_outcomes = (
-                    orderly.extract.canonicalise.get_canonicalised_smiles(
-                        mol_id_from_outcomes, is_mapped=False
-                    )
-                )
                 if smi_from_input != smi_from_outcomes:
                     warnings.warn(
                         f"The smiles do not match for {idx=}: {smi_from_input=}!={smi_from_outcomes=}"
                     )
 
-        # A reaction object has 3 data-sources: rxn_string, rxn_inputs, and rxn_outcomes; these sources should be in agreement, but it's still important to have a robust idea of how to resolve any disagreements
-        _rxn_str = OrdExtractor.get_rxn_string_and_is_mapped(rxn)
-        if _rxn_str is None:
-            rxn_str, is_mapped = None, False
-        else:
-            rxn_str, is_mapped = _rxn_str
+        return ReactionSources(
+            labelled_reactants=labelled_reactants,
+            labelled_reagents=labelled_reagents,
+            labelled_solvents=labelled_solvents,
+            labelled_catalysts=labelled_catalysts,
+            labelled_products=labelled_products,
+            yields=yields,
+            ice_present=ice_present,
+            rxn_str=rxn_str,
+            is_mapped=is_mapped,
+            procedure_details=OrdExtractor.procedure_details_extractor(rxn),
+            date_of_experiment=OrdExtractor.date_of_experiment_extractor(rxn),
+            rxn_time=OrdExtractor.rxn_time_extractor(rxn),
+            temperature=OrdExtractor.temperature_extractor(rxn),
+            non_smiles_names_list=rxn_non_smiles_names_list,
+        )
+
+    @staticmethod
+    @orderly.extract.profiling.profiled
+    def handle_reaction_object(
+        rxn: ord_reaction_pb2.Reaction,
+        manual_replacements_dict: MANUAL_REPLACEMENTS_DICT,
+        solvents_set: Set[SOLVENT],
+        trust_labelling: bool = False,
+        consider_molecule_names: bool = False,
+        use_labelling_if_extract_fails: bool = True,
+        include_unadded_labelled_molecules_as_agents: bool = True,
+        sources: Optional[ReactionSources] = None,
+        reaction_filter: Optional[
+            orderly.extract.reaction_filter.ReactionFilter
+        ] = None,
+    ) -> Optional[EXTRACTED_REACTION]:
+        """
+        An ORD rxn object has 3 sources of rxn data: the rxn string, rxn.inputs, and rxn.outcomes.
+        If trust_labelling is True, we trust the labelling of the rxn.inputs and rxn.outcomes, and don't use the rxn string.
+        If trust_labelling is False (default), we determine reactants, agents, solvents, and products, from the rxn string by looking at the mapping of the reaction (hence why we trust the rxn string more than the inputs/outcomes labelling, and this behaviour is set to default). However, the rxn.inputs and rxn.outcomes may contain info not contained in the rxn string:
+            - If use_labelling_if_extract_fails is True, we use the labelling of the rxn.inputs and rxn.outcomes instead of simply returning None
+            - If include_unadded_labelled_molecules_as_agents is True, we look through the rxn.inputs for any agents that were not added to the reactants, agents, solvents, or products, and add them to the agents list
+        sources are the result of get_reaction_sources for the rxn (computed if None), see handle_reaction_object_for_labellings.
+        If a reaction_filter is given, reactions that fail it are counted in reaction_filter.dropped and None is returned. The reaction string is checked before anything is extracted, and the molecules as soon as they are final (after canonicalisation, the replacements and the removal of carbon next to transition metals).
+        """
+        if sources is None:
+            sources = OrdExtractor.get_reaction_sources(rxn, consider_molecule_names)
+        if reaction_filter is not None:
+            reason = reaction_filter.check_rxn_str(sources.is_mapped)
+            if reason is not None:
+                reaction_filter.drop(trust_labelling, reason)
+                return None
+
+        # initilise, the lists are copied as they are modified in place below and the sources may be shared
+        reactants: REACTANTS = []
+        reagents: REAGENTS = []
+        solvents: SOLVENTS = []
+        catalysts: CATALYSTS = []
+        labelled_reactants = list(sources.labelled_reactants)
+        labelled_reagents = list(sources.labelled_reagents)
+        labelled_solvents = list(sources.labelled_solvents)
+        labelled_catalysts = list(sources.labelled_catalysts)
+        labelled_products = list(sources.labelled_products)
+        yields = list(sources.yields)
+        ice_present = sources.ice_present
+        rxn_str, is_mapped = sources.rxn_str, sources.is_mapped
+        rxn_non_smiles_names_list = list(sources.non_smiles_names_list)
 
         # Get all the molecules
         if trust_labelling or (rxn_str is None and use_labelling_if_extract_fails):
@@ -780,82 +1147,7 @@ class OrdExtractor:
             x for x in rxn_non_smiles_names_list if not is_number(x)
         ]
 
-        def canonicalise_and_get_non_smiles_names(
-            mol_id_list: REACTANTS
-            | AGENTS
-            | REAGENTS
-            | SOLVENTS
-            | CATALYSTS
-            | PRODUCTS,
-            is_mapped: bool = False,
-        ) -> Tuple[
-            REACTANTS | AGENTS | REAGENTS | SOLVENTS | CATALYSTS | PRODUCTS,
-            List[MOLECULE_IDENTIFIER],
-        ]:
-            """Canonicalise the smiles and return the identifier (either SMILES or non-SMILES) as well as a list of non-SMILES names"""
-            assert isinstance(mol_id_list, list)
-            non_smiles_names_list_additions = []
-            for idx, mol_id in enumerate(mol_id_list):
-                smi = orderly.extract.canonicalise.get_canonicalised_smiles(
-                    mol_id, is_mapped=is_mapped
-                )
-                if smi is None:
-                    non_smiles_names_list_additions.append(mol_id)
-                    mol_id_list[idx] = mol_id
-                else:
-                    mol_id_list[idx] = smi
-            return mol_id_list, non_smiles_names_list_additions
-
-        # Reactants and products might be mapped, but agents are not
-        # TODO?: The canonicalisation is repeated! We extract information from rxn_str, and then apply logic to figure out what is a reactant/agent. So we canonicalise inside the extract_info_from_rxn_str function, but not within the input_extraction function, which is why we need to do it again here. This also means we add stuff to the non-smiles names list multiple times, so we need to do list(set()) on that list; all this is slightly inefficient, but shouldn't add that much overhead.
-        (
-            reactants,
-            non_smiles_names_list_additions,
-        ) = canonicalise_and_get_non_smiles_names(
-            mol_id_list=reactants, is_mapped=is_mapped
-        )
-        rxn_non_smiles_names_list += non_smiles_names_list_additions
-
-        (
-            agents,
-            non_smiles_names_list_additions,
-        ) = canonicalise_and_get_non_smiles_names(
-            mol_id_list=agents, is_mapped=is_mapped
-        )
-        rxn_non_smiles_names_list += non_smiles_names_list_additions
-
-        (
-            reagents,
-            non_smiles_names_list_additions,
-        ) = canonicalise_and_get_non_smiles_names(
-            mol_id_list=reagents, is_mapped=is_mapped
-        )
-        rxn_non_smiles_names_list += non_smiles_names_list_additions
-
-        (
-            solvents,
-            non_smiles_names_list_additions,
-        ) = canonicalise_and_get_non_smiles_names(
-            mol_id_list=solvents, is_mapped=is_mapped
-        )
-        rxn_non_smiles_names_list += non_smiles_names_list_additions
-
-        (
-            catalysts,
-            non_smiles_names_list_additions,
-        ) = canonicalise_and_get_non_smiles_names(
-            mol_id_list=catalysts, is_mapped=is_mapped
-        )
-        rxn_non_smiles_names_list += non_smiles_names_list_additions
-
-        (
-            products,
-            non_smiles_names_list_additions,
-        ) = canonicalise_and_get_non_smiles_names(
-            mol_id_list=products, is_mapped=is_mapped
-        )
-        rxn_non_smiles_names_list += non_smiles_names_list_additions
-
+        # The molecules are already canonical, see extract_info_from_rxn_str and find_smiles
         # Apply the manual_replacements_dict to the reactants, agents, reagents, solvents, and catalysts
         reactants = OrdExtractor.apply_replacements_dict(
             reactants, manual_replacements_dict=manual_replacements_dict
@@ -913,14 +1205,15 @@ class OrdExtractor:
                 )
                 return list(mol_id_list_without_none), list(_list_to_keep_order)
 
-        reactants, _ = remove_none_and_empty_str(reactants)
-        agents, _ = remove_none_and_empty_str(agents)
-        reagents, _ = remove_none_and_empty_str(reagents)
-        solvents, _ = remove_none_and_empty_str(solvents)
-        catalysts, _ = remove_none_and_empty_str(catalysts)
-        products, yields = remove_none_and_empty_str(
-            products, list_to_keep_order=yields
-        )
+        with orderly.extract.profiling.stage("remove_none_and_empty_str"):
+            reactants, _ = remove_none_and_empty_str(reactants)
+            agents, _ = remove_none_and_empty_str(agents)
+            reagents, _ = remove_none_and_empty_str(reagents)
+            solvents, _ = remove_none_and_empty_str(solvents)
+            catalysts, _ = remove_none_and_empty_str(catalysts)
+            products, yields = remove_none_and_empty_str(
+                products, list_to_keep_order=yields
+            )
 
         #### Secondary reaction participation checks before returning
         # The rxn participation logic we perform within extract_info_from_rxn_str is to identify our best guess of the reactants and products given the atom mapping. Following this, we add agents from the inputs, canonicalise, and apply the manual_replacements_dict, so we need to do another check here
@@ -995,36 +1288,37 @@ class OrdExtractor:
                     list(resolvable_names_alt_list + unresolvable_names_alt_list),
                 )
 
-        reactants, _ = move_unresolvable_names_to_end_of_list(
-            reactants, rxn_non_smiles_names_set
-        )
+        with orderly.extract.profiling.stage("move_unresolvable_names_to_end_of_list"):
+            reactants, _ = move_unresolvable_names_to_end_of_list(
+                reactants, rxn_non_smiles_names_set
+            )
 
-        products, _yields = move_unresolvable_names_to_end_of_list(
-            products, rxn_non_smiles_names_set, yields
-        )
-        agents, _ = move_unresolvable_names_to_end_of_list(
-            agents, rxn_non_smiles_names_set
-        )
-        reagents, _ = move_unresolvable_names_to_end_of_list(
-            reagents, rxn_non_smiles_names_set
-        )
-        solvents, _ = move_unresolvable_names_to_end_of_list(
-            solvents, rxn_non_smiles_names_set
-        )
-        catalysts, _ = move_unresolvable_names_to_end_of_list(
-            catalysts, rxn_non_smiles_names_set
-        )
+            products, _yields = move_unresolvable_names_to_end_of_list(
+                products, rxn_non_smiles_names_set, yields
+            )
+            agents, _ = move_unresolvable_names_to_end_of_list(
+                agents, rxn_non_smiles_names_set
+            )
+            reagents, _ = move_unresolvable_names_to_end_of_list(
+                reagents, rxn_non_smiles_names_set
+            )
+            solvents, _ = move_unresolvable_names_to_end_of_list(
+                solvents, rxn_non_smiles_names_set
+            )
+            catalysts, _ = move_unresolvable_names_to_end_of_list(
+                catalysts, rxn_non_smiles_names_set
+            )
 
         # NB this needs to be before the removal of [C] and C
-        procedure_details = OrdExtractor.procedure_details_extractor(rxn)
-        date_of_experiment = OrdExtractor.date_of_experiment_extractor(rxn)
-        rxn_time = OrdExtractor.rxn_time_extractor(rxn)
-        temperature = OrdExtractor.temperature_extractor(rxn)
+        procedure_details = sources.procedure_details
+        date_of_experiment = sources.date_of_experiment
+        rxn_time = sources.rxn_time
+        temperature = sources.temperature
 
         # Add paladium on carbon exception: Delete carbon if Pd exists. Expand exception to other transition metals
         def contains_transition_metal(agents: AGENTS) -> bool:
             for agent in agents:
-                if orderly.extract.defaults.has_transition_metal(agent):
+                if orderly.extract.annotations.has_transition_metal(agent):
                     return True
             return False
 
@@ -1034,9 +1328,26 @@ class OrdExtractor:
             return False
 
         # Check if any agent contains a transition metal
-        if contains_transition_metal(agents) or contains_charcoal(procedure_details):
-            # Remove "[C]" and "C" from agents
-            agents = [a for a in agents if a not in ["[C]", "C"]]
+        with orderly.extract.profiling.stage("transition_metal_checks"):
+            if contains_transition_metal(agents) or contains_charcoal(
+                procedure_details
+            ):
+                # Remove "[C]" and "C" from agents
+                agents = [a for a in agents if a not in ["[C]", "C"]]
+
+        if reaction_filter is not None:
+            reason = reaction_filter.check_molecules(
+                reactants,
+                agents,
+                reagents,
+                solvents,
+                catalysts,
+                products,
+                rxn_non_smiles_names_list,
+            )
+            if reason is not None:
+                reaction_filter.drop(trust_labelling, reason)
+                return None
 
         if _yields == []:
             _yields = [None] * len(products)
@@ -1049,11 +1360,12 @@ class OrdExtractor:
 
         # Move the catalysts with a transition metal to the front of the list
         # This will be useful in the cleaner if we have to rename the catalysts to reagents
-        catalysts = sorted(
-            catalysts,
-            key=lambda x: orderly.extract.defaults.has_transition_metal(x),
-            reverse=True,
-        )
+        with orderly.extract.profiling.stage("transition_metal_checks"):
+            catalysts = sorted(
+                catalysts,
+                key=orderly.extract.annotations.has_transition_metal,
+                reverse=True,
+            )
 
         return (
             reactants,
@@ -1072,33 +1384,49 @@ class OrdExtractor:
             rxn_non_smiles_names_list,
         )
 
-    def build_rxn_lists(
-        self,
-    ) -> Tuple[
-        Dict[
-            str,
-            Union[
-                List[Optional[RXN_STR]],
-                List[REACTANTS],
-                List[AGENTS],
-                List[REAGENTS],
-                List[SOLVENTS],
-                List[CATALYSTS],
-                List[Optional[TEMPERATURE_CELCIUS]],
-                List[Optional[RXN_TIME]],
-                List[PRODUCTS],
-                List[YIELDS],
-                List[str],
-                List[Optional[pd.Timestamp]],
-                List[bool],
-            ],
-        ],
-        List[MOLECULE_IDENTIFIER],
-    ]:
-        rxn_non_smiles_names_list: List[MOLECULE_IDENTIFIER] = []
+    @staticmethod
+    def get_reaction_key(rxn: ord_reaction_pb2.Reaction) -> Tuple[str, str]:
+        """
+        Returns (reaction_id, digest of the serialised reaction), the digest is used as the id if the reaction has no reaction_id
+        """
+        digest = hashlib.sha256(rxn.SerializeToString(deterministic=True)).hexdigest()
+        reaction_id = str(rxn.reaction_id)
+        if reaction_id == "":
+            reaction_id = digest
+        return reaction_id, digest
 
+    @staticmethod
+    def handle_reaction_object_for_labellings(
+        rxn: ord_reaction_pb2.Reaction,
+        manual_replacements_dict: MANUAL_REPLACEMENTS_DICT,
+        solvents_set: Set[SOLVENT],
+        trust_labellings: Sequence[bool],
+        consider_molecule_names: bool = False,
+        reaction_filter: Optional[
+            orderly.extract.reaction_filter.ReactionFilter
+        ] = None,
+    ) -> Dict[bool, Optional[EXTRACTED_REACTION]]:
+        """
+        Runs handle_reaction_object for each value of trust_labelling, the labelled molecules, rxn string and conditions are extracted once and shared (and the molecules are only canonicalised once, as the canonicalisation is cached).
+        """
+        sources = OrdExtractor.get_reaction_sources(rxn, consider_molecule_names)
+        return {
+            trust_labelling: OrdExtractor.handle_reaction_object(
+                rxn,
+                manual_replacements_dict=manual_replacements_dict,
+                solvents_set=solvents_set,
+                trust_labelling=trust_labelling,
+                consider_molecule_names=consider_molecule_names,
+                sources=sources,
+                reaction_filter=reaction_filter,
+            )
+            for trust_labelling in trust_labellings
+        }
+
+    @staticmethod
+    def _empty_rxn_lists() -> RXN_LISTS:
         # mypy struggles with the dict so we just ignore here
-        rxn_lists = {  # type: ignore
+        return {  # type: ignore
             "rxn_str": [],
             "reactant": [],
             "agent": [],
@@ -1112,54 +1440,500 @@ class OrdExtractor:
             "procedure_details": [],
             "date_of_experiment": [],
             "is_mapped": [],
+            # the ORD reaction_id and the position in the dataset, which give the row id (see orderly.extract.procedures.get_row_ids)
+            "reaction_id": [],
+            "reaction_index": [],
         }
 
-        assert self.solvents_set is not None
+    @staticmethod
+    def _append_extracted_reaction(
+        rxn_lists: RXN_LISTS,
+        extracted_reaction: EXTRACTED_REACTION,
+        rxn: ord_reaction_pb2.Reaction,
+        reaction_index: int,
+    ) -> List[MOLECULE_IDENTIFIER]:
+        """Appends the columns of an extracted reaction to rxn_lists, returns its non-SMILES names"""
+        (
+            reactants,
+            agents,
+            reagents,
+            solvents,
+            catalysts,
+            products,
+            yields,
+            temperature,
+            rxn_time,
+            rxn_str,
+            procedure_details,
+            date_of_experiment,
+            is_mapped,
+            rxn_non_smiles_names_list_additions,
+        ) = extracted_reaction
+
+        rxn_lists["rxn_str"].append(rxn_str)  # type: ignore
+        rxn_lists["reactant"].append(reactants)  # type: ignore
+        rxn_lists["agent"].append(agents)  # type: ignore
+        rxn_lists["reagent"].append(reagents)  # type: ignore
+        rxn_lists["solvent"].append(solvents)  # type: ignore
+        rxn_lists["catalyst"].append(catalysts)  # type: ignore
+        rxn_lists["temperature"].append(temperature)  # type: ignore
+        rxn_lists["rxn_time"].append(rxn_time)  # type: ignore
+        rxn_lists["product"].append(products)  # type: ignore
+        rxn_lists["yield"].append(yields)  # type: ignore
+        rxn_lists["procedure_details"].append(procedure_details)  # type: ignore
+        rxn_lists["date_of_experiment"].append(date_of_experiment)  # type: ignore
+        rxn_lists["is_mapped"].append(is_mapped)  # type: ignore
+        rxn_lists["reaction_id"].append(str(rxn.reaction_id))  # type: ignore
+        rxn_lists["reaction_index"].append(reaction_index)  # type: ignore
+        return rxn_non_smiles_names_list_additions
+
+    @staticmethod
+    def extract_reactions(
+        reactions: Iterable[ord_reaction_pb2.Reaction],
+        manual_replacements_dict: MANUAL_REPLACEMENTS_DICT,
+        solvents_set: Set[SOLVENT],
+        trust_labelling: bool,
+        consider_molecule_names: bool,
+        reaction_cache: Optional[orderly.extract.store.ReactionCache] = None,
+        reaction_filter: Optional[
+            orderly.extract.reaction_filter.ReactionFilter
+        ] = None,
+        start: int = 0,
+    ) -> Tuple[RXN_LISTS, List[MOLECULE_IDENTIFIER]]:
+        """
+        Runs handle_reaction_object on each reaction and collects the results into one list per column
+        If a reaction_cache is given, reactions that are unchanged since they were cached are taken from the cache rather than extracted again.
+        start is the position of the first reaction in the dataset (e.g. for a chunk of the reactions).
+        """
+        rxn_non_smiles_names_list: List[MOLECULE_IDENTIFIER] = []
+        rxn_lists = OrdExtractor._empty_rxn_lists()
+
+        for reaction_index, rxn in enumerate(reactions, start):
+            found = False
+            if reaction_cache is not None:
+                reaction_id, digest = OrdExtractor.get_reaction_key(rxn)
+                found, row = reaction_cache.get(reaction_id, digest)
+                if found:
+                    assert row is not None
+                    extracted_reaction = pickle.loads(row)
+            if not found:
+                extracted_reaction = OrdExtractor.handle_reaction_object(
+                    rxn,
+                    manual_replacements_dict=manual_replacements_dict,
+                    solvents_set=solvents_set,
+                    trust_labelling=trust_labelling,
+                    consider_molecule_names=consider_molecule_names,
+                    reaction_filter=reaction_filter,
+                )
+                if reaction_cache is not None:
+                    reaction_cache.put(
+                        reaction_id, digest, pickle.dumps(extracted_reaction)
+                    )
+            if extracted_reaction is None:
+                continue
+            rxn_non_smiles_names_list += OrdExtractor._append_extracted_reaction(
+                rxn_lists, extracted_reaction, rxn, reaction_index
+            )
 
-        for rxn in self.data.reactions:
-            extracted_reaction = OrdExtractor.handle_reaction_object(
+        return rxn_lists, rxn_non_smiles_names_list
+
+    @staticmethod
+    def extract_reactions_for_labellings(
+        reactions: Iterable[ord_reaction_pb2.Reaction],
+        manual_replacements_dict: MANUAL_REPLACEMENTS_DICT,
+        solvents_set: Set[SOLVENT],
+        trust_labellings: Sequence[bool],
+        consider_molecule_names: bool,
+        reaction_filter: Optional[
+            orderly.extract.reaction_filter.ReactionFilter
+        ] = None,
+        start: int = 0,
+    ) -> Dict[bool, Tuple[RXN_LISTS, List[MOLECULE_IDENTIFIER]]]:
+        """As extract_reactions, for each value of trust_labelling in one pass over the reactions (see handle_reaction_object_for_labellings)"""
+        results: Dict[bool, Tuple[RXN_LISTS, List[MOLECULE_IDENTIFIER]]] = {
+            trust_labelling: (OrdExtractor._empty_rxn_lists(), [])
+            for trust_labelling in trust_labellings
+        }
+        for reaction_index, rxn in enumerate(reactions, start):
+            extracted_reactions = OrdExtractor.handle_reaction_object_for_labellings(
                 rxn,
+                manual_replacements_dict=manual_replacements_dict,
+                solvents_set=solvents_set,
+                trust_labellings=trust_labellings,
+                consider_molecule_names=consider_molecule_names,
+                reaction_filter=reaction_filter,
+            )
+            for trust_labelling, extracted_reaction in extracted_reactions.items():
+                if extracted_reaction is None:
+                    continue
+                rxn_lists, rxn_non_smiles_names_list = results[trust_labelling]
+                rxn_non_smiles_names_list += OrdExtractor._append_extracted_reaction(
+                    rxn_lists, extracted_reaction, rxn, reaction_index
+                )
+        return results
+
+    @staticmethod
+    def _extract_serialised_reactions(
+        serialised_reactions: List[bytes],
+        manual_replacements_dict: MANUAL_REPLACEMENTS_DICT,
+        solvents_set: Set[SOLVENT],
+        trust_labellings: Sequence[bool],
+        consider_molecule_names: bool,
+        canonicalisation_store_path: Optional[pathlib.Path] = None,
+        reaction_cache_file: Optional[Tuple[pathlib.Path, str]] = None,
+        profile: bool = False,
+        reaction_filter: Optional[
+            orderly.extract.reaction_filter.ReactionFilter
+        ] = None,
+        cost_limits: Optional[orderly.extract.canonicalise.CostLimits] = None,
+        start: int = 0,
+    ) -> Tuple[
+        Dict[bool, Tuple[RXN_LISTS, List[MOLECULE_IDENTIFIER]]],
+        Optional[orderly.extract.profiling.PROFILE],
+        Dict[bool, Dict[str, int]],
+    ]:
+        """Worker for a chunk of reactions starting at position start in the dataset, the reactions are sent serialised as this is much cheaper to pickle. Returns the rxn lists and names for each value of trust_labelling, the stage timings of the chunk if profile is True, and the number of reactions dropped by the reaction_filter, so the parent can merge them"""
+        if profile:
+            with orderly.extract.profiling.collect() as profiler:
+                results, _, dropped = OrdExtractor._extract_serialised_reactions(
+                    serialised_reactions,
+                    manual_replacements_dict=manual_replacements_dict,
+                    solvents_set=solvents_set,
+                    trust_labellings=trust_labellings,
+                    consider_molecule_names=consider_molecule_names,
+                    canonicalisation_store_path=canonicalisation_store_path,
+                    reaction_cache_file=reaction_cache_file,
+                    reaction_filter=reaction_filter,
+                    cost_limits=cost_limits,
+                    start=start,
+                )
+                return results, profiler.snapshot(), dropped
+        if reaction_filter is not None:
+            # the worker may be the parent process, which merges the counts itself
+            reaction_filter = reaction_filter.without_counts()
+        if canonicalisation_store_path is not None:
+            orderly.extract.canonicalise.attach_store(canonicalisation_store_path)
+        if cost_limits is not None:
+            orderly.extract.canonicalise.configure_cost_limits(cost_limits)
+        reactions = (
+            ord_reaction_pb2.Reaction.FromString(serialised_reaction)
+            for serialised_reaction in serialised_reactions
+        )
+        if len(trust_labellings) == 1:
+            reaction_cache = None
+            if reaction_cache_file is not None:
+                reaction_cache = orderly.extract.store.ReactionCache(
+                    *reaction_cache_file
+                )
+            results = {
+                trust_labellings[0]: OrdExtractor.extract_reactions(
+                    reactions,
+                    manual_replacements_dict=manual_replacements_dict,
+                    solvents_set=solvents_set,
+                    trust_labelling=trust_labellings[0],
+                    consider_molecule_names=consider_molecule_names,
+                    reaction_cache=reaction_cache,
+                    reaction_filter=reaction_filter,
+                    start=start,
+                )
+            }
+            if reaction_cache is not None:
+                reaction_cache.close()
+        else:
+            results = OrdExtractor.extract_reactions_for_labellings(
+                reactions,
+                manual_replacements_dict=manual_replacements_dict,
+                solvents_set=solvents_set,
+                trust_labellings=trust_labellings,
+                consider_molecule_names=consider_molecule_names,
+                reaction_filter=reaction_filter,
+                start=start,
+            )
+        if canonicalisation_store_path is not None:
+            orderly.extract.canonicalise.flush_store()
+        dropped = {} if reaction_filter is None else reaction_filter.dropped
+        return results, None, dropped
+
+    def get_trust_labellings(self) -> Tuple[bool, ...]:
+        """The values of trust_labelling the reactions are extracted with, self.trust_labelling first"""
+        if self.dual_labelling:
+            return (self.trust_labelling, not self.trust_labelling)
+        return (self.trust_labelling,)
+
+    def get_reaction_cache_file(self) -> Optional[Tuple[pathlib.Path, str]]:
+        """The path and config hash of the reaction cache for this dataset"""
+        if self.reaction_cache_path is None:
+            return None
+        assert self.solvents_set is not None
+        config_hash = orderly.extract.manifest.hash_extraction_config(
+            trust_labelling=self.trust_labelling,
+            consider_molecule_names=self.consider_molecule_names,
+            manual_replacements_dict=self.manual_replacements_dict,
+            solvents_set=self.solvents_set,
+            name_contains_substring=None,
+            inverse_substring=False,
+            cost_limits=orderly.extract.canonicalise.get_cost_limits().to_config(),
+        )
+        return (
+            pathlib.Path(self.reaction_cache_path) / f"{self.filename}.sqlite",
+            config_hash,
+        )
+
+    def _close_reaction_cache(
+        self,
+        reaction_cache: orderly.extract.store.ReactionCache,
+        reaction_ids: Set[str],
+    ) -> None:
+        """Drops the cached reactions that are no longer in the dataset"""
+        removed = reaction_cache.retain(reaction_ids)
+        LOG.info(
+            f"Reaction cache for {self.filename}: {reaction_cache.hits} unchanged, {reaction_cache.misses} new or changed, {removed} removed"
+        )
+        reaction_cache.close()
+
+    def build_rxn_lists(
+        self,
+    ) -> Tuple[RXN_LISTS, List[MOLECULE_IDENTIFIER]]:
+        """The rxn lists and non-SMILES names of the dataset, see build_rxn_lists_for_labellings"""
+        return self.build_rxn_lists_for_labellings()[self.trust_labelling]
+
+    def build_rxn_lists_for_labellings(
+        self,
+    ) -> Dict[bool, Tuple[RXN_LISTS, List[MOLECULE_IDENTIFIER]]]:
+        """
+        Extracts every reaction in the dataset, for each value of trust_labelling (see get_trust_labellings). If reaction_chunk_size is set and the dataset has more reactions than this, the reactions are split into chunks that are extracted on a process pool; the chunks are merged in order so the result is identical to the serial extraction.
+        """
+        assert self.solvents_set is not None
+
+        reactions = self.data.reactions
+        trust_labellings = self.get_trust_labellings()
+        reaction_cache_file = self.get_reaction_cache_file()
+        if (
+            self.reaction_chunk_size is None
+            or len(reactions) <= self.reaction_chunk_size
+        ):
+            if self.dual_labelling:
+                return OrdExtractor.extract_reactions_for_labellings(
+                    reactions,
+                    manual_replacements_dict=self.manual_replacements_dict,
+                    solvents_set=self.solvents_set,
+                    trust_labellings=trust_labellings,
+                    consider_molecule_names=self.consider_molecule_names,
+                    reaction_filter=self.reaction_filter,
+                )
+            reaction_cache = None
+            if reaction_cache_file is not None:
+                reaction_cache = orderly.extract.store.ReactionCache(
+                    *reaction_cache_file
+                )
+            result = OrdExtractor.extract_reactions(
+                reactions,
                 manual_replacements_dict=self.manual_replacements_dict,
                 solvents_set=self.solvents_set,
                 trust_labelling=self.trust_labelling,
                 consider_molecule_names=self.consider_molecule_names,
+                reaction_cache=reaction_cache,
+                reaction_filter=self.reaction_filter,
             )
-            if extracted_reaction is None:
-                continue
-            (
-                reactants,
-                agents,
-                reagents,
-                solvents,
-                catalysts,
-                products,
-                yields,
-                temperature,
-                rxn_time,
-                rxn_str,
-                procedure_details,
-                date_of_experiment,
-                is_mapped,
-                rxn_non_smiles_names_list_additions,
-            ) = extracted_reaction
-
-            rxn_non_smiles_names_list += rxn_non_smiles_names_list_additions
-
-            rxn_lists["rxn_str"].append(rxn_str)
-            rxn_lists["reactant"].append(reactants)
-            rxn_lists["agent"].append(agents)
-            rxn_lists["reagent"].append(reagents)
-            rxn_lists["solvent"].append(solvents)
-            rxn_lists["catalyst"].append(catalysts)
-            rxn_lists["temperature"].append(temperature)
-            rxn_lists["rxn_time"].append(rxn_time)
-            rxn_lists["product"].append(products)
-            rxn_lists["yield"].append(yields)
-            rxn_lists["procedure_details"].append(procedure_details)
-            rxn_lists["date_of_experiment"].append(date_of_experiment)
-            rxn_lists["is_mapped"].append(is_mapped)
+            if reaction_cache is not None:
+                self._close_reaction_cache(reaction_cache, reaction_cache.seen)
+            return {self.trust_labelling: result}
 
-        return rxn_lists, rxn_non_smiles_names_list
+        # somewhat dangerous imports so keeping localised
+        import multiprocessing
+        import joblib
+
+        chunk_size = self.reaction_chunk_size
+        LOG.info(
+            f"Extracting {len(reactions)} reactions from {self.filename} in chunks of {chunk_size}"
+        )
+        chunk_results = joblib.Parallel(n_jobs=multiprocessing.cpu_count())(
+            joblib.delayed(OrdExtractor._extract_serialised_reactions)(
+                [rxn.SerializeToString() for rxn in reactions[i : i + chunk_size]],
+                manual_replacements_dict=self.manual_replacements_dict,
+                solvents_set=self.solvents_set,
+                trust_labellings=trust_labellings,
+                consider_molecule_names=self.consider_molecule_names,
+                canonicalisation_store_path=self.canonicalisation_store_path,
+                reaction_cache_file=reaction_cache_file,
+                profile=orderly.extract.profiling.is_enabled(),
+                reaction_filter=self.reaction_filter,
+                cost_limits=orderly.extract.canonicalise.get_cost_limits(),
+                start=i,
+            )
+            for i in range(0, len(reactions), chunk_size)
+        )
+        if reaction_cache_file is not None:
+            # the workers wrote to the cache, so the counters are not known here
+            self._close_reaction_cache(
+                orderly.extract.store.ReactionCache(*reaction_cache_file),
+                set(OrdExtractor.get_reaction_key(rxn)[0] for rxn in reactions),
+            )
+
+        results, _, _ = chunk_results[0]
+        for chunk_result, _, _ in chunk_results[1:]:
+            for trust_labelling, (
+                chunk_rxn_lists,
+                chunk_non_smiles_names_list,
+            ) in chunk_result.items():
+                rxn_lists, rxn_non_smiles_names_list = results[trust_labelling]
+                for col, values in chunk_rxn_lists.items():
+                    rxn_lists[col] += values  # type: ignore
+                rxn_non_smiles_names_list += chunk_non_smiles_names_list
+        for _, chunk_profile, chunk_dropped in chunk_results:
+            if chunk_profile is not None:
+                orderly.extract.profiling.get_profiler().merge(chunk_profile)
+            if self.reaction_filter is not None:
+                self.reaction_filter.merge(chunk_dropped)
+        return results
+
+    def iter_rxn_list_batches(
+        self,
+    ) -> Iterator[Tuple[RXN_LISTS, List[MOLECULE_IDENTIFIER]]]:
+        """
+        Streams the reactions from the file and extracts them batch_size reactions at a time, so only one batch is ever held in memory.
+        """
+        assert self.solvents_set is not None
+        assert self.batch_size is not None and self.batch_size > 0
+
+        reaction_cache_file = self.get_reaction_cache_file()
+        reaction_cache = None
+        if reaction_cache_file is not None:
+            reaction_cache = orderly.extract.store.ReactionCache(*reaction_cache_file)
+
+        def extract_batch(
+            batch: List[ord_reaction_pb2.Reaction], start: int
+        ) -> Tuple[RXN_LISTS, List[MOLECULE_IDENTIFIER]]:
+            assert self.solvents_set is not None
+            result = OrdExtractor.extract_reactions(
+                batch,
+                manual_replacements_dict=self.manual_replacements_dict,
+                solvents_set=self.solvents_set,
+                trust_labelling=self.trust_labelling,
+                consider_molecule_names=self.consider_molecule_names,
+                reaction_cache=reaction_cache,
+                reaction_filter=self.reaction_filter,
+                start=start,
+            )
+            if reaction_cache is not None:
+                reaction_cache.flush()
+            return result
+
+        batch: List[ord_reaction_pb2.Reaction] = []
+        start = 0
+        for rxn in OrdExtractor.iter_reactions(self.ord_file_path):
+            batch.append(rxn)
+            if len(batch) == self.batch_size:
+                yield extract_batch(batch, start)
+                start += len(batch)
+                batch = []
+        if len(batch) > 0:
+            yield extract_batch(batch, start)
+        if reaction_cache is not None:
+            self._close_reaction_cache(reaction_cache, reaction_cache.seen)
+
+    @orderly.extract.profiling.profiled
+    def to_parquet(
+        self,
+        path: pathlib.Path,
+        dataset_format: bool = False,
+        trust_labelling: Optional[bool] = None,
+        procedure_details_path: Optional[pathlib.Path] = None,
+    ) -> None:
+        """
+        Writes the extracted reactions to a parquet file.
+        In streaming mode (batch_size is set) each batch is extracted and spilled to a temporary parquet file, then the batches are appended as row groups to a single file through a pyarrow ParquetWriter. In the wide format a batch may have fewer molecule columns than the file as a whole (e.g. no reaction with 4 reactants), so every batch is padded to the union of the columns, which gives the same file as the non-streaming extraction.
+        If dataset_format is True the file is written with the options of the partitioned dataset (see orderly.extract.dataset.get_write_options).
+        With dual_labelling, trust_labelling selects which of the labelling_outputs is written (default self.trust_labelling).
+        If procedure_details_path is set the procedure details are written there instead, as a compressed sidecar keyed by the row id column of the reactions (see row_ids and orderly.extract.procedures).
+        """
+        if self.filtered_out:
+            e = ValueError(f"{self.ord_file_path} was filtered out, nothing to write")
+            LOG.error(e)
+            raise e
+
+        def get_write_options(schema: pa.Schema) -> Dict[str, Any]:
+            if not dataset_format:
+                return {}
+            return orderly.extract.dataset.get_write_options(schema)
+
+        if self.batch_size is None:
+            full_table = self.full_table
+            if trust_labelling is not None:
+                full_table = self.labelling_outputs[trust_labelling][0]
+            assert full_table is not None
+            if procedure_details_path is not None:
+                full_table, sidecar = orderly.extract.procedures.split_table(full_table)
+                with orderly.extract.procedures.open_sidecar_writer(
+                    procedure_details_path
+                ) as sidecar_writer:
+                    sidecar_writer.write_table(sidecar)
+            pq.write_table(full_table, path, **get_write_options(full_table.schema))
+            return
+
+        # somewhat dangerous imports so keeping localised
+        import tempfile
+
+        if self.canonicalisation_store_path is not None:
+            orderly.extract.canonicalise.attach_store(self.canonicalisation_store_path)
+
+        self.non_smiles_names_list = []
+        sidecar_writer = None
+        if procedure_details_path is not None:
+            sidecar_writer = orderly.extract.procedures.open_sidecar_writer(
+                procedure_details_path
+            )
+        with tempfile.TemporaryDirectory(dir=pathlib.Path(path).parent) as spill_dir:
+            batch_paths = []
+            column_types: Dict[str, pa.DataType] = {}
+            for idx, (rxn_lists, rxn_non_smiles_names_list) in enumerate(
+                self.iter_rxn_list_batches()
+            ):
+                self.non_smiles_names_list += rxn_non_smiles_names_list
+                if len(rxn_lists["rxn_str"]) == 0:
+                    continue
+                batch_table = self.rxn_lists_to_table(rxn_lists)
+                if sidecar_writer is not None:
+                    batch_table, sidecar = orderly.extract.procedures.split_table(
+                        batch_table
+                    )
+                    sidecar_writer.write_table(sidecar)
+                column_types.update(
+                    zip(batch_table.column_names, batch_table.schema.types)
+                )
+                batch_path = pathlib.Path(spill_dir) / f"batch_{idx:06d}.parquet"
+                pq.write_table(batch_table, batch_path)
+                batch_paths.append(batch_path)
+                del batch_table
+                LOG.debug(f"Spilled batch {idx} of {self.filename} to {batch_path}")
+
+            if self.canonicalisation_store_path is not None:
+                orderly.extract.canonicalise.flush_store()
+            if sidecar_writer is not None:
+                sidecar_writer.close()
+            if len(batch_paths) == 0:
+                e = ValueError(f"No reactions extracted from {self.ord_file_path}")
+                LOG.error(e)
+                raise e
+
+            schema = pa.schema(
+                [(col, column_types[col]) for col in sorted(column_types)]
+            )
+            with pq.ParquetWriter(path, schema, **get_write_options(schema)) as writer:
+                for batch_path in batch_paths:
+                    writer.write_table(
+                        OrdExtractor.pad_to_schema(
+                            pq.read_table(batch_path), schema, self.missing_value
+                        )
+                    )
+        LOG.debug(f"Streamed {len(batch_paths)} batches of {self.filename} to {path}")
+
+    @property
+    def full_df(self) -> Optional[pd.DataFrame]:
+        """The extracted reactions as a pandas dataframe (converted from full_table)"""
+        if self.full_table is None:
+            return None
+        return self.full_table.to_pandas()
 
     @staticmethod
     def _create_column_headers(num_cols: int, base_string: str) -> List[str]:
@@ -1170,110 +1944,165 @@ class OrdExtractor:
         return [f"{base_string}_{i:03d}" for i in range(num_cols)]
 
     @staticmethod
-    def _to_dataframe(cols: List[Any], base_string: str | List[str]) -> pd.DataFrame:
-        df = pd.DataFrame(cols)
-        if isinstance(base_string, str):
-            df.columns = OrdExtractor._create_column_headers(
-                num_cols=df.shape[1], base_string=base_string
+    def pad_to_schema(
+        table: pa.Table, schema: pa.Schema, missing_value: Optional[str]
+    ) -> pa.Table:
+        """Selects the columns of the schema from the table, adding the columns the table doesn't have (e.g. reactant_003 when no reaction in the table has 4 reactants) as missing"""
+        columns = []
+        for field in schema:
+            if field.name in table.column_names:
+                columns.append(table.column(field.name).cast(field.type))
+            else:
+                columns.append(
+                    OrdExtractor._fill_missing(
+                        pa.nulls(table.num_rows, field.type), missing_value
+                    )
+                )
+        return pa.Table.from_arrays(columns, schema=schema)
+
+    @staticmethod
+    def _fill_missing(array: pa.Array, missing_value: Optional[str]) -> pa.Array:
+        """Replaces the nulls of a string array with missing_value (if not None)"""
+        if missing_value is None or not pa.types.is_string(array.type):
+            return array
+        return pc.fill_null(array, missing_value)
+
+    @staticmethod
+    def _to_wide_arrays(
+        cols: List[List[Any]],
+        base_string: str,
+        value_type: pa.DataType,
+        missing_value: Optional[str],
+    ) -> Dict[str, pa.Array]:
+        """
+        Splits a list of lists (e.g. the reactants of each reaction) into one array per position (reactant_000, reactant_001, ...), padded with nulls.
+        The lists are converted to arrow once, and each position is gathered from the flat values with take.
+        """
+        list_array = pa.array(cols, type=pa.list_(value_type))
+        values = list_array.flatten()
+        offsets = list_array.offsets.to_numpy()
+        starts = offsets[:-1]
+        lengths = np.diff(offsets)
+        num_cols = int(lengths.max()) if len(lengths) > 0 else 0
+
+        arrays = {}
+        for i, header in enumerate(
+            OrdExtractor._create_column_headers(num_cols, base_string)
+        ):
+            indices = pa.array(starts + i, mask=lengths <= i)
+            arrays[header] = OrdExtractor._fill_missing(
+                values.take(indices), missing_value
             )
-        else:
-            assert df.shape[1] == 1
-            df.columns = base_string
-        return df
+        return arrays
 
-    def build_full_df(
+    def build_full_table(
         self,
-    ) -> Tuple[pd.DataFrame, List[MOLECULE_IDENTIFIER]]:
-        data_lists, rxn_non_smiles_names_list = self.build_rxn_lists()
+    ) -> Tuple[pa.Table, List[MOLECULE_IDENTIFIER]]:
+        return self.build_full_tables()[self.trust_labelling]
+
+    def build_full_tables(
+        self,
+    ) -> Dict[bool, Tuple[pa.Table, List[MOLECULE_IDENTIFIER]]]:
+        """The table and non-SMILES names of the dataset for each value of trust_labelling (see get_trust_labellings)"""
+        results = self.build_rxn_lists_for_labellings()
         LOG.info("Build rxn lists")
 
-        dfs = []
-        dfs.append(
-            OrdExtractor._to_dataframe(data_lists["rxn_str"], base_string=["rxn_str"])
-            .fillna("<missing>")
-            .astype("string")
-            .astype(object)
-        )
-        dfs.append(
-            OrdExtractor._to_dataframe(data_lists["reactant"], base_string="reactant")
-            .fillna("<missing>")
-            .astype("string")
-            .astype(object)
-        )
-        dfs.append(
-            OrdExtractor._to_dataframe(data_lists["agent"], base_string="agent")
-            .fillna("<missing>")
-            .astype("string")
-            .astype(object)
+        full_tables = {
+            trust_labelling: (self.rxn_lists_to_table(data_lists), names)
+            for trust_labelling, (data_lists, names) in results.items()
+        }
+        LOG.info("Constructed table")
+
+        return full_tables
+
+    def rxn_lists_to_table(self, data_lists: RXN_LISTS) -> pa.Table:
+        return OrdExtractor.build_table(
+            data_lists,
+            dataset_id=self.dataset_id,
+            grant_date=self.grant_date,
+            list_columns=self.list_columns,
+            missing_value=self.missing_value,
+            reaction_hashes=self.reaction_hashes,
+            row_ids=self.row_ids,
         )
-        dfs.append(
-            OrdExtractor._to_dataframe(data_lists["reagent"], base_string="reagent")
-            .fillna("<missing>")
-            .astype("string")
-            .astype(object)
+
+    @staticmethod
+    @orderly.extract.profiling.profiled
+    def build_table(
+        data_lists: RXN_LISTS,
+        dataset_id: str,
+        grant_date: Optional[pd.Timestamp],
+        list_columns: bool = False,
+        missing_value: Optional[str] = "<missing>",
+        reaction_hashes: bool = False,
+        row_ids: bool = False,
+    ) -> pa.Table:
+        """
+        Builds an arrow table straight from the lists of extracted reactions, with the columns sorted by name.
+        By default the table is wide (one column per molecule, e.g. reactant_000, reactant_001, ...); if list_columns is True each molecule type (and the yields) is a single list column instead.
+        Missing molecules are null, or missing_value if it is not None ("<missing>" is what the cleaner expects from older extractions).
+        If reaction_hashes is True the order invariant hash of each reaction is added (see orderly.extract.duplicates.REACTION_HASH_COLUMN), and if row_ids is True its row id (see orderly.extract.procedures.get_row_ids).
+        """
+        num_rows = len(data_lists["rxn_str"])
+        arrays: Dict[str, pa.Array] = {}
+        arrays["rxn_str"] = OrdExtractor._fill_missing(
+            pa.array(data_lists["rxn_str"], type=pa.string()), missing_value
         )
-        dfs.append(
-            OrdExtractor._to_dataframe(data_lists["solvent"], base_string="solvent")
-            .fillna("<missing>")
-            .astype("string")
-            .astype(object)
+        for col in ["reactant", "agent", "reagent", "solvent", "catalyst", "product"]:
+            if list_columns:
+                arrays[col] = pa.array(data_lists[col], type=pa.list_(pa.string()))
+            else:
+                arrays.update(
+                    OrdExtractor._to_wide_arrays(
+                        data_lists[col],  # type: ignore
+                        base_string=col,
+                        value_type=pa.string(),
+                        missing_value=missing_value,
+                    )
+                )
+        if list_columns:
+            arrays["yield"] = pa.array(data_lists["yield"], type=pa.list_(pa.float64()))
+        else:
+            arrays.update(
+                OrdExtractor._to_wide_arrays(
+                    data_lists["yield"],  # type: ignore
+                    base_string="yield",
+                    value_type=pa.float64(),
+                    missing_value=None,
+                )
+            )
+        arrays["temperature"] = pa.array(data_lists["temperature"], type=pa.float64())
+        arrays["rxn_time"] = pa.array(
+            data_lists["rxn_time"], type=pa.float64()
+        )  # TODO do we extract multiple rxn times?
+        arrays["procedure_details"] = OrdExtractor._fill_missing(
+            pa.array(data_lists["procedure_details"], type=pa.string()),
+            missing_value,
         )
-        dfs.append(
-            OrdExtractor._to_dataframe(data_lists["catalyst"], base_string="catalyst")
-            .fillna("<missing>")
-            .astype("string")
-            .astype(object)
+        arrays["date_of_experiment"] = pa.array(
+            data_lists["date_of_experiment"], type=pa.timestamp("ns")
         )
-        dfs.append(
-            OrdExtractor._to_dataframe(
-                data_lists["temperature"], base_string=["temperature"]
-            ).astype("float")
+        arrays["is_mapped"] = pa.array(data_lists["is_mapped"], type=pa.bool_())
+        arrays["extracted_from_file"] = pa.array(
+            [dataset_id] * num_rows, type=pa.string()
         )
-        dfs.append(
-            OrdExtractor._to_dataframe(
-                data_lists["rxn_time"], base_string=["rxn_time"]
-            ).astype("float")
-        )  # TODO do we extract multiple rxn times?
-        dfs.append(
-            OrdExtractor._to_dataframe(data_lists["product"], base_string="product")
-            .fillna("<missing>")
-            .astype("string")
-            .astype(object)
+        arrays["grant_date"] = pa.array(
+            [None if grant_date is None else pd.Timestamp(grant_date)] * num_rows,
+            type=pa.timestamp("ns"),
         )
-        dfs.append(
-            OrdExtractor._to_dataframe(data_lists["yield"], base_string="yield").astype(
-                "float"
+        if reaction_hashes:
+            arrays[orderly.extract.duplicates.REACTION_HASH_COLUMN] = pa.array(
+                orderly.extract.duplicates.get_reaction_hashes(data_lists),
+                type=pa.string(),
             )
-        )
-        dfs.append(
-            OrdExtractor._to_dataframe(
-                data_lists["procedure_details"], base_string=["procedure_details"]
+        if row_ids:
+            arrays[
+                orderly.extract.procedures.ROW_ID_COLUMN
+            ] = orderly.extract.procedures.get_row_ids(
+                dataset_id,
+                data_lists["reaction_id"],  # type: ignore
+                data_lists["reaction_index"],  # type: ignore
             )
-            .fillna("<missing>")
-            .astype("string")
-            .astype(object)
-        )
-        dfs.append(
-            OrdExtractor._to_dataframe(
-                data_lists["date_of_experiment"], base_string=["date_of_experiment"]
-            ).apply(pd.to_datetime, errors="coerce")
-        )
-        dfs.append(
-            OrdExtractor._to_dataframe(
-                data_lists["is_mapped"], base_string=["is_mapped"]
-            ).astype("bool")
-        )
-        LOG.info("Constructed dict of dfs")
-
-        full_df = pd.concat(dfs, axis=1)
-
-        full_df = full_df.assign(extracted_from_file=self.dataset_id)
-
-        full_df = full_df.assign(grant_date=self.grant_date)
-        full_df.grant_date = pd.to_datetime(full_df.grant_date)
-
-        full_df.reset_index(inplace=True, drop=True)
-        full_df = full_df.sort_index(axis=1)
-        LOG.info("Constructed df")
+        LOG.debug("Constructed arrays")
 
-        return full_df, rxn_non_smiles_names_list
+        return pa.table({col: arrays[col] for col in sorted(arrays)})
@@ -0,0 +1,147 @@
+import dataclasses
+import json
+import logging
+import pathlib
+from typing import Dict, List, Optional
+
+from orderly.extract.extractor import OrdExtractor
+
+LOG = logging.getLogger(__name__)
+
+# rough single core extraction time per reaction (measured on the USPTO test data with a cold canonicalisation cache), only used to estimate the runtime of an extraction
+SECONDS_PER_REACTION = 0.004
+
+
+@dataclasses.dataclass
+class DatasetInfo:
+    """The header of an ORD file (the reactions are counted but not parsed), num_reactions is None if only the name was read"""
+
+    size: int
+    mtime_ns: int
+    name: str
+    dataset_id: str
+    filename: str
+    num_reactions: Optional[int]
+
+
+def scan_file(file: pathlib.Path, count_reactions: bool = True) -> DatasetInfo:
+    """
+    Reads the name, dataset_id and (if count_reactions) number of reactions of an ORD file without parsing the reactions.
+    Without count_reactions only the start of the file is read for a named dataset (see OrdExtractor.peek_filename), with it the whole file is read but the reactions are skipped over.
+    """
+    stat = file.stat()
+    if count_reactions:
+        header, num_reactions = OrdExtractor.load_header(file)
+        return DatasetInfo(
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            name=str(header.name),
+            dataset_id=str(header.dataset_id),
+            filename=OrdExtractor.get_filename(header),
+            num_reactions=num_reactions,
+        )
+    filename = OrdExtractor.peek_filename(file)
+    if filename is None:
+        # not a binary file, so it has to be loaded
+        data = OrdExtractor.load_data(file)
+        return DatasetInfo(
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            name=str(data.name),
+            dataset_id=str(data.dataset_id),
+            filename=OrdExtractor.get_filename(data),
+            num_reactions=len(data.reactions),
+        )
+    return DatasetInfo(
+        size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        name="",
+        dataset_id="",
+        filename=filename,
+        num_reactions=None,
+    )
+
+
+class DatasetInventory:
+    """
+    A cache of the DatasetInfo of each ORD file (keyed by path), saved as json. An entry is reused while the size and mtime of the file are unchanged.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        self.entries: Dict[str, DatasetInfo] = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.entries = {
+                    file: DatasetInfo(**entry) for file, entry in json.load(f).items()
+                }
+            LOG.debug(f"Loaded inventory of {len(self.entries)} files from {path}")
+
+    def get(self, file: pathlib.Path, count_reactions: bool = True) -> DatasetInfo:
+        entry = self.entries.get(str(file))
+        stat = file.stat()
+        if (
+            entry is not None
+            and entry.size == stat.st_size
+            and entry.mtime_ns == stat.st_mtime_ns
+            and (entry.num_reactions is not None or not count_reactions)
+        ):
+            return entry
+        entry = scan_file(file, count_reactions=count_reactions)
+        self.entries[str(file)] = entry
+        return entry
+
+    def scan(
+        self, files: List[pathlib.Path], count_reactions: bool = True
+    ) -> Dict[pathlib.Path, DatasetInfo]:
+        return {file: self.get(file, count_reactions=count_reactions) for file in files}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(
+                {
+                    file: dataclasses.asdict(entry)
+                    for file, entry in self.entries.items()
+                },
+                f,
+                indent=4,
+                sort_keys=True,
+            )
+
+
+def filter_files(
+    infos: Dict[pathlib.Path, DatasetInfo],
+    name_contains_substring: Optional[str],
+    inverse_substring: bool = False,
+) -> List[pathlib.Path]:
+    """The files that pass the filename filter of the extraction (see OrdExtractor.is_filtered_out), in the order of infos"""
+    return [
+        file
+        for file, info in infos.items()
+        if not OrdExtractor.is_filtered_out(
+            info.filename, name_contains_substring, inverse_substring
+        )
+    ]
+
+
+def estimate_extraction_seconds(
+    infos: Dict[pathlib.Path, DatasetInfo],
+    num_workers: int = 1,
+    seconds_per_reaction: float = SECONDS_PER_REACTION,
+) -> float:
+    """A rough estimate of the wall time of extracting the files on num_workers workers, the largest file is a lower bound"""
+    seconds = [
+        (info.num_reactions or 0) * seconds_per_reaction for info in infos.values()
+    ]
+    if len(seconds) == 0:
+        return 0.0
+    return max(sum(seconds) / max(num_workers, 1), max(seconds))
+
+
+def log_summary(infos: Dict[pathlib.Path, DatasetInfo], num_workers: int = 1) -> None:
+    num_reactions = sum(info.num_reactions or 0 for info in infos.values())
+    total_size = sum(info.size for info in infos.values())
+    LOG.info(
+        f"Inventory: {len(infos)} files, {num_reactions} reactions, {total_size / 2**20:.1f} MiB, estimated extraction time {estimate_extraction_seconds(infos, num_workers=num_workers):.0f}s on {num_workers} workers"
+    )
@@ -0,0 +1,207 @@
+import logging
+import pathlib
+from typing import List, Optional, Set, Tuple
+
+import tqdm
+import tqdm.contrib.logging
+
+from ord_schema.proto import dataset_pb2 as ord_dataset_pb2
+
+import orderly.extract.canonicalise
+import orderly.extract.store
+from orderly.extract.extractor import OrdExtractor
+from orderly.types import *
+
+LOG = logging.getLogger(__name__)
+
+MOLECULE_KEY = Tuple[MOLECULE_IDENTIFIER, bool]  # (raw identifier, is_mapped)
+
+
+def _first_identifier_of_type(
+    identifiers: REPEATEDCOMPOSITECONTAINER, identifier_type: int
+) -> Optional[MOLECULE_IDENTIFIER]:
+    for i in identifiers:
+        if i.type == identifier_type:
+            return str(i.value)
+    return None
+
+
+def _add_identifiers(
+    identifiers: REPEATEDCOMPOSITECONTAINER,
+    consider_molecule_names: bool,
+    is_mapped: bool,
+    molecule_keys: Set[MOLECULE_KEY],
+) -> None:
+    """Mirrors OrdExtractor.find_smiles: the first SMILES, or failing that the first name"""
+    smiles = _first_identifier_of_type(identifiers, 2)
+    if smiles is not None:
+        molecule_keys.add((smiles, is_mapped))
+    elif consider_molecule_names:
+        name = _first_identifier_of_type(identifiers, 6)
+        if name is not None:
+            molecule_keys.add((name, is_mapped))
+
+
+def collect_dataset_molecule_identifiers(
+    data: ord_dataset_pb2.Dataset,
+    consider_molecule_names: bool,
+) -> Set[MOLECULE_KEY]:
+    """
+    Collects the distinct raw molecule strings that OrdExtractor.handle_reaction_object will canonicalise: the molecules in the reaction string and the identifiers of the inputs and outcomes.
+    """
+    molecule_keys: Set[MOLECULE_KEY] = set()
+    for rxn in data.reactions:
+        rxn_str_and_is_mapped = OrdExtractor.get_rxn_string_and_is_mapped(rxn)
+        is_mapped = False
+        if rxn_str_and_is_mapped is not None:
+            rxn_str, is_mapped = rxn_str_and_is_mapped
+            for side in rxn_str.split(">"):
+                for smi in side.split("."):
+                    if smi != "":
+                        molecule_keys.add((smi, is_mapped))
+        for key in rxn.inputs:
+            for component in rxn.inputs[key].components:
+                _add_identifiers(
+                    component.identifiers,
+                    consider_molecule_names,
+                    is_mapped,
+                    molecule_keys,
+                )
+        for outcome in rxn.outcomes[:1]:
+            for product in outcome.products:
+                _add_identifiers(
+                    product.identifiers,
+                    consider_molecule_names,
+                    is_mapped,
+                    molecule_keys,
+                )
+    return molecule_keys
+
+
+def collect_molecule_identifiers(
+    file: pathlib.Path,
+    consider_molecule_names: bool,
+    name_contains_substring: Optional[str] = None,
+    inverse_substring: bool = False,
+) -> Set[MOLECULE_KEY]:
+    """Scans an ORD file for the distinct raw molecule strings, applying the same filename filter as the extraction"""
+    if name_contains_substring is not None:
+        filename = OrdExtractor.peek_filename(file)
+        if filename is not None and OrdExtractor.is_filtered_out(
+            filename, name_contains_substring, inverse_substring
+        ):
+            return set()
+    data = OrdExtractor.load_data(file)
+    if OrdExtractor.is_filtered_out(
+        OrdExtractor.get_filename(data), name_contains_substring, inverse_substring
+    ):
+        return set()
+    return collect_dataset_molecule_identifiers(data, consider_molecule_names)
+
+
+LOOKUP_ENTRY = Tuple[MOLECULE_IDENTIFIER, bool, Optional[CANON_SMILES], int]
+
+
+def canonicalise_molecule_identifiers(
+    molecule_keys: List[MOLECULE_KEY],
+) -> List[LOOKUP_ENTRY]:
+    """The canonical SMILES and the flags (see MoleculeInfo.to_flags) of each molecule, so the extraction doesn't parse any molecule in the lookup"""
+    entries = []
+    for identifier, is_mapped in molecule_keys:
+        info = orderly.extract.canonicalise.get_molecule_info(
+            identifier, is_mapped=is_mapped
+        )
+        entries.append((identifier, is_mapped, info.canonical_smiles, info.to_flags()))
+    return entries
+
+
+def _chunk(x: List[MOLECULE_KEY], num_chunks: int) -> List[List[MOLECULE_KEY]]:
+    chunk_size = max(1, -(-len(x) // num_chunks))
+    return [x[i : i + chunk_size] for i in range(0, len(x), chunk_size)]
+
+
+def build_molecule_lookup(
+    files: List[pathlib.Path],
+    store_path: pathlib.Path,
+    consider_molecule_names: bool,
+    name_contains_substring: Optional[str] = None,
+    inverse_substring: bool = False,
+    use_multiprocessing: bool = True,
+) -> int:
+    """
+    Two-phase extraction, phase one: collects the distinct raw molecule strings across all the files, canonicalises each distinct string once (across a process pool), and writes the results to the CanonicalisationStore at store_path.
+    The extraction workers then attach the store, so RDKit work scales with the number of unique molecules rather than the number of occurrences.
+    The fragments of unresolvable identifiers are canonicalised one by one in OrdExtractor.canonicalise_molecules, so these are added in a second round.
+    Returns the number of entries in the lookup.
+    """
+    store = orderly.extract.store.CanonicalisationStore(store_path)
+
+    def _is_missing(key: MOLECULE_KEY) -> bool:
+        found, smiles, flags = store.get_entry(*key)
+        # the flags of a resolvable molecule are needed so the extraction doesn't parse it
+        return not found or (smiles is not None and flags is None)
+
+    def _canonicalise_missing(
+        molecule_keys: Set[MOLECULE_KEY],
+    ) -> List[LOOKUP_ENTRY]:
+        missing = sorted(k for k in molecule_keys if _is_missing(k))
+        LOG.info(
+            f"Canonicalising {len(missing)} unique molecules ({len(molecule_keys) - len(missing)} already in {store_path})"
+        )
+        if use_multiprocessing and len(missing) > 0:
+            import multiprocessing
+            import joblib
+
+            num_cores = multiprocessing.cpu_count()
+            results = []
+            for chunk_results in joblib.Parallel(n_jobs=num_cores)(
+                joblib.delayed(canonicalise_molecule_identifiers)(chunk)
+                for chunk in _chunk(missing, num_cores * 4)
+            ):
+                results += chunk_results
+        else:
+            results = canonicalise_molecule_identifiers(missing)
+        store.put_many(results)
+        store.flush()
+        return results
+
+    LOG.info(f"Collecting unique molecules from {len(files)} files")
+    with tqdm.contrib.logging.logging_redirect_tqdm(loggers=[LOG]):
+        if use_multiprocessing:
+            import multiprocessing
+            import joblib
+
+            per_file_keys = joblib.Parallel(n_jobs=multiprocessing.cpu_count())(
+                joblib.delayed(collect_molecule_identifiers)(
+                    file,
+                    consider_molecule_names,
+                    name_contains_substring,
+                    inverse_substring,
+                )
+                for file in tqdm.tqdm(files)
+            )
+        else:
+            per_file_keys = [
+                collect_molecule_identifiers(
+                    file,
+                    consider_molecule_names,
+                    name_contains_substring,
+                    inverse_substring,
+                )
+                for file in tqdm.tqdm(files)
+            ]
+    molecule_keys: Set[MOLECULE_KEY] = set().union(*per_file_keys)
+    results = _canonicalise_missing(molecule_keys)
+
+    # the fragments of an unresolvable identifier are canonicalised one by one
+    fragment_keys: Set[MOLECULE_KEY] = set()
+    for identifier, is_mapped, smiles, _ in results:
+        if smiles is None and "." in identifier:
+            for fragment in identifier.split("."):
+                fragment_keys.add((fragment, is_mapped))
+    _canonicalise_missing(fragment_keys - molecule_keys)
+
+    num_entries = len(store)
+    store.close()
+    LOG.info(f"Built molecule lookup with {num_entries} entries at {store_path}")
+    return num_entries
@@ -1,5 +1,7 @@
 import logging
-from typing import List, Dict, Tuple, Set, Optional
+from typing import Any, Callable, List, Dict, Tuple, Set, Optional
+import collections
+import dataclasses
 import datetime
 import pathlib
 import click
@@ -9,11 +11,27 @@ import pandas as pd
 import tqdm
 import tqdm.contrib.logging
 
+from ord_schema.proto import dataset_pb2 as ord_dataset_pb2
+
+import rdkit
 from rdkit import Chem as rdkit_Chem
 from rdkit.rdBase import BlockLogs as rdkit_BlockLogs
 
 import orderly.extract.extractor
+import orderly.extract.annotations
 import orderly.extract.canonicalise
+import orderly.extract.dataset
+import orderly.extract.duplicates
+import orderly.extract.inventory
+import orderly.extract.lookup
+import orderly.extract.manifest
+import orderly.extract.pool
+import orderly.extract.prefetch
+import orderly.extract.procedures
+import orderly.extract.names
+import orderly.extract.profiling
+import orderly.extract.reaction_filter
+import orderly.extract.shards
 import orderly.extract.defaults
 import orderly.data.solvents
 
@@ -51,16 +69,30 @@ def get_file_names(
     )  # sort just so that there is no randomness in order of processing
 
 
+def split_large_files(
+    files: List[pathlib.Path], num_workers: int
+) -> Tuple[List[pathlib.Path], List[pathlib.Path]]:
+    """
+    Splits the files into (small files, large files). A file is large if it is at least a worker's fair share of the total size of all the files; such a file would keep one worker busy long after the others are idle, so it is better to extract it with intra-file parallelism.
+    """
+    sizes = {file: file.stat().st_size for file in files}
+    fair_share = sum(sizes.values()) / max(num_workers, 1)
+    small_files = [file for file in files if sizes[file] < fair_share]
+    large_files = [file for file in files if sizes[file] >= fair_share]
+    return small_files, large_files
+
+
 def merge_mol_names(
     molecule_names_path: pathlib.Path = pathlib.Path("data/orderly/molecule_names"),
     output_file_path: pathlib.Path = pathlib.Path(
         "data/orderly/all_molecule_names.csv"
     ),
     overwrite: bool = True,
-    molecule_names_file_ending: str = ".csv",
-) -> None:
+    molecule_names_file_ending: str = ".parquet",
+) -> orderly.extract.names.MoleculeNameIndex:
     """
     Merges all the files containing molecule non-smiles identifiers (typically english names) into one file.
+    The per-file name indices (or csv lists of names) are merged by adding their counts; the unique names are saved to output_file_path (csv) and the merged index, with the count and datasets of each name, next to it with a .parquet suffix.
     """
     if output_file_path.suffix != ".csv":
         suffix_error = ValueError(
@@ -78,15 +110,23 @@ def merge_mol_names(
             LOG.error(file_error)
             raise file_error
 
-    full_lst = []
-    for f in molecule_names_path.glob(f"./*{molecule_names_file_ending}"):
-        full_lst += orderly.data.util.load_list(f)
+    index = orderly.extract.names.MoleculeNameIndex()
+    for f in sorted(molecule_names_path.glob(f"./*{molecule_names_file_ending}")):
+        if f.suffix == ".parquet":
+            index.update(orderly.extract.names.MoleculeNameIndex.load(f))
+        else:
+            index.add(
+                orderly.data.util.load_list(f),
+                dataset=f.stem.removeprefix("molecules_"),
+            )
 
-    unique_molecule_names = sorted(list(set(full_lst)))
+    unique_molecule_names = sorted(index.names())
 
     # save the list
     orderly.data.util.save_list(x=unique_molecule_names, path=output_file_path)
-    LOG.info(f"Saved list of unique molecule names at {output_file_path=}")
+    index.save(output_file_path.with_suffix(".parquet"))
+    LOG.info(f"Saved list of {len(index)} unique molecule names at {output_file_path=}")
+    return index
 
 
 def build_solvents_set_and_dict(
@@ -95,12 +135,9 @@ def build_solvents_set_and_dict(
     """
     Builds a set of canonical smiles strings for all solvents (used to identify which agents are solvents) and a dictionary of solvent names to canonical smiles strings (for name resolution)
     """
+    # the canonical smiles come from the solvents cache, see orderly.data.solvents.get_solvents
     solvents = orderly.data.solvents.get_solvents(path=solvents_path)
 
-    solvents["canonical_smiles"] = solvents["smiles"].apply(
-        orderly.extract.canonicalise.get_canonicalised_smiles
-    )
-
     # TODO raise error if any of the canonical smiles have a none in
 
     solvents_set = set(solvents["canonical_smiles"])
@@ -120,34 +157,77 @@ def build_solvents_set_and_dict(
     return solvents_set, solvents_dict
 
 
+# the built replacements dicts, keyed by the hash of their inputs and the RDKit version
+_REPLACEMENTS: Dict[
+    str, Dict[MOLECULE_IDENTIFIER | INVALID_IDENTIFIER, Optional[SMILES]]
+] = {}
+
+
+def get_replacements_cache_path(
+    cache_key: str, cache_dir: Optional[pathlib.Path] = None
+) -> pathlib.Path:
+    if cache_dir is None:
+        cache_dir = orderly.data.util.get_cache_dir()
+    return cache_dir / f"replacements_{cache_key}.json"
+
+
 def build_replacements(
     molecule_replacements: Optional[Dict[MOLECULE_IDENTIFIER, SMILES]] = None,
     molecule_str_force_nones: Optional[List[INVALID_IDENTIFIER]] = None,
+    cache_dir: Optional[pathlib.Path] = None,
 ) -> Dict[MOLECULE_IDENTIFIER | INVALID_IDENTIFIER, Optional[SMILES]]:
     """
     Builds dictionary mapping english name molecule identifiers to canonical smiles. Dict is based on manually curated list.
+    The dict is only built once per set of inputs (and RDKit version): it is kept in memory and as a json file in cache_dir (default orderly.data.util.get_cache_dir()).
     """
-    _ = rdkit_BlockLogs()  # removes excessive warnings
-
     if molecule_replacements is None:
         molecule_replacements = orderly.extract.defaults.get_molecule_replacements()
 
+    if molecule_str_force_nones is None:
+        molecule_str_force_nones = (
+            orderly.extract.defaults.get_molecule_str_force_nones()
+        )
+
+    cache_key = orderly.data.util.hash_cache_key(
+        json.dumps(molecule_replacements, sort_keys=True),
+        json.dumps(molecule_str_force_nones),
+        rdkit.__version__,
+    )
+    if cache_key in _REPLACEMENTS:
+        return _REPLACEMENTS[cache_key].copy()
+    cache_path = get_replacements_cache_path(cache_key, cache_dir=cache_dir)
+    if cache_path.exists():
+        try:
+            with open(cache_path) as f:
+                _REPLACEMENTS[cache_key] = json.load(f)
+            LOG.debug(f"Loaded molecule replacements from {cache_path}")
+            return _REPLACEMENTS[cache_key].copy()
+        except (OSError, ValueError) as e:
+            LOG.warning(f"Ignoring the unreadable replacements cache {cache_path}: {e}")
+
+    _ = rdkit_BlockLogs()  # removes excessive warnings
+
     # Iterate over the dictionary and canonicalize each SMILES string
     for key, value in molecule_replacements.items():
         mol = rdkit_Chem.MolFromSmiles(value)
         if mol is not None:
             molecule_replacements[key] = rdkit_Chem.MolToSmiles(mol)
 
-    if molecule_str_force_nones is None:
-        molecule_str_force_nones = (
-            orderly.extract.defaults.get_molecule_str_force_nones()
-        )
-
     molecule_replacements_with_force_nones: Dict[MOLECULE_IDENTIFIER | INVALID_IDENTIFIER, Optional[SMILES]] = molecule_replacements.copy()  # type: ignore
 
     for molecule_str in molecule_str_force_nones:
         molecule_replacements_with_force_nones[molecule_str] = None
 
+    _REPLACEMENTS[cache_key] = molecule_replacements_with_force_nones.copy()
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(molecule_replacements_with_force_nones, f)
+        tmp_path.replace(cache_path)
+    except OSError as e:
+        LOG.warning(f"Could not write the replacements cache {cache_path}: {e}")
+
     LOG.debug("Got molecule replacements")
     return molecule_replacements_with_force_nones
 
@@ -169,6 +249,65 @@ def get_manual_replacements_dict(
     return manual_replacements_dict
 
 
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class ExtractionConfig:
+    """
+    The options of the extraction beyond the files, the labelling and the names of the outputs, see main for the description of each.
+    main passes the config to extract (in the workers of the pool too), so the options of each file are in one picklable object.
+    """
+
+    # how each file is extracted and written
+    canonicalisation_store_path: Optional[pathlib.Path] = None
+    reaction_chunk_size: Optional[int] = None
+    batch_size: Optional[int] = None
+    reaction_cache_path: Optional[pathlib.Path] = None
+    list_columns: bool = False
+    missing_as_null: bool = False
+    dataset_output: bool = False
+    other_labelling_output_path: Optional[pathlib.Path] = None
+    reaction_filter: Optional[orderly.extract.reaction_filter.ReactionFilter] = None
+    drop_duplicates: bool = False
+    cost_limits: orderly.extract.canonicalise.CostLimits = dataclasses.field(
+        default_factory=orderly.extract.canonicalise.CostLimits
+    )
+    procedure_details_sidecar: bool = False
+    # the steps around the extraction of the files
+    precanonicalise_molecules: bool = False
+    include_cleaned_USPTO_file: bool = False
+    incremental: bool = False
+    annotate_molecules: bool = False
+    profile: bool = False
+    inventory_only: bool = False
+    # the pool of workers (with use_multiprocessing)
+    max_memory_fraction: Optional[float] = 0.8
+    memory_per_input_byte: float = 25.0
+    prefetch_depth: int = 1
+    file_timeout: Optional[float] = None
+    max_file_memory: Optional[int] = None
+    file_attempts: int = 2
+    # the shard of the files that are extracted
+    shard_index: Optional[int] = None
+    num_shards: Optional[int] = None
+
+    def to_config(self) -> Dict[str, Any]:
+        """The options as json values, for the extract_config.json of the outputs"""
+        config: Dict[str, Any] = {}
+        for field in dataclasses.fields(self):
+            value = getattr(self, field.name)
+            if isinstance(value, pathlib.Path):
+                value = str(value)
+            elif isinstance(
+                value,
+                (
+                    orderly.extract.reaction_filter.ReactionFilter,
+                    orderly.extract.canonicalise.CostLimits,
+                ),
+            ):
+                value = value.to_config()
+            config[field.name] = value
+        return config
+
+
 def extract(
     output_path: pathlib.Path,
     file: pathlib.Path,
@@ -181,11 +320,23 @@ def extract(
     name_contains_substring: Optional[str] = None,
     inverse_substring: bool = False,
     overwrite: bool = True,
-) -> None:
+    config: ExtractionConfig = ExtractionConfig(),
+    chunk_reactions: bool = False,
+    preloaded_data: Optional[ord_dataset_pb2.Dataset] = None,
+) -> Optional[str]:
     """
-    Extract information from an ORD file.
+    Extract information from an ORD file with the options of config, returns the name of the outputs (None if the file was filtered out).
+    If config.other_labelling_output_path is set, the reactions are also extracted with the opposite trust_labelling in the same pass (see OrdExtractor.dual_labelling), and written to the same folders in other_labelling_output_path.
+    If config.batch_size is set the reactions are streamed from the file and written in row groups, so memory is bounded by the batch size rather than the size of the file.
+    If config.dataset_output is True the reactions are written to their own partition of a parquet dataset in output_path/extracted_ord_data_folder (see orderly.extract.dataset) rather than to a file per dataset.
+    If a config.reaction_filter is given, the reactions that fail it are not extracted, and the number of reactions dropped by each check is saved in each output tree, see get_reaction_filter_counts_path.
+    If config.drop_duplicates is True the output has the order invariant hash of each reaction, which main uses to drop the duplicates across files (see orderly.extract.duplicates).
+    If config.procedure_details_sidecar is True the procedure details are written to a compressed sidecar in each output tree rather than with the rest of the reactions, see orderly.extract.procedures.get_sidecar_path.
+    If chunk_reactions is True the reactions are split into chunks of config.reaction_chunk_size across all the cores, for the large files (see split_large_files).
+    preloaded_data is the already loaded file (see orderly.extract.prefetch.PrefetchingReader), if None the file is loaded here.
     """
     LOG.debug(f"Attempting extraction for {file}")
+    cache_stats_before = orderly.extract.canonicalise.get_cache_stats()
     instance = orderly.extract.extractor.OrdExtractor(
         ord_file_path=file,
         trust_labelling=trust_labelling,
@@ -194,46 +345,190 @@ def extract(
         solvents_set=solvents_set,
         contains_substring=name_contains_substring,
         inverse_contains_substring=inverse_substring,
+        canonicalisation_store_path=config.canonicalisation_store_path,
+        reaction_chunk_size=config.reaction_chunk_size if chunk_reactions else None,
+        batch_size=config.batch_size,
+        reaction_cache_path=config.reaction_cache_path,
+        list_columns=config.list_columns,
+        missing_value=None if config.missing_as_null else "<missing>",
+        dual_labelling=config.other_labelling_output_path is not None,
+        reaction_filter=config.reaction_filter,
+        reaction_hashes=config.drop_duplicates,
+        preloaded_data=preloaded_data,
+        cost_limits=config.cost_limits,
+        row_ids=config.procedure_details_sidecar,
     )
-    if instance.full_df is None:
+    if instance.filtered_out:
         LOG.debug(f"Skipping extraction for {file}")
-        return
+        return None
 
     filename = instance.filename
-    LOG.info(f"Completed extraction for {file}: {filename}")
+    # (output tree, trust_labelling) of each output, the opposite labelling goes to other_labelling_output_path
+    outputs = [(output_path, trust_labelling)]
+    if config.other_labelling_output_path is not None:
+        outputs.append((config.other_labelling_output_path, not trust_labelling))
+
+    for tree_path, labelling in outputs:
+        df_path = tree_path / extracted_ord_data_folder / f"{filename}.parquet"
+        if config.dataset_output:
+            df_path = orderly.extract.dataset.get_partition_path(
+                tree_path / extracted_ord_data_folder, filename
+            )
+        molecule_names_path = (
+            tree_path / molecule_names_folder / f"molecules_{filename}.parquet"
+        )
+        if not overwrite:
+            if df_path.exists():
+                e = FileExistsError(
+                    f"Trying to overwrite {df_path} which exists, overwrite must be true to do this"
+                )
+                LOG.error(e)
+                raise e
+            if molecule_names_path.exists():
+                e = FileExistsError(
+                    f"Trying to overwrite {molecule_names_path} which exists, overwrite must be true to do this"
+                )
+                LOG.error(e)
+                raise e
+
+    for tree_path, labelling in outputs:
+        df_path = tree_path / extracted_ord_data_folder / f"{filename}.parquet"
+        procedure_details_path = None
+        if config.procedure_details_sidecar:
+            procedure_details_path = orderly.extract.procedures.get_sidecar_path(
+                tree_path, filename
+            )
+        if config.dataset_output:
+            orderly.extract.dataset.write_partition(
+                instance,
+                tree_path / extracted_ord_data_folder,
+                filename,
+                trust_labelling=labelling,
+                procedure_details_path=procedure_details_path,
+            )
+        else:
+            instance.to_parquet(
+                df_path,
+                trust_labelling=labelling,
+                procedure_details_path=procedure_details_path,
+            )
+        LOG.debug(f"Saved df at {df_path}")
+
+        # index of the names used for molecules, as opposed to SMILES strings
+        # (the names of each reaction are unique, so a name is counted once per reaction)
+        non_smiles_names_list = instance.non_smiles_names_list
+        if labelling != trust_labelling:
+            non_smiles_names_list = instance.labelling_outputs[labelling][1]
+        assert non_smiles_names_list is not None, "we dont expect this to be none here"
+        molecule_names_path = (
+            tree_path / molecule_names_folder / f"molecules_{filename}.parquet"
+        )
+        molecule_names = orderly.extract.names.MoleculeNameIndex()
+        molecule_names.add(non_smiles_names_list, dataset=filename)
+        molecule_names.save(molecule_names_path)
+        LOG.debug(f"Saves molecule names for {filename} at {molecule_names_path}")
+
+        if instance.reaction_filter is not None:
+            # with batch_size the reactions are only extracted while they are written, so this is after to_parquet
+            counts_path = get_reaction_filter_counts_path(tree_path, filename)
+            counts_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(counts_path, "w") as f:
+                json.dump(instance.reaction_filter.get_dropped(labelling), f, indent=4)
 
-    df_path = output_path / extracted_ord_data_folder / f"{filename}.parquet"
-    molecule_names_path = (
-        output_path / molecule_names_folder / f"molecules_{filename}.csv"
+    LOG.info(f"Completed extraction for {file}: {filename}")
+    cache_stats = orderly.extract.canonicalise.get_cache_stats() - cache_stats_before
+    LOG.info(
+        f"Canonicalisation cache for {filename}: {cache_stats} (entries={len(orderly.extract.canonicalise.get_cache())})"
     )
-    if not overwrite:
-        if df_path.exists():
-            e = FileExistsError(
-                f"Trying to overwrite {df_path} which exists, overwrite must be true to do this"
-            )
-            LOG.error(e)
-            raise e
-        if molecule_names_path.exists():
-            e = FileExistsError(
-                f"Trying to overwrite {molecule_names_path} which exists, overwrite must be true to do this"
+    return filename
+
+
+def get_profile_path(output_path: pathlib.Path, filename: str) -> pathlib.Path:
+    return output_path / "profiles" / f"{filename}.json"
+
+
+def extract_and_profile(
+    output_path: pathlib.Path, file: pathlib.Path, **kwargs: Any
+) -> Optional[str]:
+    """Runs extract (see config.profile), and saves the time spent in each stage of the extraction of the file at output_path/profiles/{filename}.json, see get_profile_path"""
+    with orderly.extract.profiling.collect() as profiler:
+        filename = extract(output_path=output_path, file=file, **kwargs)
+        if filename is not None:
+            orderly.extract.profiling.save_profile(
+                profiler.snapshot(), get_profile_path(output_path, filename)
             )
-            LOG.error(e)
-            raise e
+    return filename
+
+
+def write_profile_report(
+    output_path: pathlib.Path,
+    filenames: List[str],
+    report_path: pathlib.Path,
+) -> None:
+    """Merges the profiles saved by extract for each file into one report (report_path.json and report_path.csv), and deletes the per-file profiles"""
+    profiles = {}
+    for filename in filenames:
+        profile_path = get_profile_path(output_path, filename)
+        if profile_path.exists():
+            profiles[filename] = orderly.extract.profiling.load_profile(profile_path)
+            profile_path.unlink()
+    total = orderly.extract.profiling.write_report(profiles, report_path)
+    for name, timings in sorted(
+        total.items(), key=lambda item: item[1]["seconds"], reverse=True
+    ):
+        LOG.info(
+            f"Profile: {name}: {timings['seconds']:.3f}s over {int(timings['calls'])} calls"
+        )
 
-    instance.full_df.to_parquet(df_path)
 
-    LOG.debug(f"Saved df at {df_path}")
+REACTION_FILTER_COUNTS_FOLDER = "reaction_filter_counts"
 
-    # list of the names used for molecules, as opposed to SMILES strings
-    # save the non_smiles_names_list to file
 
-    assert (
-        instance.non_smiles_names_list is not None
-    ), "we dont expect this to be none here"
-    orderly.data.util.save_list(
-        x=instance.non_smiles_names_list, path=molecule_names_path
-    )
-    LOG.debug(f"Saves molecule names for {filename} at {molecule_names_path}")
+def get_reaction_filter_counts_path(
+    output_path: pathlib.Path, filename: str
+) -> pathlib.Path:
+    return output_path / REACTION_FILTER_COUNTS_FOLDER / f"{filename}.json"
+
+
+def write_reaction_filter_report(output_path: pathlib.Path) -> Dict[str, int]:
+    """
+    Merges the number of reactions dropped by the reaction filter in each file of the output tree (saved by extract) into output_path/reaction_filter_counts.json, and returns the total per check.
+    The per-file counts are kept with the other outputs of each file (and deleted with them by the manifest), so the report of an incremental extraction also covers the files that were not extracted again.
+    """
+    files: Dict[str, Dict[str, int]] = {}
+    counts: collections.Counter[str] = collections.Counter()
+    for counts_path in sorted(
+        (output_path / REACTION_FILTER_COUNTS_FOLDER).glob("*.json")
+    ):
+        with open(counts_path) as f:
+            files[counts_path.stem] = json.load(f)
+        counts.update(files[counts_path.stem])
+    total = dict(sorted(counts.items()))
+    with open(output_path / "reaction_filter_counts.json", "w") as f:
+        json.dump({"total": total, "files": files}, f, indent=4)
+    for reason, count in total.items():
+        LOG.info(
+            f"Reaction filter for {output_path}: dropped {count} reactions ({reason})"
+        )
+    return total
+
+
+def write_quarantine_report(
+    output_path: pathlib.Path, quarantined: Dict[pathlib.Path, List[str]]
+) -> None:
+    """Saves the files that were quarantined by the extraction pool (with the reason each attempt failed) at output_path/quarantined_files.json"""
+    with open(output_path / "quarantined_files.json", "w") as f:
+        json.dump(
+            {str(file): reasons for file, reasons in sorted(quarantined.items())},
+            f,
+            indent=4,
+        )
+    if len(quarantined) > 0:
+        LOG.error(
+            f"{len(quarantined)} files were quarantined and not extracted, see {output_path / 'quarantined_files.json'}"
+        )
+    for file, reasons in sorted(quarantined.items()):
+        LOG.error(f"Quarantined {file}: {reasons}")
 
 
 @click.command()
@@ -258,7 +553,7 @@ def extract(
     show_default=False,
     help="""
 - If True, maintain the labelling and ordering of the original data.
-- If False: Trust the mapped reaction more than the labelled data. A reaction string should be of the form reactants>agents>products; however, agents (particularly reagents) may sometimes appear as reactants on the LHS, so any molecules on the LHS we re-label as a reagent if it (i) does not contain any atom mapped atoms, (ii) the molecule appears on both the LHS and RHS (ie it is unreacted). Note that the original labelling is trusted (by default) if the reaction is not mapped. The agents list consists of catalysts, reagents and solvents; any molecules that occur in the set of solvents are extracted from the agents list and re-labelled as solvents, while the remaining molecules remain labelled as agents. Then the list of agents and solvents is sorted alphabetically, and finally any molecules that contain a transition metal were moved to the front of the agents list; ideally these lists be sorted by using chemical reasoning (e.g. by amount or importance), however this information doesn't exist, so we sort alphabetically and move transition metal containing molecules to the front (since its likely to be a catalyst) to at least add some order, albeit an arbitrary one. Prior work indicates that sequential prediction of conditions (with the caatlyst first) outperforms predicting all conditions in a single output layer (https://doi.org/10.1021/acscentsci.8b00357), so ordering may be helpful.""",
+- If False: Trust the mapped reaction more than the labelled data. A reaction string should be of the form reactants>agents>products; however, agents (particularly reagents) may sometimes appear as reactants on the LHS, so any molecules on the LHS we re-label as a reagent if it (i) does not contain any atom mapped atoms, (ii) the molecule appears on both the LHS and RHS (ie it is unreacted). Note that the original labelling is trusted (by default) if the reaction is not mapped. The agents list consists of catalysts, reagents and solvents; any molecules that occur in the set of solvents are extracted from the agents list and re-labelled as solvents, while the remaining molecules remain labelled as agents. Then the list of agents and solvents is sorted alphabetically, and finally any molecules that contain a transition metal were moved to the front of the agents list; ideally these lists be sorted by using chemical reasoning (e.g. by amount or importance), however this information doesn't exist, so we sort alphabetically and move transition metal containing molecules to the front (since its likely to be a catalyst) to at least add some order, albeit an arbitrary one. Prior work indicates that sequential prediction of conditions (with the catalyst first) outperforms predicting all conditions in a single output layer (https://doi.org/10.1021/acscentsci.8b00357), so ordering may be helpful.""",
 )
 @click.option(
     "--consider_molecule_names",
@@ -330,6 +625,202 @@ def extract(
     show_default=True,
     help="If true, will overwrite existing files, else will through an error if a file exists",
 )
+@click.option(
+    "--canonicalisation_store_path",
+    type=str,
+    default="",
+    show_default=True,
+    help="Path to an sqlite file that persists canonicalised SMILES across extraction runs (e.g. data/orderly/canonical_smiles.sqlite). If left empty no store is used",
+)
+@click.option(
+    "--precanonicalise_molecules",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If true, first scan all the files for the unique molecules and canonicalise each once across a process pool (into the canonicalisation store, output_path/canonical_smiles.sqlite if no store path is given), then extract the reactions using this lookup",
+)
+@click.option(
+    "--include_cleaned_USPTO_file",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If true, also extract ord_dataset-de0979205c84441190feef587fef8d6d (a cleaned version of USPTO that is 10x bigger than any other ORD dataset), best combined with reaction_chunk_size",
+)
+@click.option(
+    "--reaction_chunk_size",
+    type=int,
+    default=0,
+    show_default=True,
+    help="If larger than 0 (and use_multiprocessing is true), files that are at least a worker's share of the total data are extracted one at a time with their reactions split into chunks of this size across all the cores. If 0 every file is extracted by a single worker",
+)
+@click.option(
+    "--batch_size",
+    type=int,
+    default=0,
+    show_default=True,
+    help="If larger than 0, stream the reactions of each file and extract and write them in batches of this size, so the memory of each worker is bounded by the batch size rather than the file size. If 0 each file is loaded in full",
+)
+@click.option(
+    "--incremental",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If true, keep a manifest of the extracted files in output_path and only extract files that are new, changed, or were extracted with a different config; the outputs of removed or changed files are deleted",
+)
+@click.option(
+    "--reaction_cache_path",
+    type=str,
+    default="",
+    show_default=True,
+    help="Path to a folder with a cache of the extracted reactions of each dataset (keyed by reaction_id and a digest of the reaction), so only new or changed reactions are extracted when a dataset is re-published. If left empty no cache is used",
+)
+@click.option(
+    "--list_columns",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If true, write one list column per molecule type (reactant, agent, ...) instead of one column per molecule (reactant_000, reactant_001, ...). orderly.clean expects the wide columns",
+)
+@click.option(
+    "--missing_as_null",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If true, missing molecules are written as nulls rather than the '<missing>' string",
+)
+@click.option(
+    "--dataset_output",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If True, the extracted data is written as one parquet dataset partitioned by ORD file (with dictionary encoded molecule columns and row group statistics) instead of a parquet file per ORD file, and the partitions are compacted to a common schema at the end",
+)
+@click.option(
+    "--annotate_molecules",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If True, after the extraction, builds a table of per-molecule properties (elements, transition metal flag, heavy atom count, formal charge) keyed by SMILES for all the molecules in the extracted data, and saves it next to the extracted data",
+)
+@click.option(
+    "--profile",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If True, records the wall time and number of calls of each stage of the extraction (e.g. rxn_input_extractor, canonicalise, apply_replacements_dict) per file, and writes a per-file and overall report as json and csv next to the log file",
+)
+@click.option(
+    "--max_memory_fraction",
+    type=float,
+    default=0.8,
+    show_default=True,
+    help="With use_multiprocessing, files are only started while the estimated memory of the files being extracted is within this fraction of the available memory. If 0 there is no cap",
+)
+@click.option(
+    "--memory_per_input_byte",
+    type=float,
+    default=25.0,
+    show_default=True,
+    help="The estimated peak memory needed to extract a file per byte of the (compressed) file, used for max_memory_fraction",
+)
+@click.option(
+    "--other_labelling_output_path",
+    type=str,
+    default="",
+    show_default=True,
+    help="If set, each file is also extracted with the opposite trust_labelling in the same pass (sharing the parsing and canonicalisation) and written to this output path, instead of running the extraction twice. If left empty only trust_labelling is extracted",
+)
+@click.option(
+    "--inventory_only",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If True, only scan the headers of the files (name, dataset_id, number of reactions) into output_path/dataset_inventory.json and log the number of reactions and an estimate of the extraction time, without extracting",
+)
+@click.option(
+    "--reaction_filter_path",
+    type=str,
+    default="",
+    show_default=True,
+    help="Path to a json file with the cleaning options (e.g. the clean_config.json written by orderly.clean, or any of num_reactant, num_product, num_solv, num_agent, num_cat, num_reag, remove_reactions_with_no_reactants, remove_reactions_with_no_products, remove_reactions_with_no_solvents, remove_reactions_with_no_agents, remove_reactions_with_no_conditions, require_mapped_rxn_str). The reactions that the cleaning would always drop with these options are dropped during the extraction, and the number dropped by each check is written to output_path/reaction_filter_counts.json. If left empty all reactions are extracted",
+)
+@click.option(
+    "--drop_duplicates",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If True, only the first occurrence (in the order of the output file names) of each reaction is kept across all the files, where reactions are the same if they have the same molecules of each type (in any order), yields, temperature and reaction time. The number of duplicates removed from each file is written to output_path/duplicate_counts.json",
+)
+@click.option(
+    "--prefetch_depth",
+    type=int,
+    default=1,
+    show_default=True,
+    help="The number of files that are read (and, without use_multiprocessing, decompressed and parsed) on a background thread ahead of the file being extracted, to hide the I/O latency. If 0 each file is read when its extraction starts",
+)
+@click.option(
+    "--shard_index",
+    type=int,
+    default=0,
+    show_default=True,
+    help="With num_shards, the shard of the files to extract (from 0 to num_shards - 1)",
+)
+@click.option(
+    "--num_shards",
+    type=int,
+    default=0,
+    show_default=True,
+    help="If larger than 0, the files are split into this many shards of about the same total size (the same on every node), and only the files of shard_index are extracted, to output_path/shards/shard_{shard_index}_of_{num_shards}. Once every shard is done, merge them into output_path with python -m orderly.extract.shards. If 0 all the files are extracted",
+)
+@click.option(
+    "--file_timeout",
+    type=float,
+    default=0,
+    show_default=True,
+    help="With use_multiprocessing, the worker of a file that takes longer than this many seconds is killed and the file is retried (see file_attempts). If 0 there is no limit",
+)
+@click.option(
+    "--max_file_memory_gb",
+    type=float,
+    default=0,
+    show_default=True,
+    help="With use_multiprocessing, the worker of a file that uses more than this much memory (GB) is killed and the file is retried (see file_attempts). If 0 there is no limit",
+)
+@click.option(
+    "--file_attempts",
+    type=int,
+    default=2,
+    show_default=True,
+    help="With use_multiprocessing, a file that fails (raises, crashes its worker, or goes over file_timeout or max_file_memory_gb) is tried this many times, then it is quarantined: it is listed in output_path/quarantined_files.json and the rest of the files are extracted",
+)
+@click.option(
+    "--max_identifier_length",
+    type=int,
+    default=orderly.extract.canonicalise.CostLimits.max_length,
+    show_default=True,
+    help="Molecule identifiers longer than this are not canonicalised, they are kept as unresolvable names (see orderly.extract.canonicalise.CostLimits). If 0 there is no limit",
+)
+@click.option(
+    "--max_identifier_atoms",
+    type=int,
+    default=orderly.extract.canonicalise.CostLimits.max_atoms,
+    show_default=True,
+    help="Molecule identifiers with more atoms than this are not canonicalised, they are kept as unresolvable names. If 0 there is no limit",
+)
+@click.option(
+    "--max_identifier_ring_closures",
+    type=int,
+    default=orderly.extract.canonicalise.CostLimits.max_ring_closures,
+    show_default=True,
+    help="Molecule identifiers with more ring closure digits than this are not canonicalised, they are kept as unresolvable names. If 0 there is no limit",
+)
+@click.option(
+    "--procedure_details_sidecar",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If True, the procedure details are written to a compressed sidecar (output_path/procedure_details) keyed by the row_id column of the extracted reactions, rather than with the rest of the reactions",
+)
 @click.option(
     "--log_file",
     type=str,
@@ -358,68 +849,40 @@ def main_click(
     name_contains_substring: str,
     inverse_substring: bool,
     overwrite: bool,
+    canonicalisation_store_path: str,
+    precanonicalise_molecules: bool,
+    include_cleaned_uspto_file: bool,
+    reaction_chunk_size: int,
+    batch_size: int,
+    incremental: bool,
+    reaction_cache_path: str,
+    list_columns: bool,
+    missing_as_null: bool,
+    dataset_output: bool,
+    annotate_molecules: bool,
+    profile: bool,
+    max_memory_fraction: float,
+    memory_per_input_byte: float,
+    other_labelling_output_path: str,
+    inventory_only: bool,
+    reaction_filter_path: str,
+    drop_duplicates: bool,
+    prefetch_depth: int,
+    shard_index: int,
+    num_shards: int,
+    file_timeout: float,
+    max_file_memory_gb: float,
+    file_attempts: int,
+    max_identifier_length: int,
+    max_identifier_atoms: int,
+    max_identifier_ring_closures: int,
+    procedure_details_sidecar: bool,
     log_file: str,
     log_level: int = logging.INFO,
 ) -> None:
     """
-    After downloading the dataset from ORD, this script will extract the data and write it to file. During extraction we also extract unresolvable/uncanonicalisable molecules and keep a record of these and then remove them during cleaning
-        Example:
-
-
-    Args:
-
-    1) data_path: str
-        - Path to the folder that contains the ORD data
-    2) ord_file_ending: str
-        - the file ending of the ord data typically ".pb.gz"
-    3) trust_labelling: Bool
-        - If True, maintain the labelling and ordering of the original data.
-        - If False: Trust the mapped reaction more than the labelled data. A reaction string should be of the form reactants>agents>products; however, agents (particularly reagents) may sometimes appear as reactants on the LHS, so any molecules on the LHS we re-label as a reagent if it (i) does not contain any atom mapped atoms, (ii) the molecule appears on both the LHS and RHS (ie it is unreacted). Note that the original labelling is trusted (by default) if the reaction is not mapped. The agents list consists of catalysts, reagents and solvents; any molecules that occur in the set of solvents are extracted from the agents list and re-labelled as solvents, while the remaining molecules remain labelled as agents. Then the list of agents and solvents is sorted alphabetically, and finally any molecules that contain a transition metal were moved to the front of the agents list; ideally these lists be sorted by using chemical reasoning (e.g. by amount or importance), however this information doesn't exist, so we sort alphabetically and move transition metal containing molecules to the front (since its likely to be a catalyst) to at least add some order, albeit an arbitrary one. Prior work indicates that sequential prediction of conditions (with the catalyst first) outperforms predicting all conditions in a single output layer (https://doi.org/10.1021/acscentsci.8b00357), so ordering may be helpful.
-    3) consider_molecule_names: bool
-    4) output_path: str
-        - The path to the folder than will contain the extracted_ord_data_folder and molecule_names_folder
-    5) extracted_ord_data_folder: str
-        - The name of folder than contains the extracted ord dataframes
-    6) solvents_path: Optional[str]
-        - The path to the solvents csv, if None will use the default
-    7) molecule_names_folder: str
-        - The name of the folder that contains the molecule_name per folder
-    8) merged_molecules_file: str
-        - The name and file tag of the merged_molecules file (the merged_molecules_file is outputed to output_path / merged_molecules_file)
-    9) use_multiprocessing: bool
-        - Boolean to make the processing of each ORD file done with multiprocessing
-    10) name_contains_substring: Optional[str]
-        - A filter for the ORD file names, will only extract files that includes the str. If left empty will not search for anything. For example 'uspto' grabs only uspto data (https://figshare.com/articles/dataset/Chemical_reactions_from_US_patents_1976-Sep2016_/5104873)
-    11) inverse_substring: bool
-        - Inversed the name contains substring, so name_contains_substring='uspto' & inverse_substring=True will exclude names with uspto in
-    12) overwrite: bool
-        - If true, will overwrite existing files, else will through an error if a file exists.
-
-
-    Functionality:
-
-    1) Data extracted from ORD comes in a large number of files (.pd.gz) batched in a large number of sub-folders. First step is to extract all filepaths that contain data of interest (e.g. everything if name_contains_substring is empty or only uspto data if name_contains_substring='uspto').
-    2) Iteration over all filepaths to extract the following data:
-        - The mapped reaction (unchanged)
-        - Reactants, products, and agents (reagents, solvents and catalysts)
-            - NB: If trust_labelling=True this info is extracted from .input and .outcomes labelling. If trust_labelling=False (default) it is extracted from the mapped reaction string & mapping is considered to reason on whether a molecule is a reactant, solvent, or agent.
-        - Temperature: All temperatures were converted to Celcius. If only the control type was specified, the following mapping was used: 'AMBIENT' -> 25, 'ICE_BATH' -> 0, 'DRY_ICE' -> -78.5, 'LIQUID_NITROGEN' -> -196.
-        - Time: All times were converted to hours.
-        - Yield (for each product): The PERCENTAGEYIELD was preferred, but if this was not available, the CALCULATEDPERCENTYIELD was used instead. If neither was available, the value was set to None.
-        - Procedure_details: Plain text string describing the procedure in English.
-    3) Canonicalisation and light cleaning
-        - All SMILES strings were canonicalised using RDKit.
-        - A "replacements dictionary" was created to replace common names with their corresponding SMILES strings. This dictionary was created by iterating over the most common names in the dataset and replacing them with their corresponding SMILES strings. This was done semi-manually, with some dictionary entries coming from solvents.csv and others being added within the script (in the build_replacements function; mainly concerning catalysts).
-        - The final light cleaning step depends on the value of trust_labelling (see above, in the Args section).
-        - Reactions will only be added if the reactants and products are different (i.e. no crystalisation reactions etc.)
-    4) Build a pandas DataFrame from this data (one for each ORD file), and save each as a file
-    5) Create a list of all molecule names and save as a file. This comes in handy when performing name resolution (many molecules are represented with an english name as opposed to a smiles string). A molecule is understood as having an english name (as opposed to a SMILES string) if it is unresolvable by RDKit.
-    6) Merge all the lists of molecule names to create a list of unique molecule names (in merged_molecules_file eg "data/ORD/all_molecule_names.csv").
-
-    Output:
-
-    1) A file with the cleaned data for each folder of data. NB: Temp always in C, time always in hours
-    2) A list of all unique molecule names (in merged_molecules_file)
+    The command line interface of main: after downloading the dataset from ORD, this script will extract the data and write it to file. During extraction we also extract unresolvable/uncanonicalisable molecules and keep a record of these and then remove them during cleaning
+    See main for the description of each argument, of the steps of the extraction and of the output. The paths are given as str and the solvents and reaction filter as paths to files, which are loaded here.
     """
 
     _solvents_path: Optional[pathlib.Path] = None
@@ -430,8 +893,37 @@ def main_click(
     if name_contains_substring != "":
         _name_contains_substring = name_contains_substring
 
+    _canonicalisation_store_path: Optional[pathlib.Path] = None
+    if canonicalisation_store_path != "":
+        _canonicalisation_store_path = pathlib.Path(canonicalisation_store_path)
+
+    _reaction_cache_path: Optional[pathlib.Path] = None
+    if reaction_cache_path != "":
+        _reaction_cache_path = pathlib.Path(reaction_cache_path)
+
+    _other_labelling_output_path: Optional[pathlib.Path] = None
+    if other_labelling_output_path != "":
+        _other_labelling_output_path = pathlib.Path(other_labelling_output_path)
+
+    _reaction_filter: Optional[orderly.extract.reaction_filter.ReactionFilter] = None
+    if reaction_filter_path != "":
+        _reaction_filter = orderly.extract.reaction_filter.ReactionFilter.load(
+            pathlib.Path(reaction_filter_path)
+        )
+
+    _shard_index: Optional[int] = None
+    _num_shards: Optional[int] = None
+    _log_path = pathlib.Path(output_path)
+    if num_shards > 0:
+        _shard_index = shard_index
+        _num_shards = num_shards
+        # a log per shard, as the shards may share the filesystem
+        _log_path = orderly.extract.shards.get_shard_path(
+            _log_path, shard_index, num_shards
+        )
+
     file_name = pathlib.Path(output_path).name
-    _log_file = pathlib.Path(output_path) / f"{file_name}_extract.log"
+    _log_file = _log_path / f"{file_name}_extract.log"
     if log_file != "default_path_extract.log":
         _log_file = pathlib.Path(log_file)
 
@@ -451,6 +943,46 @@ def main_click(
         overwrite=overwrite,
         log_file=_log_file,
         log_level=log_level,
+        config=ExtractionConfig(
+            canonicalisation_store_path=_canonicalisation_store_path,
+            reaction_chunk_size=reaction_chunk_size
+            if reaction_chunk_size > 0
+            else None,
+            batch_size=batch_size if batch_size > 0 else None,
+            reaction_cache_path=_reaction_cache_path,
+            list_columns=list_columns,
+            missing_as_null=missing_as_null,
+            dataset_output=dataset_output,
+            other_labelling_output_path=_other_labelling_output_path,
+            reaction_filter=_reaction_filter,
+            drop_duplicates=drop_duplicates,
+            cost_limits=orderly.extract.canonicalise.CostLimits(
+                max_length=max_identifier_length if max_identifier_length > 0 else None,
+                max_atoms=max_identifier_atoms if max_identifier_atoms > 0 else None,
+                max_ring_closures=max_identifier_ring_closures
+                if max_identifier_ring_closures > 0
+                else None,
+            ),
+            procedure_details_sidecar=procedure_details_sidecar,
+            precanonicalise_molecules=precanonicalise_molecules,
+            include_cleaned_USPTO_file=include_cleaned_uspto_file,
+            incremental=incremental,
+            annotate_molecules=annotate_molecules,
+            profile=profile,
+            inventory_only=inventory_only,
+            max_memory_fraction=max_memory_fraction
+            if max_memory_fraction > 0
+            else None,
+            memory_per_input_byte=memory_per_input_byte,
+            prefetch_depth=prefetch_depth,
+            file_timeout=file_timeout if file_timeout > 0 else None,
+            max_file_memory=int(max_file_memory_gb * 2**30)
+            if max_file_memory_gb > 0
+            else None,
+            file_attempts=file_attempts,
+            shard_index=_shard_index,
+            num_shards=_num_shards,
+        ),
     )
 
 
@@ -470,6 +1002,7 @@ def main(
     overwrite: bool,
     log_file: pathlib.Path = pathlib.Path("extraction.log"),
     log_level: int = logging.INFO,
+    config: Optional[ExtractionConfig] = None,
 ) -> None:
     """
     After downloading the dataset from ORD, this script will extract the data and write it to files.
@@ -484,7 +1017,7 @@ def main(
         - the file ending of the ord data typically ".pb.gz"
     3) trust_labelling: Bool
         - If True, maintain the labelling and ordering of the original data.
-        - If False: Trust the mapped reaction more than the labelled data. A reaction string should be of the form reactants>agents>products; however, agents (particularly reagents) may sometimes appear as reactants on the LHS, so any molecules on the LHS we re-label as a reagent if it (i) does not contain any atom mapped atoms, (ii) the molecule appears on both the LHS and RHS (ie it is unreacted). Note that the original labelling is trusted (by default) if the reaction is not mapped. The agents list consists of catalysts, reagents and solvents; any molecules that occur in the set of solvents are extracted from the agents list and re-labelled as solvents, while the remaining molecules remain labelled as agents. Then the list of agents and solvents is sorted alphabetically, and finally any molecules that contain a transition metal were moved to the front of the agents list; ideally these lists be sorted by using chemical reasoning (e.g. by amount or importance), however this information doesn't exist, so we sort alphabetically and move transition metal containing molecules to the front (since its likely to be a catalyst) to at least add some order, albeit an arbitrary one. Prior work indicates that sequential prediction of conditions (with the caatlyst first) outperforms predicting all conditions in a single output layer (https://doi.org/10.1021/acscentsci.8b00357), so ordering may be helpful.
+        - If False: Trust the mapped reaction more than the labelled data. A reaction string should be of the form reactants>agents>products; however, agents (particularly reagents) may sometimes appear as reactants on the LHS, so any molecules on the LHS we re-label as a reagent if it (i) does not contain any atom mapped atoms, (ii) the molecule appears on both the LHS and RHS (ie it is unreacted). Note that the original labelling is trusted (by default) if the reaction is not mapped. The agents list consists of catalysts, reagents and solvents; any molecules that occur in the set of solvents are extracted from the agents list and re-labelled as solvents, while the remaining molecules remain labelled as agents. Then the list of agents and solvents is sorted alphabetically, and finally any molecules that contain a transition metal were moved to the front of the agents list; ideally these lists be sorted by using chemical reasoning (e.g. by amount or importance), however this information doesn't exist, so we sort alphabetically and move transition metal containing molecules to the front (since its likely to be a catalyst) to at least add some order, albeit an arbitrary one. Prior work indicates that sequential prediction of conditions (with the catalyst first) outperforms predicting all conditions in a single output layer (https://doi.org/10.1021/acscentsci.8b00357), so ordering may be helpful.
     3) consider_molecule_names: bool
     4) output_path: pathlib.Path
         - The path to the folder than will contain the extracted_ord_data_folder and molecule_names_folder
@@ -504,6 +1037,60 @@ def main(
         - Inversed the name contains substring, so name_contains_substring='uspto' & inverse_substring=True will exclude names with uspto in
     12) overwrite: bool
         - If true, will overwrite existing files, else will through an error if a file exists.
+    13) config: Optional[ExtractionConfig]
+        - The options of the extraction, ExtractionConfig() if None. From the command line each option has its own flag (the paths are given as str, and 0 or an empty string is None).
+        - canonicalisation_store_path: Optional[pathlib.Path]
+            - Path to an sqlite file that persists canonicalised SMILES across extraction runs, keyed by RDKit version. If left empty no store is used.
+        - precanonicalise_molecules: bool
+            - If true, first scan all the files for the unique molecules and canonicalise each once across a process pool, then extract the reactions using this lookup (stored in the canonicalisation store, output_path/canonical_smiles.sqlite if no store path is given).
+        - include_cleaned_USPTO_file: bool
+            - If true, also extract ord_dataset-de0979205c84441190feef587fef8d6d (a cleaned version of USPTO that is 10x bigger than any other ORD dataset).
+        - reaction_chunk_size: Optional[int]
+            - If set (and use_multiprocessing is true), files that are at least a worker's share of the total data are extracted one at a time with their reactions split into chunks of this size across all the cores. The output is identical to extracting the file in one go.
+        - batch_size: Optional[int]
+            - If set, the reactions of each file are streamed and extracted in batches of this size, and written to the parquet file one row group at a time. Peak memory per worker is then bounded by the batch size rather than the file size, and the output is the same as loading the whole file.
+        - incremental: bool
+            - If true, keep a manifest (output_path/extract_manifest.json) of each extracted file's size, mtime, content hash and extraction config hash (trust_labelling, consider_molecule_names, replacements dict, solvents set and name filter). Files that match their entry are not extracted again, and the outputs of files that have been removed or changed are deleted.
+        - reaction_cache_path: Optional[pathlib.Path]
+            - Path to a folder with a cache of the extracted rows of each dataset, keyed by reaction_id and a digest of the serialised reaction. Only new or changed reactions are run through handle_reaction_object; the output is rebuilt from the cached rows and the new ones.
+        - list_columns: bool
+            - If true, write one list column per molecule type (reactant, agent, reagent, solvent, catalyst, product, yield) instead of the wide columns (reactant_000, reactant_001, ...). orderly.clean expects the wide columns.
+        - missing_as_null: bool
+            - If true, missing molecules are written as nulls rather than the '<missing>' string.
+        - dataset_output: bool
+            - If True, the extracted data is written as one parquet dataset in output_path/extracted_ord_data_folder, partitioned by source_file (one hive style directory per ORD file, named after the file, so the workers write to it independently). The molecule columns are dictionary encoded and min/max statistics are written for each row group. At the end the partitions are compacted to the schema of the whole dataset, so it can be read in one scan (see orderly.extract.dataset.read_dataset), with filters on source_file only reading the matching partitions.
+        - annotate_molecules: bool
+            - If True, after the extraction, builds a table of per-molecule properties (elements, transition metal flag, heavy atom count, formal charge) keyed by SMILES for all the molecules in the extracted data, and saves it at output_path/molecule_annotations.parquet (see orderly.extract.annotations.MoleculeAnnotationTable.load).
+        - profile: bool
+            - If True, records the wall time and number of calls of each stage of the extraction per file (in each worker), and writes a per-file and overall report next to the log file ({log_file stem}_profile.json and {log_file stem}_profile.csv).
+        - max_memory_fraction: Optional[float]
+            - With use_multiprocessing, the files are extracted on a pool of workers that receive the shared state (replacements dict, solvents set) once when they start. The files are started largest first, but only while the estimated memory of the files being extracted (memory_per_input_byte * file size) is within this fraction of the available memory. If None there is no cap.
+        - memory_per_input_byte: float
+            - The estimated peak memory needed to extract a file per byte of the (compressed) file.
+        - other_labelling_output_path: Optional[pathlib.Path]
+            - If set, each file is also extracted with the opposite value of trust_labelling in the same pass, and written to this output path (with the same folder and file names as output_path). The labelled molecules, rxn string and conditions of each reaction are extracted once and the molecules are canonicalised once for both outputs, which is much cheaper than a second run. consider_molecule_names is the same for both outputs. Can't be combined with batch_size, reaction_cache_path or incremental.
+        - inventory_only: bool
+            - If True, only read the header of each file (name, dataset_id and number of reactions, without parsing the reactions), save the inventory at output_path/dataset_inventory.json, log the number of reactions and a rough estimate of the extraction time, and exit without extracting. The inventory is also used (and cached) by every extraction to apply the name_contains_substring filter before any file is loaded.
+        - reaction_filter: Optional[orderly.extract.reaction_filter.ReactionFilter]
+            - If set, reactions that orderly.clean would always drop with the same options (e.g. too many reactants, no products, see orderly.extract.reaction_filter.ReactionFilter) are dropped while they are extracted, so they are never written or read back. The number of reactions dropped by each check is written to output_path/reaction_filter_counts.json (and in other_labelling_output_path). Can't be combined with other_labelling_output_path (the cleaning options depend on trust_labelling) or reaction_cache_path. From the command line the filter is loaded from a json file (reaction_filter_path), e.g. the clean_config.json of a previous cleaning.
+        - drop_duplicates: bool
+            - If True, each reaction gets an order invariant hash of its molecules (of each type), yields, temperature and reaction time (the reaction_hash column), and once all the files are extracted only the first occurrence of each hash is kept, going through the outputs in the order of their names (so the result doesn't depend on the order the workers finish in). The number of duplicates removed from each file is written to output_path/duplicate_counts.json. This is stricter than the drop_duplicates of orderly.clean (which only compares the molecules, and keeps a random occurrence), so only reactions that it would also consider duplicates are removed. Can't be combined with incremental, as the outputs of a file depend on the files before it.
+        - prefetch_depth: int
+            - The files are read ahead of their extraction on a background thread, so reading (e.g. from a network filesystem), decompressing and parsing the next file overlaps with the extraction of the current one. Without use_multiprocessing (and for the large files extracted in chunks) up to prefetch_depth files are loaded ahead (each is held in memory until it is extracted), with use_multiprocessing the next prefetch_depth files to be started are read into the page cache by the parent. Ignored with batch_size, which streams the files. If 0 there is no prefetching.
+        - shard_index: Optional[int]
+            - The shard extracted by this process, see num_shards.
+        - num_shards: Optional[int]
+            - If set, the extraction is split across num_shards processes (e.g. on different nodes with a shared filesystem), each run with its own shard_index. The files that pass the filename filter are split into shards of about the same total size, going from the largest file to the smallest (see orderly.extract.shards.assign_shards), which only depends on the names and sizes of the files, so every node computes the same shards. Each shard writes its own output tree (with its config, manifest and log) at output_path/shards/shard_{shard_index}_of_{num_shards} (and likewise in other_labelling_output_path), and a shard.json once it is complete. The steps that depend on all the files (drop_duplicates, compacting the dataset_output and annotate_molecules) are skipped, and run by orderly.extract.shards.merge_shards (python -m orderly.extract.shards), which combines the shards into output_path so it is the same as extracting all the files in one run.
+        - file_timeout: Optional[float]
+            - With use_multiprocessing, each file runs under a wall-clock budget of this many seconds: the worker of a file that overruns it is killed (the other files in flight are restarted on a new pool), and the file counts as failed. If None there is no limit. The large files extracted in chunks (reaction_chunk_size) and the extraction without use_multiprocessing run in the main process, so they have no budget.
+        - max_file_memory: Optional[int]
+            - With use_multiprocessing, the worker of a file that uses more than this many bytes (its resident memory, checked every second) is killed, and the file counts as failed. If None there is no limit.
+        - file_attempts: int
+            - With use_multiprocessing, a file that fails (raises an error, kills its worker, e.g. a segfault in RDKit, or overruns file_timeout or max_file_memory) is retried until it has been tried file_attempts times. It is then quarantined and the rest of the run continues: the quarantined files and the reason each attempt failed are written to output_path/quarantined_files.json, and they are not recorded in the manifest, so an incremental extraction tries them again. If a worker dies while several files are in flight, they are run again one at a time to find the file that killed it.
+        - cost_limits: orderly.extract.canonicalise.CostLimits
+            - Limits on the length, number of atom tokens and number of ring closures of the molecule identifiers that are canonicalised. Polymers, large clusters and garbage strings can take orders of magnitude longer to parse with RDKit than a typical molecule, so an identifier over a limit is not parsed: it is kept as an unresolvable name (like an english name) and counted in the canonicalisation cache stats logged for each file. The default limits are well above the molecules of typical reactions. From the command line the limits are max_identifier_length, max_identifier_atoms and max_identifier_ring_closures (0 is no limit).
+        - procedure_details_sidecar: bool
+            - If True, the free-text procedure details (often kilobytes per reaction, most of the size of the extracted files) are not written with the rest of the reactions, but to a zstd compressed sidecar per file, output_path/procedure_details/{filename}.parquet (and likewise in other_labelling_output_path), with a row id column (the ORD reaction_id, or the dataset id and the position of the reaction in the dataset if it has none) in both the reactions and the sidecar to join them (see orderly.extract.procedures). The readers of the extracted data (e.g. orderly.clean) only read the columns they need, and join the procedure details from the sidecar when they are asked for. The rows of the reactions removed by drop_duplicates are left in the sidecar.
 
 
     Functionality:
@@ -524,7 +1111,7 @@ def main(
         - Reactions will only be added if the reactants and products are different (i.e. no crystalisation reactions etc.)
     4) Build a pandas DataFrame from this data (one for each ORD file), and save each as a file
     5) Create a list of all molecule names and save as a file. This comes in handy when performing name resolution (many molecules are represented with an english name as opposed to a smiles string). A molecule is understood as having an english name (as opposed to a SMILES string) if it is unresolvable by RDKit.
-    6) Merge all the lists of molecule names to create a list of unique molecule names (in merged_molecules_file eg "data/ORD/all_molecule_names.csv").
+    6) Merge the per-file indices of molecule names (with counts) to create a list of unique molecule names (in merged_molecules_file eg "data/ORD/all_molecule_names.csv") and an index of the names ranked by frequency, with the datasets they occur in (the same path with a .parquet suffix, see orderly.extract.names.MoleculeNameIndex).
 
     Output:
 
@@ -566,6 +1153,72 @@ def main(
             e = ValueError(f"Expect str: got {type(name_contains_substring)}")
             LOG.error(e)
             raise e
+    if config is None:
+        config = ExtractionConfig()
+    if config.other_labelling_output_path is not None:
+        if not isinstance(config.other_labelling_output_path, pathlib.Path):
+            e = ValueError(
+                f"Expect pathlib.Path: got {type(config.other_labelling_output_path)}"
+            )
+            LOG.error(e)
+            raise e
+        if (
+            config.batch_size is not None
+            or config.reaction_cache_path is not None
+            or config.incremental
+        ):
+            e = ValueError(
+                "other_labelling_output_path can't be combined with batch_size, reaction_cache_path or incremental"
+            )
+            LOG.error(e)
+            raise e
+    if config.reaction_filter is not None:
+        if (
+            config.other_labelling_output_path is not None
+            or config.reaction_cache_path is not None
+        ):
+            # the cleaning options (num_agent, num_cat, num_reag) depend on trust_labelling
+            e = ValueError(
+                "reaction_filter can't be combined with other_labelling_output_path or reaction_cache_path"
+            )
+            LOG.error(e)
+            raise e
+    if config.drop_duplicates and config.incremental:
+        e = ValueError("drop_duplicates can't be combined with incremental")
+        LOG.error(e)
+        raise e
+    if config.file_attempts < 1:
+        e = ValueError(
+            f"Expect at least one attempt per file: got {config.file_attempts=}"
+        )
+        LOG.error(e)
+        raise e
+    if not use_multiprocessing and (
+        config.file_timeout is not None or config.max_file_memory is not None
+    ):
+        LOG.warning(
+            "file_timeout and max_file_memory are only applied with use_multiprocessing"
+        )
+
+    shard_index, num_shards = config.shard_index, config.num_shards
+    if num_shards is not None:
+        if shard_index is None or not 0 <= shard_index < num_shards:
+            e = ValueError(
+                f"Expect 0 <= shard_index < {num_shards=}: got {shard_index=}"
+            )
+            LOG.error(e)
+            raise e
+        output_path = orderly.extract.shards.get_shard_path(
+            output_path, shard_index, num_shards
+        )
+        if config.other_labelling_output_path is not None:
+            config = dataclasses.replace(
+                config,
+                other_labelling_output_path=orderly.extract.shards.get_shard_path(
+                    config.other_labelling_output_path, shard_index, num_shards
+                ),
+            )
+    other_labelling_output_path = config.other_labelling_output_path
 
     LOG.info("starting extraction")
     start_time = datetime.datetime.now()
@@ -573,14 +1226,109 @@ def main(
     extracted_ords_path = output_path / extracted_ord_data_folder
     molecule_name_path = output_path / molecule_names_folder
 
-    extracted_ords_path.mkdir(parents=True, exist_ok=True)
-    molecule_name_path.mkdir(parents=True, exist_ok=True)
+    # (output tree, trust_labelling) of each output, see other_labelling_output_path
+    output_trees = [(output_path, trust_labelling)]
+    if other_labelling_output_path is not None:
+        output_trees.append((other_labelling_output_path, not trust_labelling))
 
-    files = get_file_names(directory=data_path, file_ending=ord_file_ending)
+    for tree_path, _ in output_trees:
+        (tree_path / extracted_ord_data_folder).mkdir(parents=True, exist_ok=True)
+        (tree_path / molecule_names_folder).mkdir(parents=True, exist_ok=True)
+
+    files = get_file_names(
+        directory=data_path,
+        file_ending=ord_file_ending,
+        include_cleaned_USPTO_file=config.include_cleaned_USPTO_file,
+    )
+
+    # apply the filename filter on the headers, so the files that are filtered out are never loaded
+    inventory = orderly.extract.inventory.DatasetInventory(
+        output_path / "dataset_inventory.json"
+    )
+    infos = inventory.scan(files, count_reactions=config.inventory_only)
+    files = orderly.extract.inventory.filter_files(
+        infos, name_contains_substring, inverse_substring
+    )
+    LOG.info(f"{len(files)} of {len(infos)} files pass the filename filter")
+    infos = {file: infos[file] for file in files}
+    inventory.save()
+    if num_shards is not None:
+        assert shard_index is not None
+        files = orderly.extract.shards.get_shard(
+            files,
+            shard_index,
+            num_shards,
+            sizes={file: info.size for file, info in infos.items()},
+        )
+        LOG.info(f"Shard {shard_index} of {num_shards}: extracting {len(files)} files")
+        infos = {file: infos[file] for file in files}
+    shard_files = files
+    num_workers = 1
+    if use_multiprocessing:
+        # somewhat dangerous imports so keeping localised
+        import multiprocessing
+
+        num_workers = multiprocessing.cpu_count()
+    if all(info.num_reactions is not None for info in infos.values()):
+        orderly.extract.inventory.log_summary(infos, num_workers=num_workers)
+    if config.inventory_only:
+        LOG.info(f"Saved the inventory at {inventory.path}")
+        return
 
-    solvents_set = orderly.data.solvents.get_solvents_set(path=solvents_path)
+    solvents_set = orderly.data.solvents.get_solvents_set(
+        path=solvents_path,
+        canonicalisation_store_path=config.canonicalisation_store_path,
+    )
     manual_replacements_dict = get_manual_replacements_dict(solvents_path=solvents_path)
 
+    manifest: Optional[orderly.extract.manifest.ExtractionManifest] = None
+    if config.incremental:
+        config_hash = orderly.extract.manifest.hash_extraction_config(
+            trust_labelling=trust_labelling,
+            consider_molecule_names=consider_molecule_names,
+            manual_replacements_dict=manual_replacements_dict,
+            solvents_set=solvents_set,
+            name_contains_substring=name_contains_substring,
+            inverse_substring=inverse_substring,
+            list_columns=config.list_columns,
+            missing_as_null=config.missing_as_null,
+            dataset_output=config.dataset_output,
+            reaction_filter=None
+            if config.reaction_filter is None
+            else config.reaction_filter.to_config(),
+            cost_limits=config.cost_limits.to_config(),
+            procedure_details_sidecar=config.procedure_details_sidecar,
+        )
+        manifest = orderly.extract.manifest.ExtractionManifest(
+            output_path / "extract_manifest.json"
+        )
+        files = manifest.remove_stale(
+            files,
+            config_hash=config_hash,
+            extracted_ords_path=extracted_ords_path,
+            molecule_names_path=molecule_name_path,
+            procedure_details_path=output_path
+            / orderly.extract.procedures.PROCEDURE_DETAILS_FOLDER,
+            reaction_filter_counts_path=output_path / REACTION_FILTER_COUNTS_FOLDER,
+        )
+        manifest.save()
+
+    if config.precanonicalise_molecules:
+        if config.canonicalisation_store_path is None:
+            config = dataclasses.replace(
+                config,
+                canonicalisation_store_path=output_path / "canonical_smiles.sqlite",
+            )
+        assert config.canonicalisation_store_path is not None
+        orderly.extract.lookup.build_molecule_lookup(
+            files=files,
+            store_path=config.canonicalisation_store_path,
+            consider_molecule_names=consider_molecule_names,
+            name_contains_substring=name_contains_substring,
+            inverse_substring=inverse_substring,
+            use_multiprocessing=use_multiprocessing,
+        )
+
     kwargs = {
         "output_path": output_path,
         "trust_labelling": trust_labelling,
@@ -592,52 +1340,164 @@ def main(
         "name_contains_substring": name_contains_substring,
         "inverse_substring": inverse_substring,
         "overwrite": overwrite,
+        "config": config,
     }
+    # the time spent in each stage is collected around each extraction, in the workers too
+    extract_func: Callable[..., Optional[str]] = (
+        extract_and_profile if config.profile else extract
+    )
 
-    config_path = output_path / "extract_config.json"
-    if not overwrite:
-        if config_path.exists():
-            e = FileExistsError(
-                f"You are trying to overwrite the config file at {config_path} with {overwrite=}"
+    for tree_path, labelling in output_trees:
+        config_path = tree_path / "extract_config.json"
+        if not (overwrite or config.incremental):
+            if config_path.exists():
+                e = FileExistsError(
+                    f"You are trying to overwrite the config file at {config_path} with {overwrite=}"
+                )
+                LOG.error(e)
+                raise e
+        copy_kwargs = {
+            **{key: value for key, value in kwargs.items() if key != "config"},
+            **config.to_config(),
+        }
+        copy_kwargs["output_path"] = str(tree_path)
+        copy_kwargs["trust_labelling"] = labelling
+        if other_labelling_output_path is not None:
+            # the config of each tree records the other one
+            copy_kwargs["other_labelling_output_path"] = str(
+                output_path if tree_path != output_path else other_labelling_output_path
             )
-            LOG.error(e)
-            raise e
-    copy_kwargs = kwargs.copy()
-    copy_kwargs["output_path"] = str(copy_kwargs["output_path"])
-    copy_kwargs["solvents_set"] = sorted(list(copy_kwargs["solvents_set"]))  # type: ignore
+        copy_kwargs["solvents_set"] = sorted(list(copy_kwargs["solvents_set"]))  # type: ignore
 
-    with open(config_path, "w") as f:
-        json.dump(copy_kwargs, f, indent=4, sort_keys=True)
+        with open(config_path, "w") as f:
+            json.dump(copy_kwargs, f, indent=4, sort_keys=True)
+
+    extracted_filenames: List[str] = []
+    quarantined: Dict[pathlib.Path, List[str]] = {}
+
+    stream_files = config.batch_size is not None
+
+    def load_file(file: pathlib.Path) -> Optional[ord_dataset_pb2.Dataset]:
+        if stream_files:
+            # the file is streamed by the extraction
+            return None
+        return orderly.extract.extractor.OrdExtractor.load_data(file)
+
+    def record(files: List[pathlib.Path], filenames: List[Optional[str]]) -> None:
+        extracted_filenames.extend(
+            filename for filename in filenames if filename is not None
+        )
+        if manifest is None:
+            return
+        for file, filename in zip(files, filenames):
+            manifest.update(file, config_hash=config_hash, output_filename=filename)
+        manifest.save()
 
+    interrupted = False
     try:
         if use_multiprocessing:
             # somewhat dangerous imports so keeping localised
             import multiprocessing
-            import joblib
 
             num_cores = multiprocessing.cpu_count()
+            large_files: List[pathlib.Path] = []
+            if config.reaction_chunk_size is not None:
+                files, large_files = split_large_files(files, num_workers=num_cores)
             with tqdm.contrib.logging.logging_redirect_tqdm(loggers=[LOG]):
-                joblib.Parallel(n_jobs=num_cores)(
-                    joblib.delayed(extract)(file=file, **kwargs)
-                    for file in tqdm.tqdm(files)
+                progress = tqdm.tqdm(total=len(files))
+
+                def on_result(file: pathlib.Path, filename: Optional[str]) -> None:
+                    record([file], [filename])
+                    progress.update()
+
+                quarantined = orderly.extract.pool.run_extraction_pool(
+                    files,
+                    func=extract_func,
+                    shared_kwargs=kwargs,
+                    num_workers=num_cores,
+                    on_result=on_result,
+                    max_memory_fraction=config.max_memory_fraction,
+                    memory_per_input_byte=config.memory_per_input_byte,
+                    prefetch_depth=config.prefetch_depth
+                    if config.batch_size is None
+                    else 0,
+                    file_timeout=config.file_timeout,
+                    max_file_memory=config.max_file_memory,
+                    max_attempts=config.file_attempts,
                 )
+                progress.close()
+                # the large files use all the cores themselves, so we extract them one at a time
+                with orderly.extract.prefetch.PrefetchingReader(
+                    large_files, load=load_file, depth=config.prefetch_depth
+                ) as reader:
+                    for file, data in tqdm.tqdm(reader, total=len(large_files)):
+                        filename = extract_func(file=file, chunk_reactions=True, preloaded_data=data, **kwargs)  # type: ignore
+                        record([file], [filename])
         else:
             with tqdm.contrib.logging.logging_redirect_tqdm(loggers=[LOG]):
-                for file in tqdm.tqdm(files):
-                    LOG.debug(f"Attempting extraction for {file}")
-                    extract(file=file, **kwargs)  # type: ignore
-                    # mypy fails with kwargs
+                with orderly.extract.prefetch.PrefetchingReader(
+                    files, load=load_file, depth=config.prefetch_depth
+                ) as reader:
+                    for file, data in tqdm.tqdm(reader, total=len(files)):
+                        LOG.debug(f"Attempting extraction for {file}")
+                        filename = extract_func(file=file, preloaded_data=data, **kwargs)  # type: ignore
+                        # mypy fails with kwargs
+                        record([file], [filename])
     except KeyboardInterrupt:
         LOG.info(
             "KeyboardInterrupt: exiting the extraction but will quickly merge the files"
         )
-        pass
-
-    merge_mol_names(
-        molecule_names_path=molecule_name_path,
-        output_file_path=output_path / merged_molecules_file,
-        overwrite=overwrite,
-        molecule_names_file_ending=".csv",
-    )
+        interrupted = True
+
+    if use_multiprocessing:
+        write_quarantine_report(output_path, quarantined)
+
+    # the steps that depend on all the files are run when the shards are merged
+    sharded = num_shards is not None
+    for tree_path, _ in output_trees:
+        if config.drop_duplicates and not sharded:
+            orderly.extract.duplicates.drop_duplicate_reactions(
+                orderly.extract.duplicates.get_output_files(
+                    tree_path / extracted_ord_data_folder
+                ),
+                report_path=tree_path / "duplicate_counts.json",
+            )
+        merge_mol_names(
+            molecule_names_path=tree_path / molecule_names_folder,
+            output_file_path=tree_path / merged_molecules_file,
+            overwrite=overwrite or config.incremental,
+            molecule_names_file_ending=".parquet",
+        )
+        if config.dataset_output and not sharded:
+            orderly.extract.dataset.compact_dataset(
+                tree_path / extracted_ord_data_folder,
+                missing_value=None if config.missing_as_null else "<missing>",
+            )
+    if config.reaction_filter is not None:
+        for tree_path, _ in output_trees:
+            write_reaction_filter_report(tree_path)
+    if config.profile:
+        write_profile_report(
+            output_path,
+            extracted_filenames,
+            report_path=log_file.parent / f"{log_file.stem}_profile",
+        )
+    if config.annotate_molecules and not sharded:
+        for tree_path, _ in output_trees:
+            orderly.extract.annotations.annotate_extracted_ords(
+                extracted_ords_path=tree_path / extracted_ord_data_folder,
+                output_file_path=tree_path / "molecule_annotations.parquet",
+            )
+    if sharded and not interrupted:
+        # an interrupted shard has no record, so it can't be merged
+        assert shard_index is not None and num_shards is not None
+        for tree_path, _ in output_trees:
+            orderly.extract.shards.write_shard_record(
+                tree_path,
+                shard_index,
+                num_shards,
+                files=shard_files,
+                filenames=extracted_filenames,
+            )
     end_time = datetime.datetime.now()
     LOG.info("Duration: {}".format(end_time - start_time))
@@ -0,0 +1,187 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import pathlib
+import shutil
+from typing import Any, Dict, List, Optional, Set
+
+import rdkit
+
+import orderly.extract.dataset
+from orderly.types import *
+
+LOG = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class ManifestEntry:
+    """The state of an input file when it was extracted, output_filename is None if the file was filtered out"""
+
+    size: int
+    mtime_ns: int
+    content_hash: str
+    config_hash: str
+    output_filename: Optional[str]
+
+
+def hash_file(path: pathlib.Path, chunk_size: int = 2**20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_extraction_config(
+    trust_labelling: bool,
+    consider_molecule_names: bool,
+    manual_replacements_dict: MANUAL_REPLACEMENTS_DICT,
+    solvents_set: Set[SOLVENT],
+    name_contains_substring: Optional[str],
+    inverse_substring: bool,
+    **output_options: Any,
+) -> str:
+    """A hash of everything that changes the output of the extraction for a given input file (including the RDKit version, which changes the canonical SMILES), output_options are options that change the format of the output"""
+    config = {
+        **output_options,
+        "trust_labelling": trust_labelling,
+        "consider_molecule_names": consider_molecule_names,
+        "manual_replacements_dict": manual_replacements_dict,
+        "solvents_set": sorted(solvents_set),
+        "name_contains_substring": name_contains_substring,
+        "inverse_substring": inverse_substring,
+        "rdkit_version": rdkit.__version__,
+    }
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class ExtractionManifest:
+    """
+    Records, for each ORD file in a previous extraction, its size, mtime and content hash, the hash of the extraction config, and the name of its outputs.
+    A file is up to date if its config hash matches and it is unchanged on disk; the content is only hashed when the size matches but the mtime does not (e.g. the file was copied or touched).
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        self.entries: Dict[str, ManifestEntry] = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.entries = {
+                    file: ManifestEntry(**entry) for file, entry in json.load(f).items()
+                }
+            LOG.debug(f"Loaded manifest with {len(self.entries)} entries from {path}")
+
+    def is_up_to_date(self, file: pathlib.Path, config_hash: str) -> bool:
+        entry = self.entries.get(str(file))
+        if entry is None or entry.config_hash != config_hash:
+            return False
+        stat = file.stat()
+        if stat.st_size != entry.size:
+            return False
+        if stat.st_mtime_ns == entry.mtime_ns:
+            return True
+        return hash_file(file) == entry.content_hash
+
+    def update(
+        self,
+        file: pathlib.Path,
+        config_hash: str,
+        output_filename: Optional[str],
+    ) -> None:
+        stat = file.stat()
+        self.entries[str(file)] = ManifestEntry(
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            content_hash=hash_file(file),
+            config_hash=config_hash,
+            output_filename=output_filename,
+        )
+
+    def remove(
+        self,
+        file: str,
+        extracted_ords_path: pathlib.Path,
+        molecule_names_path: pathlib.Path,
+        procedure_details_path: Optional[pathlib.Path] = None,
+        reaction_filter_counts_path: Optional[pathlib.Path] = None,
+    ) -> None:
+        """Drops the entry for the file and deletes its outputs (a parquet file, or a partition if the output is a dataset, its procedure details sidecar in procedure_details_path and its reaction filter counts in reaction_filter_counts_path)"""
+        entry = self.entries.pop(file, None)
+        if entry is None or entry.output_filename is None:
+            return
+        outputs = [
+            extracted_ords_path / f"{entry.output_filename}.parquet",
+            molecule_names_path / f"molecules_{entry.output_filename}.parquet",
+            molecule_names_path / f"molecules_{entry.output_filename}.csv",
+        ]
+        if procedure_details_path is not None:
+            outputs.append(procedure_details_path / f"{entry.output_filename}.parquet")
+        if reaction_filter_counts_path is not None:
+            outputs.append(
+                reaction_filter_counts_path / f"{entry.output_filename}.json"
+            )
+        for output in outputs:
+            if output.exists():
+                output.unlink()
+                LOG.debug(f"Removed stale output {output}")
+        partition_path = orderly.extract.dataset.get_partition_path(
+            extracted_ords_path, entry.output_filename
+        )
+        if partition_path.exists():
+            shutil.rmtree(partition_path)
+            LOG.debug(f"Removed stale partition {partition_path}")
+
+    def remove_stale(
+        self,
+        files: List[pathlib.Path],
+        config_hash: str,
+        extracted_ords_path: pathlib.Path,
+        molecule_names_path: pathlib.Path,
+        procedure_details_path: Optional[pathlib.Path] = None,
+        reaction_filter_counts_path: Optional[pathlib.Path] = None,
+    ) -> List[pathlib.Path]:
+        """
+        Deletes the outputs of files that have been removed or changed since the last extraction, and returns the files that need to be extracted.
+        """
+        file_names = set(str(file) for file in files)
+        for file in sorted(set(self.entries) - file_names):
+            LOG.info(f"{file} is no longer in the data, removing its outputs")
+            self.remove(
+                file,
+                extracted_ords_path,
+                molecule_names_path,
+                procedure_details_path,
+                reaction_filter_counts_path,
+            )
+
+        files_to_extract = []
+        for file in files:
+            if self.is_up_to_date(file, config_hash):
+                continue
+            self.remove(
+                str(file),
+                extracted_ords_path,
+                molecule_names_path,
+                procedure_details_path,
+                reaction_filter_counts_path,
+            )
+            files_to_extract.append(file)
+        LOG.info(
+            f"{len(files) - len(files_to_extract)} of {len(files)} files are up to date in {self.path}"
+        )
+        return files_to_extract
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(
+                {
+                    file: dataclasses.asdict(entry)
+                    for file, entry in sorted(self.entries.items())
+                },
+                f,
+                indent=4,
+            )
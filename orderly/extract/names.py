@@ -0,0 +1,96 @@
+import collections
+import logging
+import pathlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import orderly.data.util
+from orderly.types import *
+
+LOG = logging.getLogger(__name__)
+
+
+class MoleculeNameIndex:
+    """
+    The molecule identifiers that could not be resolved to SMILES (typically english names), with the number of reactions each occurs in and the datasets (ORD files) it came from.
+    Indices are merged by adding the counts, so each worker can index its own file and the indices are combined without concatenating lists of names.
+    The index is saved as a parquet file sorted by descending count, so the most frequent names can be read first.
+    """
+
+    def __init__(self) -> None:
+        self.counts: Dict[MOLECULE_IDENTIFIER, int] = collections.Counter()
+        self.datasets: Dict[MOLECULE_IDENTIFIER, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __contains__(self, name: MOLECULE_IDENTIFIER) -> bool:
+        return name in self.counts
+
+    def add(self, names: Iterable[MOLECULE_IDENTIFIER], dataset: str) -> None:
+        """Counts each occurrence of a name (the names of a reaction are expected to be unique)"""
+        for name in names:
+            self.counts[name] += 1
+            self.datasets.setdefault(name, set()).add(dataset)
+
+    def update(self, other: "MoleculeNameIndex") -> None:
+        for name, count in other.counts.items():
+            self.counts[name] += count
+            self.datasets.setdefault(name, set()).update(other.datasets[name])
+
+    def names(self) -> Set[MOLECULE_IDENTIFIER]:
+        return set(self.counts)
+
+    def most_common(
+        self, n: Optional[int] = None
+    ) -> List[Tuple[MOLECULE_IDENTIFIER, int]]:
+        """The names with their counts by descending count (then name)"""
+        ranked = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return ranked if n is None else ranked[:n]
+
+    def to_arrow(self) -> pa.Table:
+        ranked = self.most_common()
+        return pa.table(
+            {
+                "name": pa.array([name for name, _ in ranked], pa.string()),
+                "count": pa.array([count for _, count in ranked], pa.int64()),
+                "datasets": pa.array(
+                    [sorted(self.datasets[name]) for name, _ in ranked],
+                    pa.list_(pa.string()),
+                ),
+            }
+        )
+
+    def save(self, path: pathlib.Path) -> None:
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(self.to_arrow(), path)
+        LOG.debug(f"Saved {len(self)} molecule names to {path}")
+
+    @staticmethod
+    def load(path: pathlib.Path) -> "MoleculeNameIndex":
+        index = MoleculeNameIndex()
+        table = pq.read_table(path, columns=["name", "count", "datasets"])
+        for name, count, datasets in zip(
+            table.column("name").to_pylist(),
+            table.column("count").to_pylist(),
+            table.column("datasets").to_pylist(),
+        ):
+            index.counts[name] += count
+            index.datasets.setdefault(name, set()).update(datasets)
+        return index
+
+
+def load_molecule_names(path: pathlib.Path) -> List[MOLECULE_IDENTIFIER]:
+    """
+    Loads the names of a molecule name index (.parquet, only the name column is read) or of a csv list of names (as saved by orderly.data.util.save_list).
+    """
+    path = pathlib.Path(path)
+    if path.suffix == ".parquet":
+        names: List[MOLECULE_IDENTIFIER] = (
+            pq.read_table(path, columns=["name"]).column("name").to_pylist()
+        )
+        return names
+    return orderly.data.util.load_list(path)
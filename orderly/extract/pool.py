@@ -0,0 +1,266 @@
+import concurrent.futures
+import concurrent.futures.process
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import pathlib
+import queue
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import psutil
+
+import orderly.extract.prefetch
+
+LOG = logging.getLogger(__name__)
+
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def _init_worker(
+    func: Callable[..., Any],
+    shared_kwargs: Dict[str, Any],
+    log_queue: Any,
+    log_level: int,
+    started_queue: Any,
+) -> None:
+    """Runs once when a worker starts: keeps the shared state (replacements dict, solvents set, ...) and sends the logs to the parent"""
+    _WORKER_STATE["func"] = func
+    _WORKER_STATE["shared_kwargs"] = shared_kwargs
+    _WORKER_STATE["started_queue"] = started_queue
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(log_level)
+
+
+def _run_in_worker(file: pathlib.Path) -> Any:
+    # the parent needs the process of each file to enforce its budget
+    _WORKER_STATE["started_queue"].put((os.getpid(), str(file)))
+    return _WORKER_STATE["func"](file=file, **_WORKER_STATE["shared_kwargs"])
+
+
+def estimate_memory(file: pathlib.Path, memory_per_input_byte: float) -> int:
+    """A rough estimate of the peak memory needed to extract a file, proportional to its size on disk"""
+    return int(file.stat().st_size * memory_per_input_byte)
+
+
+def schedule_largest_first(files: List[pathlib.Path]) -> List[pathlib.Path]:
+    """Orders the files by descending size (then name), so a big file isn't left running alone at the end"""
+    return sorted(files, key=lambda file: (-file.stat().st_size, str(file)))
+
+
+def run_extraction_pool(
+    files: List[pathlib.Path],
+    func: Callable[..., Any],
+    shared_kwargs: Dict[str, Any],
+    num_workers: int,
+    on_result: Callable[[pathlib.Path, Any], None],
+    max_memory_fraction: Optional[float] = 0.8,
+    memory_per_input_byte: float = 25.0,
+    prefetch_depth: int = 1,
+    file_timeout: Optional[float] = None,
+    max_file_memory: Optional[int] = None,
+    max_attempts: int = 2,
+    poll_interval: float = 1.0,
+) -> Dict[pathlib.Path, List[str]]:
+    """
+    Runs func(file=file, **shared_kwargs) for each file on a pool of num_workers processes.
+    The shared_kwargs are sent to each worker once when it starts, so only the file path is sent per task. The workers are started from a fork server (or spawned where there is none), so func and the shared_kwargs must be picklable, and each worker opens its own files and connections (e.g. the canonicalisation store).
+    Files are submitted largest first; a file is only started if the estimated memory of the files in flight (memory_per_input_byte * size on disk) stays within max_memory_fraction of the available memory, otherwise a smaller file that fits is started instead (a file always starts if nothing else is running).
+    on_result(file, result) is called in the parent as each file finishes, and the logs of the workers are handled by the handlers of the parent's root logger.
+    A worker only learns its next file when it is done with the previous one, so the parent reads the next prefetch_depth pending files on a background thread (see orderly.extract.prefetch.warm_file), and the worker finds them in the page cache rather than waiting on the disk or network.
+
+    A file fails if func raises, if its worker dies (e.g. a segfault or the OOM killer), or if it runs for more than file_timeout seconds or its worker uses more than max_file_memory bytes (checked every poll_interval seconds), in which case its worker is killed. The other files in flight are restarted on a new pool without counting as an attempt; if a worker dies while several files are in flight, they are run again one at a time to find the file that killed it. A failed file is retried until it has failed max_attempts times, then it is quarantined and the run continues. Returns the quarantined files, with the reason for each failure.
+    """
+    quarantined: Dict[pathlib.Path, List[str]] = {}
+    if len(files) == 0:
+        return quarantined
+    memory_budget: Optional[int] = None
+    if max_memory_fraction is not None and max_memory_fraction > 0:
+        memory_budget = int(psutil.virtual_memory().available * max_memory_fraction)
+    estimates = {file: estimate_memory(file, memory_per_input_byte) for file in files}
+    pending = schedule_largest_first(files)
+    LOG.info(
+        f"Extracting {len(files)} files on {num_workers} workers, {memory_budget=} bytes, {file_timeout=}s, {max_file_memory=} bytes"
+    )
+
+    # the workers are not forked from this process: the log listener and prefetch threads are running, and the canonicalisation store's sqlite connection can't be shared across a fork
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        # the fork server imports the module of func once, rather than each worker on start
+        ctx.set_forkserver_preload([func.__module__])
+    else:
+        ctx = multiprocessing.get_context("spawn")
+    log_queue = ctx.Queue()
+    started_queue = ctx.Queue()
+    root = logging.getLogger()
+    listener = logging.handlers.QueueListener(
+        log_queue, *root.handlers, respect_handler_level=True
+    )
+    listener.start()
+
+    def start_executor() -> concurrent.futures.ProcessPoolExecutor:
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(func, shared_kwargs, log_queue, root.level, started_queue),
+        )
+
+    executor = start_executor()
+    in_flight: Dict[concurrent.futures.Future[Any], pathlib.Path] = {}
+    # the worker process and start time of the files in flight that have started
+    running: Dict[pathlib.Path, Tuple[int, float]] = {}
+    # the reason each file in flight was killed
+    killed: Dict[pathlib.Path, str] = {}
+    # the files that were in flight when a worker died, which are run one at a time
+    suspects: List[pathlib.Path] = []
+    failures: Dict[pathlib.Path, List[str]] = {}
+    reserved = 0
+    warmer: Optional[concurrent.futures.ThreadPoolExecutor] = None
+    warmed: Set[pathlib.Path] = set()
+    if prefetch_depth > 0:
+        warmer = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="orderly-prefetch"
+        )
+
+    def fail(file: pathlib.Path, reason: str) -> None:
+        failures.setdefault(file, []).append(reason)
+        if len(failures[file]) >= max_attempts:
+            quarantined[file] = failures[file]
+            LOG.error(
+                f"Quarantined {file} after {len(failures[file])} failed attempts: {failures[file]}"
+            )
+        else:
+            LOG.warning(f"Retrying {file} which failed: {reason}")
+            pending.append(file)
+
+    try:
+        while len(pending) > 0 or len(suspects) > 0 or len(in_flight) > 0:
+            if len(suspects) > 0:
+                if len(in_flight) == 0:
+                    suspect = suspects.pop(0)
+                    in_flight[executor.submit(_run_in_worker, suspect)] = suspect
+                    reserved += estimates[suspect]
+            while (
+                len(suspects) == 0 and len(pending) > 0 and len(in_flight) < num_workers
+            ):
+                file: Optional[pathlib.Path] = pending[0]
+                if memory_budget is not None and len(in_flight) > 0:
+                    file = next(
+                        (
+                            f
+                            for f in pending
+                            if reserved + estimates[f] <= memory_budget
+                        ),
+                        None,
+                    )
+                if file is None:
+                    LOG.debug(
+                        f"Waiting for memory: {reserved} of {memory_budget} bytes reserved"
+                    )
+                    break
+                pending.remove(file)
+                in_flight[executor.submit(_run_in_worker, file)] = file
+                reserved += estimates[file]
+            if warmer is not None:
+                for file in pending[:prefetch_depth]:
+                    if file not in warmed:
+                        warmed.add(file)
+                        warmer.submit(orderly.extract.prefetch.warm_file, file)
+
+            done, _ = concurrent.futures.wait(
+                in_flight,
+                timeout=poll_interval,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+
+            in_flight_files = set(in_flight.values())
+            while True:
+                try:
+                    pid, file_str = started_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pathlib.Path(file_str) in in_flight_files:
+                    running[pathlib.Path(file_str)] = (pid, time.monotonic())
+            now = time.monotonic()
+            for file, (pid, start) in running.items():
+                if file in killed:
+                    continue
+                reason: Optional[str] = None
+                try:
+                    if file_timeout is not None and now - start > file_timeout:
+                        reason = f"timed out after {file_timeout}s"
+                    elif max_file_memory is not None:
+                        rss = psutil.Process(pid).memory_info().rss
+                        if rss > max_file_memory:
+                            reason = f"used {rss} bytes, more than {max_file_memory}"
+                    if reason is not None:
+                        LOG.warning(f"Killing the worker of {file}, which {reason}")
+                        killed[file] = reason
+                        psutil.Process(pid).kill()
+                except psutil.NoSuchProcess:
+                    pass
+
+            broken: List[pathlib.Path] = []
+            for future in done:
+                file = in_flight.pop(future)
+                reserved -= estimates[file]
+                running.pop(file, None)
+                try:
+                    result = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    broken.append(file)
+                    continue
+                except Exception as e:
+                    fail(file, f"{type(e).__name__}: {e}")
+                    continue
+                on_result(file, result)
+
+            if len(broken) > 0:
+                # a dead worker breaks the whole pool, so every file in flight is stopped
+                for future in concurrent.futures.wait(in_flight).done:
+                    file = in_flight.pop(future)
+                    reserved -= estimates[file]
+                    exception = future.exception()
+                    if exception is None:
+                        on_result(file, future.result())
+                    elif isinstance(
+                        exception, concurrent.futures.process.BrokenProcessPool
+                    ):
+                        broken.append(file)
+                    else:
+                        fail(file, f"{type(exception).__name__}: {exception}")
+                running.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = start_executor()
+                culprits = [file for file in broken if file in killed]
+                if len(culprits) == 0 and len(broken) == 1:
+                    culprits = broken
+                    killed[broken[0]] = "the worker died"
+                for file in broken:
+                    if file in culprits:
+                        fail(file, killed[file])
+                    elif len(culprits) > 0:
+                        pending.insert(0, file)
+                    else:
+                        suspects.append(file)
+                if len(culprits) == 0:
+                    LOG.warning(
+                        f"A worker died while extracting {[str(f) for f in broken]}, running them one at a time"
+                    )
+                killed.clear()
+                pending = schedule_largest_first(pending)
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    else:
+        executor.shutdown()
+    finally:
+        if warmer is not None:
+            warmer.shutdown(wait=False, cancel_futures=True)
+        listener.stop()
+    return quarantined
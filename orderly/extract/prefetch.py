@@ -0,0 +1,92 @@
+import logging
+import pathlib
+import queue
+import threading
+import types
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Type
+
+LOG = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 1 << 20
+
+
+class PrefetchingReader:
+    """
+    Iterates over (file, load(file)) with the next files loaded on a background thread, so reading, decompressing and parsing a file overlaps with the processing of the previous one (gzip and file reads release the GIL).
+    The thread only starts loading a file once there is a free slot, so at most depth files are loaded (or being loaded) ahead of the one the consumer is processing, which bounds the extra memory. If depth is 0 nothing is loaded (the value is None), so the consumer loads the file itself.
+    An exception raised by load is raised when its file is reached. Use as a context manager so the thread is stopped if the consumer stops early.
+    """
+
+    def __init__(
+        self,
+        files: List[pathlib.Path],
+        load: Callable[[pathlib.Path], Any],
+        depth: int = 1,
+    ) -> None:
+        self.files = list(files)
+        self.load = load
+        self.depth = depth
+        self._queue: "queue.Queue[Tuple[pathlib.Path, Any, Optional[Exception]]]" = (
+            queue.Queue()
+        )
+        # a slot is taken before a file is loaded, and given back when the consumer takes the file
+        self._slots = threading.Semaphore(max(depth, 1))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        for file in self.files:
+            while not self._slots.acquire(timeout=0.1):
+                if self._stop.is_set():
+                    return
+            if self._stop.is_set():
+                return
+            try:
+                item = (file, self.load(file), None)
+            except Exception as exc:
+                item = (file, None, exc)
+            self._queue.put(item)
+
+    def __iter__(self) -> Iterator[Tuple[pathlib.Path, Any]]:
+        if self.depth <= 0:
+            for file in self.files:
+                yield file, None
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="orderly-prefetch", daemon=True
+            )
+            self._thread.start()
+        for _ in self.files:
+            file, value, exc = self._queue.get()
+            self._slots.release()
+            if exc is not None:
+                raise exc
+            yield file, value
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "PrefetchingReader":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[types.TracebackType],
+    ) -> None:
+        self.close()
+
+
+def warm_file(file: pathlib.Path) -> None:
+    """Reads a file and discards it, so it is in the page cache when a worker loads it (e.g. from a network filesystem)"""
+    try:
+        with open(file, "rb") as f:
+            while f.read(READ_CHUNK_SIZE):
+                pass
+    except OSError as exc:
+        LOG.debug(f"Could not prefetch {file}: {exc}")
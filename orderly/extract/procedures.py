@@ -0,0 +1,105 @@
+import logging
+import pathlib
+from typing import Optional, Sequence, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+LOG = logging.getLogger(__name__)
+
+PROCEDURE_DETAILS_COLUMN = "procedure_details"
+# the key of a reaction in its extracted file and in the sidecar, see get_row_ids
+ROW_ID_COLUMN = "row_id"
+PROCEDURE_DETAILS_FOLDER = "procedure_details"
+# the free text columns, which the readers of the extracted data skip unless they ask for them
+TEXT_COLUMNS = (PROCEDURE_DETAILS_COLUMN,)
+SIDECAR_SCHEMA = pa.schema(
+    [(ROW_ID_COLUMN, pa.string()), (PROCEDURE_DETAILS_COLUMN, pa.string())]
+)
+SIDECAR_COMPRESSION = "zstd"
+
+
+def get_sidecar_path(tree_path: pathlib.Path, filename: str) -> pathlib.Path:
+    """The procedure details of the reactions extracted from one ORD file, next to the extracted_ords and molecule_names folders of the output tree"""
+    return tree_path / PROCEDURE_DETAILS_FOLDER / f"{filename}.parquet"
+
+
+def get_row_ids(
+    dataset_id: str, reaction_ids: Sequence[str], reaction_indices: Sequence[int]
+) -> pa.Array:
+    """
+    The ids of the reactions extracted from a dataset: the ORD reaction_id of each reaction, or the dataset id and the position of the reaction in the dataset if it has no reaction_id.
+    Neither depends on the extraction options, so the ids are the same whether the file is streamed, extracted in chunks or in one go, or with different filters, and they are unique across files.
+    """
+    return pa.array(
+        [
+            reaction_id if reaction_id != "" else f"{dataset_id}:{reaction_index}"
+            for reaction_id, reaction_index in zip(reaction_ids, reaction_indices)
+        ],
+        type=pa.string(),
+    )
+
+
+def split_table(table: pa.Table) -> Tuple[pa.Table, pa.Table]:
+    """Splits the extracted table, which has a ROW_ID_COLUMN (see OrdExtractor.row_ids), into the table without the procedure details and the sidecar table of (row_id, procedure_details)"""
+    if ROW_ID_COLUMN not in table.column_names:
+        e = ValueError(f"Expect a {ROW_ID_COLUMN} column to key the procedure details")
+        LOG.error(e)
+        raise e
+    sidecar = pa.Table.from_arrays(
+        [
+            table.column(ROW_ID_COLUMN).cast(pa.string()),
+            table.column(PROCEDURE_DETAILS_COLUMN).cast(pa.string()),
+        ],
+        schema=SIDECAR_SCHEMA,
+    )
+    return table.drop([PROCEDURE_DETAILS_COLUMN]), sidecar
+
+
+def open_sidecar_writer(path: pathlib.Path) -> pq.ParquetWriter:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return pq.ParquetWriter(path, SIDECAR_SCHEMA, compression=SIDECAR_COMPRESSION)
+
+
+def read_procedure_details(
+    procedure_details_path: pathlib.Path,
+    row_ids: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    """The (row_id, procedure_details) of the sidecar files in procedure_details_path, only of the given row_ids if not None"""
+    value_set = None if row_ids is None else pa.array(row_ids, type=pa.string())
+    tables = [SIDECAR_SCHEMA.empty_table()]
+    for file in sorted(pathlib.Path(procedure_details_path).glob("*.parquet")):
+        table = pq.read_table(file)
+        if value_set is not None:
+            # filtered file by file, so only the text that is asked for is held in memory
+            table = table.filter(
+                pc.is_in(table.column(ROW_ID_COLUMN), value_set=value_set)
+            )
+        tables.append(table)
+    return pa.concat_tables(tables).to_pandas()
+
+
+def join_procedure_details(
+    df: pd.DataFrame, procedure_details_path: pathlib.Path
+) -> pd.DataFrame:
+    """
+    Adds the procedure details of each reaction of the df from the sidecar files, matched on ROW_ID_COLUMN (the order and index of the df are kept).
+    Rows of the sidecar without a reaction (e.g. reactions removed as duplicates after the extraction) are ignored, and a reaction found in several sidecar files (e.g. an ORD file that was extracted twice) takes the first.
+    """
+    if ROW_ID_COLUMN not in df.columns:
+        e = ValueError(
+            f"Expect a {ROW_ID_COLUMN} column to join the procedure details from {procedure_details_path}"
+        )
+        LOG.error(e)
+        raise e
+    procedure_details = read_procedure_details(
+        procedure_details_path, row_ids=df[ROW_ID_COLUMN].tolist()
+    ).drop_duplicates(subset=ROW_ID_COLUMN)
+    procedure_details = procedure_details.set_index(ROW_ID_COLUMN)[
+        PROCEDURE_DETAILS_COLUMN
+    ]
+    df = df.copy()
+    df[PROCEDURE_DETAILS_COLUMN] = df[ROW_ID_COLUMN].map(procedure_details)
+    return df
@@ -0,0 +1,158 @@
+import contextlib
+import csv
+import dataclasses
+import functools
+import json
+import logging
+import pathlib
+import time
+from typing import Any, Callable, ContextManager, Dict, Iterator, Mapping, TypeVar
+
+LOG = logging.getLogger(__name__)
+
+PROFILE = Dict[str, Dict[str, float]]  # stage -> {"calls": ..., "seconds": ...}
+
+
+@dataclasses.dataclass
+class StageTimings:
+    calls: int = 0
+    seconds: float = 0.0
+
+
+class Profiler:
+    """
+    Accumulates the wall time and number of calls of named stages of the extraction.
+    When disabled, stage() returns a shared no-op context manager, so the instrumentation costs a function call per stage.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.stages: Dict[str, StageTimings] = {}
+
+    @contextlib.contextmanager
+    def _timed(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings = self.stages.get(name)
+            if timings is None:
+                timings = self.stages[name] = StageTimings()
+            timings.calls += 1
+            timings.seconds += time.perf_counter() - start
+
+    def stage(self, name: str) -> ContextManager[None]:
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._timed(name)
+
+    def snapshot(self) -> PROFILE:
+        return {
+            name: {"calls": timings.calls, "seconds": timings.seconds}
+            for name, timings in sorted(self.stages.items())
+        }
+
+    def merge(self, profile: Mapping[str, Mapping[str, float]]) -> None:
+        """Adds the timings of a snapshot (e.g. from another process) to this profiler"""
+        for name, timings in profile.items():
+            stage_timings = self.stages.setdefault(name, StageTimings())
+            stage_timings.calls += int(timings["calls"])
+            stage_timings.seconds += float(timings["seconds"])
+
+    def reset(self) -> None:
+        self.stages = {}
+
+
+_NULL_CONTEXT = contextlib.nullcontext()
+_PROFILER = Profiler()
+
+
+def get_profiler() -> Profiler:
+    return _PROFILER
+
+
+def enable(enabled: bool = True) -> None:
+    _PROFILER.enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _PROFILER.enabled
+
+
+@contextlib.contextmanager
+def collect() -> Iterator[Profiler]:
+    """
+    Enables the process-wide profiler with empty timings for the body of the with statement, then restores the previous timings, so the timings of e.g. a chunk extracted by a worker can be returned to the parent (even if the worker turns out to be the parent process).
+    """
+    enabled, stages = _PROFILER.enabled, _PROFILER.stages
+    _PROFILER.enabled, _PROFILER.stages = True, {}
+    try:
+        yield _PROFILER
+    finally:
+        _PROFILER.enabled, _PROFILER.stages = enabled, stages
+
+
+def stage(name: str) -> ContextManager[None]:
+    """Times the body of a with statement as the named stage of the process-wide profiler (if it is enabled)"""
+    return _PROFILER.stage(name)
+
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def profiled(func: _F) -> _F:
+    """Decorator that times each call of func as a stage named after the function"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if not _PROFILER.enabled:
+            return func(*args, **kwargs)
+        with _PROFILER._timed(name):
+            return func(*args, **kwargs)
+
+    return wrapper  # type: ignore
+
+
+def merge_profiles(profiles: Mapping[str, Mapping[str, Any]]) -> PROFILE:
+    profiler = Profiler()
+    for profile in profiles.values():
+        profiler.merge(profile)
+    return profiler.snapshot()
+
+
+def save_profile(profile: PROFILE, path: pathlib.Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=4)
+
+
+def load_profile(path: pathlib.Path) -> PROFILE:
+    with open(path) as f:
+        profile: PROFILE = json.load(f)
+    return profile
+
+
+def write_report(profiles: Mapping[str, PROFILE], path: pathlib.Path) -> PROFILE:
+    """
+    Writes the timings of each file and their total as path.json and path.csv (path is the stem), returns the total.
+    The csv has one row per (file, stage), with "total" as the file for the merged timings.
+    """
+    total = merge_profiles(profiles)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix(".json"), "w") as f:
+        json.dump(
+            {"total": total, "files": dict(sorted(profiles.items()))}, f, indent=4
+        )
+    with open(path.with_suffix(".csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "stage", "calls", "seconds", "seconds_per_call"])
+        for file, profile in [("total", total)] + sorted(profiles.items()):
+            for name, timings in profile.items():
+                calls = int(timings["calls"])
+                seconds = float(timings["seconds"])
+                writer.writerow(
+                    [file, name, calls, seconds, seconds / calls if calls > 0 else 0.0]
+                )
+    LOG.info(f"Saved the extraction profile of {len(profiles)} files to {path}.json")
+    return total
@@ -0,0 +1,127 @@
+import collections
+import dataclasses
+import json
+import logging
+import pathlib
+from typing import Any, Dict, List, Mapping, Optional
+
+from orderly.types import *
+
+LOG = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class ReactionFilter:
+    """
+    Cheap reaction level checks of orderly.clean that are applied during the extraction (see OrdExtractor.handle_reaction_object), so reactions that are always dropped by the cleaning are never written or read back.
+    The fields have the names (and meaning, -1 is no limit) of the options of orderly.clean, so a clean_config.json can be loaded with ReactionFilter.load. The checks are conservative: a reaction is only dropped if the cleaning would drop it whatever it does with the unresolved names, so the molecule limits only count the molecules that were canonicalised to SMILES, and the checks for missing molecules count every molecule. The number of reactions dropped by each check is counted per value of trust_labelling in dropped.
+    require_mapped_rxn_str has no equivalent in orderly.clean, it drops the reactions without an atom mapped reaction string before any molecule is extracted.
+    """
+
+    require_mapped_rxn_str: bool = False
+    remove_reactions_with_no_reactants: bool = False
+    remove_reactions_with_no_products: bool = False
+    remove_reactions_with_no_solvents: bool = False
+    remove_reactions_with_no_agents: bool = False
+    remove_reactions_with_no_conditions: bool = False
+    num_reactant: int = -1
+    num_product: int = -1
+    num_solv: int = -1
+    num_agent: int = -1
+    num_cat: int = -1
+    num_reag: int = -1
+
+    def __post_init__(self) -> None:
+        self.dropped: Dict[bool, collections.Counter[str]] = {}
+
+    def to_config(self) -> Dict[str, Any]:
+        return {
+            field.name: getattr(self, field.name) for field in dataclasses.fields(self)
+        }
+
+    def without_counts(self) -> "ReactionFilter":
+        """A copy of the filter with no reactions dropped, e.g. for a worker that returns its counts to the parent"""
+        return ReactionFilter(**self.to_config())
+
+    @staticmethod
+    def load(path: pathlib.Path) -> "ReactionFilter":
+        """Loads the filter from a json file with any of the fields, e.g. the clean_config.json written by orderly.clean (the other options are ignored)"""
+        with open(path) as f:
+            config = json.load(f)
+        names = [field.name for field in dataclasses.fields(ReactionFilter)]
+        reaction_filter = ReactionFilter(
+            **{name: config[name] for name in names if name in config}
+        )
+        LOG.info(f"Loaded reaction filter from {path}: {reaction_filter.to_config()}")
+        return reaction_filter
+
+    def drop(self, trust_labelling: bool, reason: str) -> None:
+        counts = self.dropped.setdefault(trust_labelling, collections.Counter())
+        counts[reason] += 1
+
+    def get_dropped(self, trust_labelling: bool) -> Dict[str, int]:
+        return dict(sorted(self.dropped.get(trust_labelling, {}).items()))
+
+    def merge(self, dropped: Mapping[bool, Mapping[str, int]]) -> None:
+        """Adds the counts of another filter (e.g. from another process)"""
+        for trust_labelling, counts in dropped.items():
+            for reason, count in counts.items():
+                self.dropped.setdefault(trust_labelling, collections.Counter())[
+                    reason
+                ] += count
+
+    def check_rxn_str(self, is_mapped: bool) -> Optional[str]:
+        """The reason the reaction is dropped based on its reaction string, None if it is kept"""
+        if self.require_mapped_rxn_str and not is_mapped:
+            return "no_mapped_rxn_str"
+        return None
+
+    def check_molecules(
+        self,
+        reactants: REACTANTS,
+        agents: AGENTS,
+        reagents: REAGENTS,
+        solvents: SOLVENTS,
+        catalysts: CATALYSTS,
+        products: PRODUCTS,
+        non_smiles_names: List[MOLECULE_IDENTIFIER],
+    ) -> Optional[str]:
+        """The reason the reaction is dropped based on its (canonicalised) molecules, None if it is kept"""
+        if self.remove_reactions_with_no_reactants and len(reactants) == 0:
+            return "no_reactants"
+        if self.remove_reactions_with_no_products and len(products) == 0:
+            return "no_products"
+        if self.remove_reactions_with_no_solvents and len(solvents) == 0:
+            return "no_solvents"
+        # without agents (trust_labelling=True) orderly.clean checks the catalysts and reagents instead
+        if self.remove_reactions_with_no_agents and (
+            len(agents) + len(reagents) + len(catalysts) == 0
+        ):
+            return "no_agents"
+        if self.remove_reactions_with_no_conditions and (
+            len(agents) + len(reagents) + len(solvents) + len(catalysts) == 0
+        ):
+            return "no_conditions"
+
+        # the unresolved names may be set to None by orderly.clean, so only the SMILES count towards the limits
+        names = set(non_smiles_names)
+
+        def count(molecules: List[MOLECULE_IDENTIFIER]) -> int:
+            return sum(1 for molecule in molecules if molecule not in names)
+
+        for reason, molecules, limit in (
+            ("too_many_reactants", reactants, self.num_reactant),
+            ("too_many_products", products, self.num_product),
+            ("too_many_solvents", solvents, self.num_solv),
+            ("too_many_agents", agents, self.num_agent),
+        ):
+            if limit != -1 and count(molecules) > limit:
+                return reason
+        # orderly.clean may rename the catalysts beyond num_cat as reagents, so only their sum is checked
+        if (
+            self.num_cat != -1
+            and self.num_reag != -1
+            and count(catalysts) + count(reagents) > self.num_cat + self.num_reag
+        ):
+            return "too_many_catalysts_and_reagents"
+        return None
@@ -0,0 +1,339 @@
+import collections
+import json
+import logging
+import pathlib
+import shutil
+from typing import Any, Dict, List, Optional
+
+import click
+
+import orderly.extract.annotations
+import orderly.extract.dataset
+import orderly.extract.duplicates
+import orderly.extract.main
+import orderly.extract.procedures
+
+LOG = logging.getLogger(__name__)
+
+SHARD_RECORD_FILE = "shard.json"
+
+
+def assign_shards(
+    files: List[pathlib.Path],
+    num_shards: int,
+    sizes: Optional[Dict[pathlib.Path, int]] = None,
+) -> List[List[pathlib.Path]]:
+    """
+    Splits the files into num_shards lists of about the same total size: going from the largest file to the smallest, each file goes to the shard with the smallest total so far (the lowest index on a tie).
+    Ties between files of the same size are broken by the folder and name of the file (not the full path), so every node computes the same shards even if the data is mounted at a different path. The files of each shard are sorted.
+    """
+    if num_shards < 1:
+        e = ValueError(f"Expect at least one shard: got {num_shards=}")
+        LOG.error(e)
+        raise e
+    if sizes is None:
+        sizes = {file: file.stat().st_size for file in files}
+    shards: List[List[pathlib.Path]] = [[] for _ in range(num_shards)]
+    totals = [0] * num_shards
+    for file in sorted(
+        files, key=lambda file: (-sizes[file], file.parent.name, file.name)  # type: ignore
+    ):
+        shard_index = min(range(num_shards), key=lambda i: (totals[i], i))
+        shards[shard_index].append(file)
+        totals[shard_index] += sizes[file]
+    return [sorted(shard) for shard in shards]
+
+
+def get_shard(
+    files: List[pathlib.Path],
+    shard_index: int,
+    num_shards: int,
+    sizes: Optional[Dict[pathlib.Path, int]] = None,
+) -> List[pathlib.Path]:
+    """The files extracted by shard shard_index of num_shards, see assign_shards"""
+    if not 0 <= shard_index < num_shards:
+        e = ValueError(f"Expect 0 <= shard_index < {num_shards=}: got {shard_index=}")
+        LOG.error(e)
+        raise e
+    return assign_shards(files, num_shards, sizes=sizes)[shard_index]
+
+
+def get_shard_path(
+    output_path: pathlib.Path, shard_index: int, num_shards: int
+) -> pathlib.Path:
+    """The output tree of one shard of the extraction to output_path"""
+    return output_path / "shards" / f"shard_{shard_index:03d}_of_{num_shards:03d}"
+
+
+def write_shard_record(
+    shard_path: pathlib.Path,
+    shard_index: int,
+    num_shards: int,
+    files: List[pathlib.Path],
+    filenames: List[str],
+) -> None:
+    """Saves the files of the shard and the names of their outputs, which marks the shard as complete for merge_shards"""
+    with open(shard_path / SHARD_RECORD_FILE, "w") as f:
+        json.dump(
+            {
+                "shard_index": shard_index,
+                "num_shards": num_shards,
+                "files": [str(file) for file in files],
+                "filenames": sorted(filenames),
+            },
+            f,
+            indent=4,
+        )
+
+
+def _merge_json_entries(
+    paths: List[pathlib.Path], output_file_path: pathlib.Path
+) -> None:
+    """Merges json files of {key: entry} (e.g. the manifests or inventories of the shards) into one"""
+    entries: Dict[str, Any] = {}
+    for path in paths:
+        if path.exists():
+            with open(path) as f:
+                entries.update(json.load(f))
+    if len(entries) > 0:
+        with open(output_file_path, "w") as f:
+            json.dump(entries, f, indent=4, sort_keys=True)
+
+
+def merge_shards(
+    output_path: pathlib.Path,
+    num_shards: int,
+    extracted_ord_data_folder: str = "extracted_ords",
+    molecule_names_folder: str = "molecule_names",
+    merged_molecules_file: str = "all_molecule_names.csv",
+    annotate_molecules: bool = False,
+    overwrite: bool = False,
+) -> List[str]:
+    """
+    Combines the output trees of the num_shards shards of an extraction to output_path (see get_shard_path) into output_path, so it is the same as extracting all the files on one node.
+    The outputs, molecule name indices and procedure details sidecars of each file are copied (the shards are left as they are, so they can be extracted again incrementally), then the steps that depend on all the files are run on the merged tree: merging the molecule names, dropping the duplicate reactions (if the shards were extracted with drop_duplicates) and compacting the dataset (if dataset_output). The manifests, inventories, quarantined files, reaction filter counts and config of the shards are merged too. Returns the names of the outputs.
+    """
+    output_path = pathlib.Path(output_path)
+    shard_paths = [
+        get_shard_path(output_path, i, num_shards) for i in range(num_shards)
+    ]
+    filenames: List[str] = []
+    for shard_index, shard_path in enumerate(shard_paths):
+        record_path = shard_path / SHARD_RECORD_FILE
+        if not record_path.exists():
+            e = FileNotFoundError(
+                f"Shard {shard_index} of {num_shards} is missing or incomplete: {record_path} doesn't exist"
+            )
+            LOG.error(e)
+            raise e
+        with open(record_path) as f:
+            record = json.load(f)
+        if record["num_shards"] != num_shards:
+            e = ValueError(
+                f"{shard_path} is a shard of {record['num_shards']} shards, not {num_shards}"
+            )
+            LOG.error(e)
+            raise e
+        filenames.extend(record["filenames"])
+    if len(set(filenames)) != len(filenames):
+        duplicated = sorted(
+            name for name, count in collections.Counter(filenames).items() if count > 1
+        )
+        e = ValueError(
+            f"The same outputs were extracted by several shards: {duplicated}"
+        )
+        LOG.error(e)
+        raise e
+
+    with open(shard_paths[0] / "extract_config.json") as f:
+        config = json.load(f)
+
+    extracted_ords_path = output_path / extracted_ord_data_folder
+    molecule_names_path = output_path / molecule_names_folder
+    extracted_ords_path.mkdir(parents=True, exist_ok=True)
+    molecule_names_path.mkdir(parents=True, exist_ok=True)
+
+    procedure_details_folder = orderly.extract.procedures.PROCEDURE_DETAILS_FOLDER
+    for shard_path in shard_paths:
+        for folder, destination in [
+            (extracted_ord_data_folder, extracted_ords_path),
+            (molecule_names_folder, molecule_names_path),
+            (procedure_details_folder, output_path / procedure_details_folder),
+            (
+                orderly.extract.main.REACTION_FILTER_COUNTS_FOLDER,
+                output_path / orderly.extract.main.REACTION_FILTER_COUNTS_FOLDER,
+            ),
+        ]:
+            if not (shard_path / folder).exists():
+                # the procedure details and reaction filter counts are only there with procedure_details_sidecar and reaction_filter
+                continue
+            destination.mkdir(parents=True, exist_ok=True)
+            for source in sorted((shard_path / folder).iterdir()):
+                target = destination / source.name
+                if target.exists() and not overwrite:
+                    e = FileExistsError(
+                        f"Trying to overwrite {target} (from {shard_path}) which exists, overwrite must be true to do this"
+                    )
+                    LOG.error(e)
+                    raise e
+                if source.is_dir():
+                    # a partition of a dataset
+                    if target.exists():
+                        shutil.rmtree(target)
+                    shutil.copytree(source, target)
+                else:
+                    shutil.copy2(source, target)
+    LOG.info(f"Merged the outputs of {len(filenames)} files from {num_shards} shards")
+
+    for name in [
+        "extract_manifest.json",
+        "dataset_inventory.json",
+        "quarantined_files.json",
+    ]:
+        _merge_json_entries(
+            [shard_path / name for shard_path in shard_paths], output_path / name
+        )
+    if (output_path / orderly.extract.main.REACTION_FILTER_COUNTS_FOLDER).exists():
+        orderly.extract.main.write_reaction_filter_report(output_path)
+    config["output_path"] = str(output_path)
+    if config.get("other_labelling_output_path") is not None:
+        # the other tree of each shard is a shard of the other output path, which is merged separately
+        config["other_labelling_output_path"] = str(
+            pathlib.Path(config["other_labelling_output_path"]).parent.parent
+        )
+    with open(output_path / "extract_config.json", "w") as f:
+        json.dump(config, f, indent=4, sort_keys=True)
+
+    if config.get("drop_duplicates", False):
+        orderly.extract.duplicates.drop_duplicate_reactions(
+            orderly.extract.duplicates.get_output_files(extracted_ords_path),
+            report_path=output_path / "duplicate_counts.json",
+        )
+    orderly.extract.main.merge_mol_names(
+        molecule_names_path=molecule_names_path,
+        output_file_path=output_path / merged_molecules_file,
+        overwrite=True,
+        molecule_names_file_ending=".parquet",
+    )
+    if config.get("dataset_output", False):
+        orderly.extract.dataset.compact_dataset(
+            extracted_ords_path,
+            missing_value=None if config.get("missing_as_null", False) else "<missing>",
+        )
+    if annotate_molecules:
+        orderly.extract.annotations.annotate_extracted_ords(
+            extracted_ords_path=extracted_ords_path,
+            output_file_path=output_path / "molecule_annotations.parquet",
+        )
+    return sorted(filenames)
+
+
+@click.command()
+@click.option(
+    "--output_path",
+    type=str,
+    default="data/orderly/",
+    show_default=True,
+    help="The output_path of the sharded extraction, the shards are in output_path/shards",
+)
+@click.option(
+    "--num_shards",
+    type=int,
+    required=True,
+    help="The number of shards the extraction was split into",
+)
+@click.option(
+    "--extracted_ord_data_folder",
+    type=str,
+    default="extracted_ords",
+    show_default=True,
+    help="The name of folder than contains the extracted ord dataframes",
+)
+@click.option(
+    "--molecule_names_folder",
+    type=str,
+    default="molecule_names",
+    show_default=True,
+    help="The name of the folder that contains the molecule_name per folder",
+)
+@click.option(
+    "--merged_molecules_file",
+    type=str,
+    default="all_molecule_names.csv",
+    show_default=True,
+    help="The name and file tag of the merged_molecules file (the merged_molecules_file is outputed to output_path / merged_molecules_file)",
+)
+@click.option(
+    "--annotate_molecules",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If True, builds the table of per-molecule properties for the merged data (see orderly.extract --annotate_molecules)",
+)
+@click.option(
+    "--overwrite",
+    type=bool,
+    default=False,
+    show_default=True,
+    help="If true, will overwrite existing outputs in output_path, else will through an error if an output exists",
+)
+@click.option(
+    "--log_file",
+    type=str,
+    default="default_path_merge.log",
+    show_default=True,
+    help="path for the log file of the merge",
+)
+@click.option(
+    "--log_level",
+    type=int,
+    default=logging.INFO,
+    show_default=True,
+    help="The log level",
+)
+def merge_shards_click(
+    output_path: str,
+    num_shards: int,
+    extracted_ord_data_folder: str,
+    molecule_names_folder: str,
+    merged_molecules_file: str,
+    annotate_molecules: bool,
+    overwrite: bool,
+    log_file: str,
+    log_level: int = logging.INFO,
+) -> None:
+    """
+    Merges the shards of an extraction that was split across nodes with --shard_index and --num_shards (see orderly.extract.main) into output_path, e.g.
+
+        python -m orderly.extract --output_path=data/orderly/uspto --num_shards=2 --shard_index=0  (on the first node)
+        python -m orderly.extract --output_path=data/orderly/uspto --num_shards=2 --shard_index=1  (on the second node)
+        python -m orderly.extract.shards --output_path=data/orderly/uspto --num_shards=2
+
+    With other_labelling_output_path the other output path is merged with a second call.
+    """
+    _log_file = (
+        pathlib.Path(output_path) / f"{pathlib.Path(output_path).name}_merge.log"
+    )
+    if log_file != "default_path_merge.log":
+        _log_file = pathlib.Path(log_file)
+    _log_file.parent.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(
+        filename=_log_file,
+        encoding="utf-8",
+        format="%(name)s - %(levelname)s - %(asctime)s - %(message)s",
+        datefmt="%d-%b-%y %H:%M:%S",
+        level=log_level,
+    )
+    merge_shards(
+        output_path=pathlib.Path(output_path),
+        num_shards=num_shards,
+        extracted_ord_data_folder=extracted_ord_data_folder,
+        molecule_names_folder=molecule_names_folder,
+        merged_molecules_file=merged_molecules_file,
+        annotate_molecules=annotate_molecules,
+        overwrite=overwrite,
+    )
+
+
+if __name__ == "__main__":
+    merge_shards_click()
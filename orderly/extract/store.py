@@ -0,0 +1,279 @@
+import logging
+import pathlib
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import rdkit
+
+from orderly.types import *
+
+LOG = logging.getLogger(__name__)
+
+_STORE_KEY = Tuple[MOLECULE_IDENTIFIER, bool]
+_STORE_VALUE = Tuple[Optional[CANON_SMILES], Optional[int]]
+
+
+class CanonicalisationStore:
+    """
+    An on-disk (sqlite) key/value store mapping a raw molecule identifier and is_mapped flag to its canonical SMILES, or to NULL if the identifier is unresolvable.
+    An entry can also hold the flags of the identifier (see orderly.extract.canonicalise.MoleculeInfo.to_flags), so a molecule found in the store doesn't need to be parsed; the flags are NULL if the entry was written without them.
+    Entries are keyed by the RDKit version, so entries written with a different version of RDKit are never returned (and are purged when the store is opened for writing).
+    The database is in WAL mode so many extraction workers can read it concurrently; new entries are buffered in memory and written in one transaction on flush().
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        read_only: bool = False,
+        rdkit_version: Optional[str] = None,
+        timeout: float = 60.0,
+    ) -> None:
+        self.path = pathlib.Path(path)
+        self.read_only = read_only
+        self.rdkit_version = (
+            rdkit.__version__ if rdkit_version is None else rdkit_version
+        )
+        self._pending: Dict[_STORE_KEY, _STORE_VALUE] = {}
+
+        if read_only:
+            self._con = sqlite3.connect(
+                f"file:{self.path}?mode=ro", uri=True, timeout=timeout
+            )
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._con = sqlite3.connect(self.path, timeout=timeout)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            with self._con:
+                self._con.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS canonical_smiles (
+                        rdkit_version TEXT NOT NULL,
+                        identifier TEXT NOT NULL,
+                        is_mapped INTEGER NOT NULL,
+                        smiles TEXT,
+                        flags INTEGER,
+                        PRIMARY KEY (rdkit_version, identifier, is_mapped)
+                    ) WITHOUT ROWID
+                    """
+                )
+                if not self._has_flags_column():
+                    # a store written before the flags were recorded
+                    self._con.execute(
+                        "ALTER TABLE canonical_smiles ADD COLUMN flags INTEGER"
+                    )
+                deleted = self._con.execute(
+                    "DELETE FROM canonical_smiles WHERE rdkit_version != ?",
+                    (self.rdkit_version,),
+                ).rowcount
+            if deleted > 0:
+                LOG.info(
+                    f"Purged {deleted} entries from {self.path} written by another RDKit version"
+                )
+
+        self._flags_column = self._has_flags_column()
+
+    def _has_flags_column(self) -> bool:
+        columns = self._con.execute("PRAGMA table_info(canonical_smiles)").fetchall()
+        return any(column[1] == "flags" for column in columns)
+
+    def get(
+        self, identifier: MOLECULE_IDENTIFIER, is_mapped: bool
+    ) -> Tuple[bool, Optional[CANON_SMILES]]:
+        """Returns (found, value), value is None if the identifier is known to be unresolvable"""
+        found, smiles, _ = self.get_entry(identifier, is_mapped)
+        return found, smiles
+
+    def get_entry(
+        self, identifier: MOLECULE_IDENTIFIER, is_mapped: bool
+    ) -> Tuple[bool, Optional[CANON_SMILES], Optional[int]]:
+        """Returns (found, value, flags), flags is None if they weren't recorded with the entry"""
+        key = (identifier, bool(is_mapped))
+        if key in self._pending:
+            return (True, *self._pending[key])
+        row = self._con.execute(
+            f"SELECT smiles, {'flags' if self._flags_column else 'NULL'} FROM canonical_smiles WHERE rdkit_version = ? AND identifier = ? AND is_mapped = ?",
+            (self.rdkit_version, identifier, int(is_mapped)),
+        ).fetchone()
+        if row is None:
+            return False, None, None
+        return True, row[0], row[1]
+
+    def put(
+        self,
+        identifier: MOLECULE_IDENTIFIER,
+        is_mapped: bool,
+        smiles: Optional[CANON_SMILES],
+        flags: Optional[int] = None,
+    ) -> None:
+        """Buffers an entry, call flush() to write it to disk. The flags of an entry are only ever added, not replaced by None"""
+        if self.read_only:
+            return
+        key = (identifier, bool(is_mapped))
+        if flags is None and key in self._pending:
+            flags = self._pending[key][1]
+        self._pending[key] = (smiles, flags)
+
+    def put_many(
+        self,
+        entries: Iterable[
+            Tuple[MOLECULE_IDENTIFIER, bool, Optional[CANON_SMILES], Optional[int]]
+        ],
+    ) -> None:
+        for identifier, is_mapped, smiles, flags in entries:
+            self.put(identifier, is_mapped, smiles, flags)
+
+    def flush(self) -> int:
+        """Writes the buffered entries to disk, returns the number of entries written"""
+        if self.read_only or len(self._pending) == 0:
+            return 0
+        rows = [
+            (self.rdkit_version, identifier, int(is_mapped), smiles, flags)
+            for (identifier, is_mapped), (smiles, flags) in self._pending.items()
+        ]
+        with self._con:
+            # an existing entry is kept, but gains the flags if it was written without them
+            self._con.executemany(
+                """
+                INSERT INTO canonical_smiles (rdkit_version, identifier, is_mapped, smiles, flags)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (rdkit_version, identifier, is_mapped)
+                DO UPDATE SET flags = excluded.flags WHERE flags IS NULL
+                """,
+                rows,
+            )
+        self._pending.clear()
+        LOG.debug(f"Wrote {len(rows)} entries to {self.path}")
+        return len(rows)
+
+    def items(self) -> List[Tuple[MOLECULE_IDENTIFIER, bool, Optional[CANON_SMILES]]]:
+        rows = self._con.execute(
+            "SELECT identifier, is_mapped, smiles FROM canonical_smiles WHERE rdkit_version = ?",
+            (self.rdkit_version,),
+        ).fetchall()
+        return [
+            (identifier, bool(is_mapped), smiles)
+            for identifier, is_mapped, smiles in rows
+        ]
+
+    def __len__(self) -> int:
+        return int(
+            self._con.execute(
+                "SELECT COUNT(*) FROM canonical_smiles WHERE rdkit_version = ?",
+                (self.rdkit_version,),
+            ).fetchone()[0]
+        )
+
+    def close(self) -> None:
+        self.flush()
+        self._con.close()
+
+
+class ReactionCache:
+    """
+    An on-disk (sqlite) cache of the rows extracted from the reactions of one dataset, keyed by reaction_id and a digest of the serialised reaction.
+    Entries are also keyed by a hash of the extraction config, entries written with a different config are purged when the cache is opened.
+    New entries are buffered in memory and written in one transaction on flush(), so a few extraction workers can share the cache.
+    """
+
+    def __init__(
+        self, path: pathlib.Path, config_hash: str, timeout: float = 60.0
+    ) -> None:
+        self.path = pathlib.Path(path)
+        self.config_hash = config_hash
+        self._pending: Dict[str, Tuple[str, bytes]] = {}
+        self.seen: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(self.path, timeout=timeout)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        with self._con:
+            self._con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reactions (
+                    config_hash TEXT NOT NULL,
+                    reaction_id TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    row BLOB NOT NULL,
+                    PRIMARY KEY (config_hash, reaction_id)
+                ) WITHOUT ROWID
+                """
+            )
+            deleted = self._con.execute(
+                "DELETE FROM reactions WHERE config_hash != ?", (self.config_hash,)
+            ).rowcount
+        if deleted > 0:
+            LOG.info(
+                f"Purged {deleted} reactions from {self.path} extracted with another config"
+            )
+
+    def get(self, reaction_id: str, digest: str) -> Tuple[bool, Optional[bytes]]:
+        """Returns (found, row), the row is only returned if the reaction is unchanged (same digest)"""
+        self.seen.add(reaction_id)
+        if reaction_id in self._pending:
+            pending_digest, row = self._pending[reaction_id]
+            if pending_digest == digest:
+                self.hits += 1
+                return True, row
+        else:
+            result = self._con.execute(
+                "SELECT digest, row FROM reactions WHERE config_hash = ? AND reaction_id = ?",
+                (self.config_hash, reaction_id),
+            ).fetchone()
+            if result is not None and result[0] == digest:
+                self.hits += 1
+                return True, result[1]
+        self.misses += 1
+        return False, None
+
+    def put(self, reaction_id: str, digest: str, row: bytes) -> None:
+        """Buffers an entry, call flush() to write it to disk"""
+        self.seen.add(reaction_id)
+        self._pending[reaction_id] = (digest, row)
+
+    def flush(self) -> int:
+        """Writes the buffered entries to disk, returns the number of entries written"""
+        if len(self._pending) == 0:
+            return 0
+        rows = [
+            (self.config_hash, reaction_id, digest, row)
+            for reaction_id, (digest, row) in self._pending.items()
+        ]
+        with self._con:
+            self._con.executemany(
+                "INSERT OR REPLACE INTO reactions VALUES (?, ?, ?, ?)", rows
+            )
+        self._pending.clear()
+        LOG.debug(f"Wrote {len(rows)} reactions to {self.path}")
+        return len(rows)
+
+    def retain(self, reaction_ids: Set[str]) -> int:
+        """Deletes the reactions that are not in reaction_ids (e.g. removed from the dataset), returns the number deleted"""
+        self.flush()
+        cached_ids = [
+            reaction_id
+            for (reaction_id,) in self._con.execute(
+                "SELECT reaction_id FROM reactions WHERE config_hash = ?",
+                (self.config_hash,),
+            ).fetchall()
+        ]
+        to_delete = [(self.config_hash, r) for r in cached_ids if r not in reaction_ids]
+        with self._con:
+            self._con.executemany(
+                "DELETE FROM reactions WHERE config_hash = ? AND reaction_id = ?",
+                to_delete,
+            )
+        return len(to_delete)
+
+    def __len__(self) -> int:
+        return int(
+            self._con.execute(
+                "SELECT COUNT(*) FROM reactions WHERE config_hash = ?",
+                (self.config_hash,),
+            ).fetchone()[0]
+        )
+
+    def close(self) -> None:
+        self.flush()
+        self._con.close()
@@ -10,10 +10,12 @@ import click
 import tqdm
 import tqdm.contrib.logging
 import pandas as pd
+import pyarrow.parquet as pq
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 
+import orderly.extract.annotations
 from orderly.types import *
 
 LOG = logging.getLogger(__name__)
@@ -38,7 +40,15 @@ class ORDerlyPlotter:
     freq_step: int
 
     def __post_init__(self) -> None:
-        self.df = pd.read_parquet(self.clean_data_path)
+        # the plots only use the molecule columns, so the rest of the cleaned data (e.g. the procedure details) is not read
+        self.df = pd.read_parquet(
+            self.clean_data_path,
+            columns=[
+                name
+                for name in pq.read_schema(self.clean_data_path).names
+                if name.startswith(orderly.extract.annotations.MOLECULE_COLUMN_PREFIXES)
+            ],
+        )
         self.axis_font_size = 16
         self.heading_fontsize = 18
 
@@ -45,3 +45,38 @@ def test_read_write_list_as_csv(
     for i in loaded_list:
         assert isinstance(i, str)
     assert loaded_list == target_list, "lists are different"
+
+
+def test_solvents_and_replacements_are_cached(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    import rdkit
+    import orderly.data.solvents
+    import orderly.extract.canonicalise
+    import orderly.extract.main
+
+    monkeypatch.setenv("ORDERLY_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(orderly.data.solvents, "_CANONICAL_SMILES", {})
+    monkeypatch.setattr(orderly.extract.main, "_REPLACEMENTS", {})
+
+    solvents_set = orderly.data.solvents.get_solvents_set()
+    replacements = orderly.extract.main.get_manual_replacements_dict()
+    assert len(list(tmp_path.glob("solvents_*.parquet"))) == 1
+    assert len(list(tmp_path.glob("replacements_*.json"))) == 1
+
+    # loaded from disk without canonicalising anything
+    def fail(*args: Any, **kwargs: Any) -> None:
+        raise AssertionError("should be cached")
+
+    monkeypatch.setattr(orderly.data.solvents, "_CANONICAL_SMILES", {})
+    monkeypatch.setattr(orderly.extract.main, "_REPLACEMENTS", {})
+    monkeypatch.setattr(orderly.extract.canonicalise, "get_canonicalised_smiles", fail)
+    monkeypatch.setattr(orderly.extract.main.rdkit_Chem, "MolFromSmiles", fail)
+    assert orderly.data.solvents.get_solvents_set() == solvents_set
+    assert orderly.extract.main.get_manual_replacements_dict() == replacements
+    assert orderly.extract.main.build_solvents_set_and_dict()[0] == solvents_set
+
+    # a new RDKit version is a cache miss
+    monkeypatch.setattr(rdkit, "__version__", "0.0.0")
+    with pytest.raises(AssertionError, match="should be cached"):
+        orderly.data.solvents.get_solvents_set()
@@ -1,4 +1,4 @@
-from typing import List, Dict, Callable, Set, Optional
+from typing import TYPE_CHECKING, Any, List, Dict, Callable, Set, Optional, Tuple
 import pytest
 import pathlib
 
@@ -6,9 +6,14 @@ from ord_schema.proto import reaction_pb2 as ord_reaction_pb2
 
 from orderly.types import YIELD, MANUAL_REPLACEMENTS_DICT
 
+if TYPE_CHECKING:
+    import orderly.extract.extractor
+
 REPETITIONS = 1
 SLOW_REPETITIONS = 1
 
+TEST_ORD_FILE_ENDING = "0c61835e3a0b4986aabf2b61b708e322.pb.gz"  # uspto-grants-1995_11
+
 
 def test_hello_world() -> None:
     assert True
@@ -39,6 +44,33 @@ def get_rxn_func() -> Callable[[str, int], ord_reaction_pb2.Reaction]:
     return get_rxn
 
 
+def get_test_ord_file(file_ending: str = TEST_ORD_FILE_ENDING) -> pathlib.Path:
+    import orderly.extract.main
+    import orderly.data.test_data
+
+    files = orderly.extract.main.get_file_names(
+        directory=orderly.data.test_data.get_path_of_test_ords(),
+        file_ending=file_ending,
+    )
+    assert len(files) == 1
+    return pathlib.Path(files[0])
+
+
+def get_extractor(**kwargs: Any) -> "orderly.extract.extractor.OrdExtractor":
+    """Extracts the test ORD file with the default manual replacements and solvents, without trusting the labelling or considering molecule names, the kwargs override any of these"""
+    import orderly.extract.extractor
+    import orderly.extract.main
+
+    options: Dict[str, Any] = dict(
+        ord_file_path=get_test_ord_file(),
+        trust_labelling=False,
+        consider_molecule_names=False,
+        manual_replacements_dict=orderly.extract.main.get_manual_replacements_dict(),
+    )
+    options.update(kwargs)
+    return orderly.extract.extractor.OrdExtractor(**options)
+
+
 @pytest.mark.parametrize(
     "file_name,rxn_idx,expected_labelled_reactants,expected_labelled_reagents,expected_labelled_solvents,expected_labelled_catalysts,expected_labelled_products_from_input,expected_ice_present,expected_non_smiles_names_list_additions",
     (
@@ -1327,6 +1359,200 @@ def test_canonicalisation(
     ), f"failure for {expected_canonical_smiles=} got {canonical_smiles}"
 
 
+def test_canonicalisation_cache() -> None:
+    import orderly.extract.canonicalise as canonicalise
+
+    canonicalise.clear_cache()
+
+    assert canonicalise.get_canonicalised_smiles("C1=CC=CC=C1") == "c1ccccc1"
+    assert canonicalise.get_canonicalised_smiles("C1=CC=CC=C1") == "c1ccccc1"
+    assert canonicalise.get_canonicalised_smiles("teststring") is None
+    assert canonicalise.get_canonicalised_smiles("teststring") is None
+    # the mapped and unmapped results are cached separately
+    assert canonicalise.get_canonicalised_smiles("teststring", is_mapped=True) is None
+
+    stats = canonicalise.get_cache_stats()
+    assert stats.positive_hits == 1
+    assert stats.negative_hits == 1
+    assert stats.misses == 3
+    assert stats.evictions == 0
+
+    cache = canonicalise.CanonicalisationCache(maxsize=2, negative_maxsize=1)
+    for smi in ["C", "CC", "CCC"]:
+        cache.insert(("canonicalise", smi, False), smi)
+    cache.insert(("canonicalise", "foo", False), None)
+    cache.insert(("canonicalise", "bar", False), None)
+    assert cache.lookup(("canonicalise", "C", False)) == (False, None)
+    assert cache.lookup(("canonicalise", "CCC", False)) == (True, "CCC")
+    assert cache.lookup(("canonicalise", "bar", False)) == (True, None)
+    assert cache.stats.positive_evictions == 1
+    assert cache.stats.negative_evictions == 1
+
+    canonicalise.clear_cache()
+
+
+@pytest.mark.parametrize(
+    "smiles,is_mapped,has_atom_map",
+    (
+        ["[CH3:1][OH:2]", True, True],
+        ["[CH3:1][OH:2]", False, True],
+        ["CCO", False, False],
+        ["[Pd]", False, False],
+        ["Cl[Pd]Cl", True, False],
+        ["Pd", False, None],
+        ["[Na+]", False, False],
+        ["teststring", True, None],
+    ),
+)
+def test_molecule_info(
+    smiles: str, is_mapped: bool, has_atom_map: Optional[bool]
+) -> None:
+    import orderly.extract.canonicalise as canonicalise
+    import orderly.extract.defaults
+
+    canonicalise.clear_cache()
+    info = canonicalise.get_molecule_info(smiles, is_mapped)
+    assert info.canonical_smiles == canonicalise._get_canonicalised_smiles(
+        smiles, is_mapped
+    )
+    assert info.has_atom_map == has_atom_map
+    assert info.has_transition_metal == orderly.extract.defaults.has_transition_metal(
+        smiles
+    )
+
+    # the canonical smiles are shared with get_canonicalised_smiles, so it doesn't parse the molecule again
+    misses = canonicalise.get_cache_stats().misses
+    assert canonicalise.get_canonicalised_smiles(smiles, is_mapped) == (
+        info.canonical_smiles
+    )
+    assert canonicalise.get_molecule_info(smiles, is_mapped) == info
+    assert canonicalise.get_cache_stats().misses == misses
+    canonicalise.clear_cache()
+
+
+def test_canonicalisation_store(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    import orderly.extract.canonicalise as canonicalise
+    from orderly.extract.store import CanonicalisationStore
+
+    store_path = tmp_path / "canonical_smiles.sqlite"
+
+    canonicalise.clear_cache()
+    canonicalise.attach_store(store_path)
+    assert canonicalise.get_canonicalised_smiles("C1=CC=CC=C1") == "c1ccccc1"
+    assert canonicalise.get_canonicalised_smiles("teststring") is None
+    assert canonicalise.flush_store() == 2
+    canonicalise.attach_store(None)
+
+    store = CanonicalisationStore(store_path)
+    assert len(store) == 2
+    assert store.get("C1=CC=CC=C1", False) == (True, "c1ccccc1")
+    assert store.get("teststring", False) == (True, None)
+    assert store.get("C1=CC=CC=C1", True) == (False, None)
+    store.close()
+
+    # a fresh process-wide cache should be served from the store
+    canonicalise.clear_cache()
+    canonicalise.attach_store(store_path)
+    assert canonicalise.get_canonicalised_smiles("C1=CC=CC=C1") == "c1ccccc1"
+    assert canonicalise.get_cache_stats().store_hits == 1
+    canonicalise.attach_store(None)
+    canonicalise.clear_cache()
+
+    # get_molecule_info adds the flags to the entries, after which a fresh cache doesn't parse them
+    canonicalise.clear_cache()
+    canonicalise.attach_store(store_path)
+    infos = {
+        smiles: canonicalise.get_molecule_info(smiles, is_mapped)
+        for smiles, is_mapped in [("C1=CC=CC=C1", False), ("[CH3:1][Pd:2]", True)]
+    }
+    canonicalise.attach_store(None)
+    store = CanonicalisationStore(store_path)
+    assert store.get_entry("C1=CC=CC=C1", False) == (
+        True,
+        "c1ccccc1",
+        infos["C1=CC=CC=C1"].to_flags(),
+    )
+    store.close()
+
+    canonicalise.clear_cache()
+    canonicalise.attach_store(store_path)
+    with monkeypatch.context() as m:
+
+        def fail(*args: Any, **kwargs: Any) -> None:
+            raise AssertionError("The molecule should have been found in the store")
+
+        m.setattr(canonicalise.rdkit_Chem, "MolFromSmiles", fail)
+        for smiles, is_mapped in [("C1=CC=CC=C1", False), ("[CH3:1][Pd:2]", True)]:
+            assert canonicalise.get_molecule_info(smiles, is_mapped) == infos[smiles]
+        assert canonicalise.get_molecule_info("teststring") == (None, None, False)
+    assert canonicalise.get_cache_stats().store_hits == 3
+    canonicalise.attach_store(None)
+    canonicalise.clear_cache()
+
+    # entries written by a different RDKit version are invalidated
+    other_version_store = CanonicalisationStore(store_path, rdkit_version="0.0.0")
+    assert len(other_version_store) == 0
+    other_version_store.close()
+
+
+def test_canonicalisation_cost_limits(tmp_path: pathlib.Path) -> None:
+    import orderly.extract.canonicalise as canonicalise
+    from orderly.extract.extractor import OrdExtractor
+
+    limits = canonicalise.CostLimits(max_length=40, max_atoms=10, max_ring_closures=4)
+    assert limits.exceeded("c1ccccc1") is None
+    assert limits.exceeded("C" * 41) == "length"
+    assert limits.exceeded("CCCCCCCCCCC") == "atoms"
+    # the atoms of a bracket are one token, and its digits are not ring closures
+    assert limits.exceeded("[CH3:1][CH2:2][CH2:3][OH:4]") is None
+    assert limits.exceeded("C1CC2CC3CC1C23") == "ring_closures"
+    assert canonicalise.CostLimits(None, None, None).exceeded("C" * 10**5) is None
+
+    default_limits = canonicalise.get_cost_limits()
+    try:
+        canonicalise.clear_cache()
+        assert canonicalise.get_canonicalised_smiles("CCCCCCCCCCC") == "CCCCCCCCCCC"
+        # the cached result is from the previous limits
+        canonicalise.configure_cost_limits(limits)
+        assert canonicalise.get_canonicalised_smiles("CCCCCCCCCCC") is None
+        assert canonicalise.get_molecule_info("C" * 41, True) == (
+            canonicalise.MoleculeInfo(None, None, False)
+        )
+        stats = canonicalise.get_cache_stats()
+        assert (stats.over_length, stats.over_atoms, stats.guarded) == (1, 1, 2)
+        # the same limits apply to the other entry points, which the cleaning and solvent loading use
+        assert canonicalise.canonicalise_smiles("CCCCCCCCCCC") is None
+        assert (
+            canonicalise.remove_mapping_info_and_canonicalise_smiles(
+                "[CH3:1]" + "C" * 10
+            )
+            is None
+        )
+        assert canonicalise.canonicalise_smiles("CCO") == "CCO"
+        assert canonicalise.get_cache_stats().guarded == 4
+        canonicalise.clear_cache()
+
+        # the molecules over the limits go to the unresolvable names, the rest are canonicalised as usual
+        reactants, agents, products, _, names = OrdExtractor.extract_info_from_rxn_str(
+            "C1CC2CC3CC1C23.OC=O>>CCCCCCCCCCCO", is_mapped=False
+        )
+        assert reactants == ["C1CC2CC3CC1C23", "O=CO"]
+        assert products == ["CCCCCCCCCCCO"]
+        assert sorted(names) == ["C1CC2CC3CC1C23", "CCCCCCCCCCCO"]
+        assert canonicalise.get_cache_stats().guarded == 2
+
+        # guarded identifiers are not recorded in the store
+        canonicalise.attach_store(tmp_path / "canonical_smiles.sqlite")
+        assert canonicalise.get_canonicalised_smiles("C" * 50) is None
+        assert canonicalise.flush_store() == 0
+    finally:
+        canonicalise.attach_store(None)
+        canonicalise.configure_cost_limits(default_limits)
+        canonicalise.clear_cache()
+
+
 @pytest.mark.parametrize(
     "trust_labelling,use_multiprocessing,name_contains_substring,inverse_substring",
     (
@@ -1508,3 +1734,1197 @@ def test_extraction_pipeline_exact_output(
     )
 
     pd.testing.assert_frame_equal(created_df, compare_against_df)
+
+
+@pytest.mark.parametrize("use_multiprocessing", [False, True])
+def test_extraction_pipeline_precanonicalise_molecules(
+    tmp_path: pathlib.Path, use_multiprocessing: bool
+) -> None:
+    import orderly.extract.main
+    import orderly.extract.store
+    import orderly.data.test_data
+    import pandas as pd
+
+    orderly.extract.main.main(
+        data_path=orderly.data.test_data.get_path_of_test_ords(),
+        ord_file_ending=TEST_ORD_FILE_ENDING,
+        trust_labelling=False,
+        consider_molecule_names=False,
+        output_path=tmp_path,
+        extracted_ord_data_folder="extracted_ord_data",
+        solvents_path=None,
+        molecule_names_folder="molecule_names",
+        merged_molecules_file="all_molecule_names.csv",
+        use_multiprocessing=use_multiprocessing,
+        name_contains_substring="uspto",
+        inverse_substring=False,
+        overwrite=False,
+        config=orderly.extract.main.ExtractionConfig(precanonicalise_molecules=True),
+    )
+
+    store = orderly.extract.store.CanonicalisationStore(
+        tmp_path / "canonical_smiles.sqlite"
+    )
+    assert len(store) > 0
+    store.close()
+
+    compare_against_df = pd.read_parquet(
+        orderly.data.test_data.get_path_of_test_extracted_ords(trust_labelling=False)
+        / "extracted_ords"
+        / "uspto-grants-1995_11.parquet"
+    )
+    created_df = pd.read_parquet(
+        tmp_path / "extracted_ord_data" / "uspto-grants-1995_11.parquet"
+    )
+    pd.testing.assert_frame_equal(created_df, compare_against_df)
+
+
+def test_chunked_extraction_matches_serial() -> None:
+    import pandas as pd
+
+    instances = [
+        get_extractor(
+            consider_molecule_names=True, reaction_chunk_size=reaction_chunk_size
+        )
+        for reaction_chunk_size in [None, 97]
+    ]
+    serial, chunked = instances
+    assert len(serial.data.reactions) > 97
+    pd.testing.assert_frame_equal(serial.full_df, chunked.full_df)
+    assert serial.non_smiles_names_list == chunked.non_smiles_names_list
+
+
+def test_split_large_files(tmp_path: pathlib.Path) -> None:
+    import orderly.extract.main
+
+    files = []
+    for name, size in [("a", 10), ("b", 10), ("c", 80)]:
+        file = tmp_path / f"{name}.pb.gz"
+        file.write_bytes(b"0" * size)
+        files.append(file)
+
+    small_files, large_files = orderly.extract.main.split_large_files(
+        files, num_workers=4
+    )
+    assert small_files == files[:2]
+    assert large_files == files[2:]
+
+
+def test_streaming_extraction_matches_full_load(tmp_path: pathlib.Path) -> None:
+    import orderly.extract.extractor
+    import pandas as pd
+
+    file = get_test_ord_file()
+    paths = []
+    non_smiles_names_lists = []
+    for batch_size in [None, 13]:
+        instance = get_extractor(consider_molecule_names=True, batch_size=batch_size)
+        path = tmp_path / f"{batch_size}.parquet"
+        instance.to_parquet(path)
+        paths.append(path)
+        non_smiles_names_lists.append(instance.non_smiles_names_list)
+        if batch_size is not None:
+            assert instance.num_reactions == len(
+                orderly.extract.extractor.OrdExtractor.load_data(file).reactions
+            )
+
+    import pyarrow.parquet as pq
+
+    assert pq.ParquetFile(paths[1]).num_row_groups > 1
+    pd.testing.assert_frame_equal(pd.read_parquet(paths[0]), pd.read_parquet(paths[1]))
+    assert non_smiles_names_lists[0] == non_smiles_names_lists[1]
+
+
+def test_incremental_extraction(tmp_path: pathlib.Path) -> None:
+    import shutil
+    import orderly.extract.extractor
+    import orderly.extract.main
+    import orderly.extract.manifest
+    import orderly.data.test_data
+
+    data_path = tmp_path / "ord"
+    shutil.copytree(orderly.data.test_data.get_path_of_test_ords(), data_path)
+    output_path = tmp_path / "orderly"
+
+    def run() -> None:
+        orderly.extract.main.main(
+            data_path=data_path,
+            ord_file_ending=".pb.gz",
+            trust_labelling=False,
+            consider_molecule_names=False,
+            output_path=output_path,
+            extracted_ord_data_folder="extracted_ords",
+            solvents_path=None,
+            molecule_names_folder="molecule_names",
+            merged_molecules_file="all_molecule_names.csv",
+            use_multiprocessing=False,
+            name_contains_substring="uspto",
+            inverse_substring=False,
+            overwrite=False,
+            config=orderly.extract.main.ExtractionConfig(incremental=True),
+        )
+
+    run()
+    manifest = orderly.extract.manifest.ExtractionManifest(
+        output_path / "extract_manifest.json"
+    )
+    # the files that are filtered out by name never reach the extraction
+    files = [
+        f
+        for f in orderly.extract.main.get_file_names(data_path)
+        if "uspto" in orderly.extract.extractor.OrdExtractor.peek_filename(f)
+    ]
+    assert set(manifest.entries) == set(str(f) for f in files)
+    outputs = sorted((output_path / "extracted_ords").glob("*.parquet"))
+    assert len(outputs) > 0
+    mtimes = [o.stat().st_mtime_ns for o in outputs]
+
+    # nothing changed, so nothing is extracted again
+    run()
+    assert [o.stat().st_mtime_ns for o in outputs] == mtimes
+
+    # a removed dataset has its outputs removed
+    removed_file = next(
+        f for f in files if manifest.entries[str(f)].output_filename is not None
+    )
+    output_filename = manifest.entries[str(removed_file)].output_filename
+    removed_file.unlink()
+    run()
+    assert not (output_path / "extracted_ords" / f"{output_filename}.parquet").exists()
+    assert not (
+        output_path / "molecule_names" / f"molecules_{output_filename}.csv"
+    ).exists()
+    assert [o.stat().st_mtime_ns for o in outputs if o.exists()] == [
+        m for o, m in zip(outputs, mtimes) if o.exists()
+    ]
+
+
+def test_incremental_reaction_filter_report(tmp_path: pathlib.Path) -> None:
+    import json
+    import shutil
+    import orderly.extract.main
+    import orderly.extract.manifest
+    import orderly.extract.reaction_filter
+    import orderly.data.test_data
+
+    data_path = tmp_path / "ord"
+    shutil.copytree(orderly.data.test_data.get_path_of_test_ords(), data_path)
+    output_path = tmp_path / "orderly"
+
+    def run() -> Dict[str, Any]:
+        orderly.extract.main.main(
+            data_path=data_path,
+            ord_file_ending=".pb.gz",
+            trust_labelling=False,
+            consider_molecule_names=False,
+            output_path=output_path,
+            extracted_ord_data_folder="extracted_ords",
+            solvents_path=None,
+            molecule_names_folder="molecule_names",
+            merged_molecules_file="all_molecule_names.csv",
+            use_multiprocessing=False,
+            name_contains_substring="uspto",
+            inverse_substring=False,
+            overwrite=False,
+            config=orderly.extract.main.ExtractionConfig(
+                incremental=True,
+                reaction_filter=orderly.extract.reaction_filter.ReactionFilter(
+                    num_reactant=2, remove_reactions_with_no_solvents=True
+                ),
+            ),
+        )
+        with open(output_path / "reaction_filter_counts.json") as f:
+            return json.load(f)  # type: ignore
+
+    report = run()
+    assert len(report["files"]) > 1
+    assert sum(report["total"].values()) > 0
+
+    # the files that are up to date are not extracted again, but are still counted
+    assert run() == report
+
+    # a removed dataset is no longer counted
+    manifest = orderly.extract.manifest.ExtractionManifest(
+        output_path / "extract_manifest.json"
+    )
+    removed_file, entry = next(
+        (file, entry)
+        for file, entry in sorted(manifest.entries.items())
+        if entry.output_filename in report["files"]
+    )
+    pathlib.Path(removed_file).unlink()
+    updated_report = run()
+    assert updated_report["files"] == {
+        filename: counts
+        for filename, counts in report["files"].items()
+        if filename != entry.output_filename
+    }
+    for reason, count in report["total"].items():
+        assert updated_report["total"].get(reason, 0) == count - report["files"][
+            entry.output_filename
+        ].get(reason, 0)
+
+
+def test_reaction_cache(tmp_path: pathlib.Path) -> None:
+    import orderly.extract.extractor
+    import pandas as pd
+    from ord_schema import message_helpers as ord_message_helpers
+
+    file = get_test_ord_file()
+
+    def get_instance(
+        ord_file_path: pathlib.Path, reaction_cache_path: Optional[pathlib.Path]
+    ) -> orderly.extract.extractor.OrdExtractor:
+        return get_extractor(
+            ord_file_path=ord_file_path,
+            consider_molecule_names=True,
+            reaction_cache_path=reaction_cache_path,
+        )
+
+    cache_path = tmp_path / "reaction_cache"
+    uncached = get_instance(file, None)
+    first = get_instance(file, cache_path)
+    second = get_instance(file, cache_path)
+    pd.testing.assert_frame_equal(uncached.full_df, first.full_df)
+    pd.testing.assert_frame_equal(uncached.full_df, second.full_df)
+    assert second.non_smiles_names_list == uncached.non_smiles_names_list
+
+    import orderly.extract.store
+
+    cache = orderly.extract.store.ReactionCache(*second.get_reaction_cache_file())  # type: ignore
+    assert len(cache) == len(uncached.data.reactions)
+    cache.close()
+
+    # edit one reaction and remove another, the cache follows the new release
+    data = orderly.extract.extractor.OrdExtractor.load_data(file)
+    data.reactions[0].conditions.temperature.setpoint.value += 10
+    del data.reactions[-1]
+    new_file = tmp_path / "new_release.pb.gz"
+    ord_message_helpers.write_message(data, str(new_file))
+
+    updated = get_instance(new_file, cache_path)
+    pd.testing.assert_frame_equal(updated.full_df, get_instance(new_file, None).full_df)
+    cache = orderly.extract.store.ReactionCache(*updated.get_reaction_cache_file())  # type: ignore
+    assert len(cache) == len(data.reactions)
+    cache.close()
+
+
+def test_list_columns_and_nulls() -> None:
+    import pandas as pd
+
+    wide_df = get_extractor(list_columns=False, missing_value="<missing>").full_df
+    null_df = get_extractor(list_columns=False, missing_value=None).full_df
+    list_df = get_extractor(list_columns=True, missing_value=None).full_df
+    assert wide_df is not None and null_df is not None and list_df is not None
+
+    assert list(wide_df.columns) == list(null_df.columns)
+    assert (null_df == "<missing>").sum().sum() == 0
+    pd.testing.assert_frame_equal(
+        null_df.fillna("<missing>"), wide_df.fillna("<missing>")
+    )
+
+    for col in ["reactant", "agent", "solvent", "product", "yield"]:
+        wide_cols = [c for c in null_df.columns if c.startswith(f"{col}_")]
+        for (_, row), values in zip(null_df[wide_cols].iterrows(), list_df[col]):
+            expected = [v for v in row if not pd.isna(v)]
+            assert [v for v in values if not pd.isna(v)] == expected
+
+
+def _file_size_times(file: pathlib.Path, factor: int) -> int:
+    return file.stat().st_size * factor
+
+
+def test_extraction_pool(tmp_path: pathlib.Path) -> None:
+    import orderly.extract.pool
+
+    files = []
+    for name, size in [("a", 10), ("b", 30), ("c", 20), ("d", 30)]:
+        file = tmp_path / f"{name}.pb.gz"
+        file.write_bytes(b"0" * size)
+        files.append(file)
+
+    assert orderly.extract.pool.schedule_largest_first(files) == [
+        files[1],
+        files[3],
+        files[2],
+        files[0],
+    ]
+
+    for max_memory_fraction in [None, 1e-12]:
+        results: Dict[pathlib.Path, int] = {}
+        orderly.extract.pool.run_extraction_pool(
+            files,
+            func=_file_size_times,
+            shared_kwargs={"factor": 2},
+            num_workers=2,
+            on_result=results.__setitem__,
+            max_memory_fraction=max_memory_fraction,
+        )
+        assert results == {file: file.stat().st_size * 2 for file in files}
+
+
+def _misbehaving_extract(file: pathlib.Path, marker_path: pathlib.Path) -> int:
+    import os
+    import time
+
+    name = file.name.removesuffix(".pb.gz")
+    if name == "slow":
+        time.sleep(60)
+    elif name == "memory":
+        block = bytearray(2**30)
+        block[:: 2**12] = b"x" * len(block[:: 2**12])
+        time.sleep(60)
+    elif name == "crash":
+        os._exit(1)
+    elif name == "error":
+        raise ValueError("pathological file")
+    elif name == "flaky" and not marker_path.exists():
+        marker_path.touch()
+        os._exit(1)
+    return file.stat().st_size
+
+
+def test_extraction_pool_budgets(tmp_path: pathlib.Path) -> None:
+    import psutil
+    import orderly.extract.pool
+
+    files = []
+    for name in ["a", "b", "slow", "memory", "crash", "error", "flaky"]:
+        file = tmp_path / f"{name}.pb.gz"
+        file.write_bytes(b"0" * (len(files) + 1))
+        files.append(file)
+
+    results: List[Tuple[pathlib.Path, int]] = []
+    quarantined = orderly.extract.pool.run_extraction_pool(
+        files,
+        func=_misbehaving_extract,
+        shared_kwargs={"marker_path": tmp_path / "marker"},
+        num_workers=2,
+        on_result=lambda file, result: results.append((file, result)),
+        max_memory_fraction=None,
+        file_timeout=3,
+        max_file_memory=psutil.Process().memory_info().rss + 2**29,
+        max_attempts=2,
+        poll_interval=0.2,
+    )
+    # the other files are extracted once, the flaky file on its second try
+    assert sorted(results) == sorted(
+        (file, file.stat().st_size)
+        for file in files
+        if file.name.removesuffix(".pb.gz") in ["a", "b", "flaky"]
+    )
+    assert {
+        file.name.removesuffix(".pb.gz"): len(reasons)
+        for file, reasons in quarantined.items()
+    } == {
+        "slow": 2,
+        "memory": 2,
+        "crash": 2,
+        "error": 2,
+    }
+    reasons = {
+        file.name.removesuffix(".pb.gz"): reasons[0]
+        for file, reasons in quarantined.items()
+    }
+    assert reasons["slow"].startswith("timed out")
+    assert reasons["memory"].startswith("used")
+    assert reasons["crash"] == "the worker died"
+    assert reasons["error"] == "ValueError: pathological file"
+
+
+def test_molecule_annotations(tmp_path: pathlib.Path) -> None:
+    import orderly.extract.annotations
+    import orderly.extract.defaults
+    import orderly.extract.main
+    import orderly.data.test_data
+
+    table = orderly.extract.annotations.MoleculeAnnotationTable()
+    annotation = table.get("[Cl-].[Cl-].[Pd+2]")
+    assert annotation == orderly.extract.annotations.MoleculeAnnotation(
+        elements=("Cl", "Pd"),
+        has_transition_metal=True,
+        num_heavy_atoms=3,
+        formal_charge=0,
+    )
+    assert table.get("CC(=O)[O-]") == orderly.extract.annotations.MoleculeAnnotation(
+        elements=("C", "H", "O"),
+        has_transition_metal=False,
+        num_heavy_atoms=4,
+        formal_charge=-1,
+    )
+    assert table.get("teststring") is None
+    assert table.annotate_many(["CC(=O)[O-]", "O"]) == 1
+    assert table.misses == 4
+
+    table.save(tmp_path / "annotations.parquet")
+    loaded = orderly.extract.annotations.MoleculeAnnotationTable.load(
+        tmp_path / "annotations.parquet"
+    )
+    assert len(loaded) == 3
+    assert loaded.get("[Cl-].[Cl-].[Pd+2]") == annotation
+    assert loaded.misses == 0
+
+    # a bounded table evicts the least recently used molecules, and the unparsable names separately
+    bounded = orderly.extract.annotations.MoleculeAnnotationTable(
+        maxsize=2, negative_maxsize=1
+    )
+    assert bounded.annotate_many(["C", "O", "teststring", "C", "N", "foo"]) == 5
+    assert "O" not in bounded and "teststring" not in bounded
+    assert "C" in bounded and "N" in bounded and "foo" in bounded
+    assert (len(bounded), bounded.evictions) == (3, 2)
+
+    orderly.extract.main.main(
+        data_path=orderly.data.test_data.get_path_of_test_ords(),
+        ord_file_ending=TEST_ORD_FILE_ENDING,
+        trust_labelling=False,
+        consider_molecule_names=False,
+        output_path=tmp_path,
+        extracted_ord_data_folder="extracted_ord_data",
+        solvents_path=None,
+        molecule_names_folder="molecule_names",
+        merged_molecules_file="all_molecule_names.csv",
+        use_multiprocessing=False,
+        name_contains_substring="uspto",
+        inverse_substring=False,
+        overwrite=False,
+        config=orderly.extract.main.ExtractionConfig(annotate_molecules=True),
+    )
+    molecules = orderly.extract.annotations.get_molecules_from_parquet(
+        tmp_path / "extracted_ord_data" / "uspto-grants-1995_11.parquet"
+    )
+    assert len(molecules) > 0 and "<missing>" not in molecules
+    annotations = orderly.extract.annotations.MoleculeAnnotationTable.load(
+        tmp_path / "molecule_annotations.parquet"
+    )
+    for smiles in molecules:
+        if smiles in annotations:
+            assert annotations.get(
+                smiles
+            ).has_transition_metal == orderly.extract.defaults.has_transition_metal(  # type: ignore
+                smiles
+            )
+        else:
+            assert annotations.get(smiles) is None
+
+
+def test_extraction_profile(tmp_path: pathlib.Path) -> None:
+    import csv
+    import json
+    import orderly.extract.main
+    import orderly.extract.profiling
+    import orderly.data.test_data
+
+    profiler = orderly.extract.profiling.get_profiler()
+    try:
+        orderly.extract.profiling.enable()
+        profiler.reset()
+        instance = get_extractor(reaction_chunk_size=100)
+        num_reactions = len(instance.data.reactions)
+        profile = profiler.snapshot()
+    finally:
+        orderly.extract.profiling.enable(False)
+        profiler.reset()
+    # the chunks are extracted in other processes, and their timings are merged
+    assert profile["handle_reaction_object"]["calls"] == num_reactions
+    assert profile["rxn_input_extractor"]["calls"] == num_reactions
+    assert profile["canonicalise"]["seconds"] > 0
+
+    orderly.extract.main.main(
+        data_path=orderly.data.test_data.get_path_of_test_ords(),
+        ord_file_ending=TEST_ORD_FILE_ENDING,
+        trust_labelling=False,
+        consider_molecule_names=False,
+        output_path=tmp_path,
+        extracted_ord_data_folder="extracted_ord_data",
+        solvents_path=None,
+        molecule_names_folder="molecule_names",
+        merged_molecules_file="all_molecule_names.csv",
+        use_multiprocessing=True,
+        name_contains_substring="uspto",
+        inverse_substring=False,
+        overwrite=False,
+        log_file=tmp_path / "extraction.log",
+        config=orderly.extract.main.ExtractionConfig(profile=True),
+    )
+    with open(tmp_path / "extraction_profile.json") as f:
+        report = json.load(f)
+    assert list(report["files"]) == ["uspto-grants-1995_11"]
+    assert report["total"]["handle_reaction_object"]["calls"] == num_reactions
+    assert report["total"] == report["files"]["uspto-grants-1995_11"]
+    with open(tmp_path / "extraction_profile.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert set(row["file"] for row in rows) == {"total", "uspto-grants-1995_11"}
+    assert not (tmp_path / "profiles" / "uspto-grants-1995_11.json").exists()
+
+
+def test_dataset_output(tmp_path: pathlib.Path) -> None:
+    import orderly.extract.dataset
+    import orderly.extract.main
+    import orderly.data.test_data
+    import pandas as pd
+    import pyarrow.dataset as pa_ds
+    import pyarrow.parquet as pq
+
+    def run(output_path: pathlib.Path, dataset_output: bool) -> pathlib.Path:
+        orderly.extract.main.main(
+            data_path=orderly.data.test_data.get_path_of_test_ords(),
+            ord_file_ending=".pb.gz",
+            trust_labelling=False,
+            consider_molecule_names=False,
+            output_path=output_path,
+            extracted_ord_data_folder="extracted_ord_data",
+            solvents_path=None,
+            molecule_names_folder="molecule_names",
+            merged_molecules_file="all_molecule_names.csv",
+            use_multiprocessing=True,
+            name_contains_substring=None,
+            inverse_substring=False,
+            overwrite=False,
+            config=orderly.extract.main.ExtractionConfig(dataset_output=dataset_output),
+        )
+        return output_path / "extracted_ord_data"
+
+    files_path = run(tmp_path / "files", dataset_output=False)
+    dataset_path = run(tmp_path / "dataset", dataset_output=True)
+
+    partition_paths = orderly.extract.dataset.get_partition_paths(dataset_path)
+    files = sorted(files_path.glob("*.parquet"))
+    assert [path.name.split("=")[1] for path in partition_paths] == [
+        file.stem for file in files
+    ]
+    assert orderly.extract.dataset.is_dataset(dataset_path)
+    assert not orderly.extract.dataset.is_dataset(files_path)
+
+    # after compaction every partition is one file with the schema of the whole dataset
+    schema = orderly.extract.dataset.get_dataset_schema(dataset_path)
+    for partition_path in partition_paths:
+        (part_file,) = partition_path.glob("*.parquet")
+        assert pq.read_schema(part_file).equals(schema)
+        metadata = pq.ParquetFile(part_file).metadata
+        column_names = [
+            metadata.row_group(0).column(i).path_in_schema
+            for i in range(metadata.num_columns)
+        ]
+        reactant_column = metadata.row_group(0).column(
+            column_names.index("reactant_000")
+        )
+        assert "RLE_DICTIONARY" in reactant_column.encodings
+        assert reactant_column.statistics.has_min_max
+
+    dataset_df = orderly.extract.dataset.read_dataset(dataset_path).to_pandas()
+    files_df = pd.concat([pd.read_parquet(file) for file in files], ignore_index=True)
+    files_df = files_df[sorted(files_df.columns)]
+    molecule_columns = [
+        col
+        for col in files_df.columns
+        if orderly.extract.dataset.is_molecule_column(col)
+    ]
+    files_df[molecule_columns] = files_df[molecule_columns].fillna("<missing>")
+    pd.testing.assert_frame_equal(dataset_df, files_df)
+
+    filename = files[0].stem
+    filtered = orderly.extract.dataset.read_dataset(
+        dataset_path,
+        filter=pa_ds.field("source_file") == filename,
+        columns=["rxn_str", "source_file"],
+    )
+    assert filtered.num_rows == pq.read_metadata(files[0]).num_rows
+    assert set(filtered.column("source_file").to_pylist()) == {filename}
+
+
+def test_molecule_name_index(tmp_path: pathlib.Path) -> None:
+    import orderly.data.util
+    import orderly.extract.main
+    import orderly.extract.names
+
+    molecule_names_path = tmp_path / "molecule_names"
+    first = orderly.extract.names.MoleculeNameIndex()
+    first.add(["water", "brine"], dataset="a")
+    first.add(["water"], dataset="a")
+    first.save(molecule_names_path / "molecules_a.parquet")
+    second = orderly.extract.names.MoleculeNameIndex()
+    second.add(["brine", "celite"], dataset="b")
+    second.save(molecule_names_path / "molecules_b.parquet")
+
+    output_file_path = tmp_path / "all_molecule_names.csv"
+    index = orderly.extract.main.merge_mol_names(
+        molecule_names_path=molecule_names_path, output_file_path=output_file_path
+    )
+    assert index.most_common() == [("brine", 2), ("water", 2), ("celite", 1)]
+    assert index.datasets == {"water": {"a"}, "brine": {"a", "b"}, "celite": {"b"}}
+    assert orderly.data.util.load_list(output_file_path) == [
+        "brine",
+        "celite",
+        "water",
+    ]
+
+    index_path = output_file_path.with_suffix(".parquet")
+    loaded = orderly.extract.names.MoleculeNameIndex.load(index_path)
+    assert loaded.most_common() == index.most_common()
+    assert loaded.datasets == index.datasets
+    assert orderly.extract.names.load_molecule_names(index_path) == [
+        "brine",
+        "water",
+        "celite",
+    ]
+
+
+def test_dual_labelling_extraction(tmp_path: pathlib.Path) -> None:
+    import json
+    import orderly.extract.main
+    import orderly.data.test_data
+    import pandas as pd
+
+    output_paths = {False: tmp_path / "no_trust", True: tmp_path / "trust"}
+    orderly.extract.main.main(
+        data_path=orderly.data.test_data.get_path_of_test_ords(),
+        ord_file_ending=".pb.gz",
+        trust_labelling=False,
+        consider_molecule_names=False,
+        output_path=output_paths[False],
+        extracted_ord_data_folder="extracted_ords",
+        solvents_path=None,
+        molecule_names_folder="molecule_names",
+        merged_molecules_file="all_molecule_names.csv",
+        use_multiprocessing=True,
+        name_contains_substring=None,
+        inverse_substring=False,
+        overwrite=False,
+        config=orderly.extract.main.ExtractionConfig(
+            other_labelling_output_path=output_paths[True]
+        ),
+    )
+
+    # both trees are identical to separate extractions with each trust_labelling
+    for trust_labelling, output_path in output_paths.items():
+        with open(output_path / "extract_config.json") as f:
+            assert json.load(f)["trust_labelling"] == trust_labelling
+        assert (output_path / "all_molecule_names.csv").exists()
+        expected_path = (
+            orderly.data.test_data.get_path_of_test_extracted_ords(
+                trust_labelling=trust_labelling
+            )
+            / "extracted_ords"
+        )
+        expected_files = sorted(expected_path.glob("*.parquet"))
+        created_files = sorted((output_path / "extracted_ords").glob("*.parquet"))
+        assert [file.name for file in created_files] == [
+            file.name for file in expected_files
+        ]
+        for created_file, expected_file in zip(created_files, expected_files):
+            pd.testing.assert_frame_equal(
+                pd.read_parquet(created_file), pd.read_parquet(expected_file)
+            )
+
+    # the chunked extraction gives the same tables for both labellings
+    dual = get_extractor(
+        trust_labelling=True, dual_labelling=True, reaction_chunk_size=500
+    )
+    assert set(dual.labelling_outputs) == {False, True}
+    for trust_labelling in (False, True):
+        single = get_extractor(trust_labelling=trust_labelling)
+        table, names = dual.labelling_outputs[trust_labelling]
+        assert table.equals(single.full_table)
+        assert names == single.non_smiles_names_list
+
+    with pytest.raises(ValueError):
+        get_extractor(trust_labelling=True, dual_labelling=True, batch_size=100)
+
+
+def test_dataset_inventory(tmp_path: pathlib.Path) -> None:
+    import orderly.extract.extractor
+    import orderly.extract.inventory
+    import orderly.extract.main
+    import orderly.data.test_data
+
+    files = orderly.extract.main.get_file_names(
+        directory=orderly.data.test_data.get_path_of_test_ords(),
+        file_ending=".pb.gz",
+    )
+    inventory_path = tmp_path / "dataset_inventory.json"
+    inventory = orderly.extract.inventory.DatasetInventory(inventory_path)
+    infos = inventory.scan(files)
+    inventory.save()
+    for file, info in infos.items():
+        data = orderly.extract.extractor.OrdExtractor.load_data(file)
+        filename = orderly.extract.extractor.OrdExtractor.get_filename(data)
+        assert info.filename == filename
+        assert info.dataset_id == data.dataset_id
+        assert info.num_reactions == len(data.reactions)
+        assert orderly.extract.extractor.OrdExtractor.peek_filename(file) == filename
+
+    # the saved entries are reused, and the filter only keeps the uspto files
+    reloaded = orderly.extract.inventory.DatasetInventory(inventory_path)
+    assert reloaded.scan(files) == infos
+    uspto_files = orderly.extract.inventory.filter_files(infos, "uspto")
+    assert 0 < len(uspto_files) < len(files)
+    assert all("uspto" in infos[file].filename for file in uspto_files)
+    assert (
+        orderly.extract.inventory.estimate_extraction_seconds(infos, num_workers=2) > 0
+    )
+
+    # a file that is filtered out by name is never loaded
+    non_uspto_file = next(file for file in files if file not in uspto_files)
+    extractor = get_extractor(ord_file_path=non_uspto_file, contains_substring="uspto")
+    assert extractor.filtered_out
+    assert not hasattr(extractor, "data")
+
+
+def test_reaction_filter(tmp_path: pathlib.Path) -> None:
+    import json
+    import orderly.extract.reaction_filter
+
+    # a clean_config.json has the options of orderly.clean, the others are ignored
+    clean_config_path = tmp_path / "clean_config.json"
+    with open(clean_config_path, "w") as f:
+        json.dump(
+            {
+                "num_reactant": 2,
+                "num_product": 1,
+                "num_solv": 2,
+                "num_agent": 3,
+                "num_cat": 0,
+                "num_reag": 0,
+                "remove_reactions_with_no_solvents": True,
+                "min_frequency_of_occurrence": 100,
+            },
+            f,
+        )
+    reaction_filter = orderly.extract.reaction_filter.ReactionFilter.load(
+        clean_config_path
+    )
+    assert reaction_filter.num_reactant == 2
+    assert not reaction_filter.require_mapped_rxn_str
+
+    unfiltered = get_extractor()
+    filtered = get_extractor(reaction_filter=reaction_filter)
+    assert unfiltered.full_table is not None and filtered.full_table is not None
+    # the extractor counts in its own copy of the filter
+    assert reaction_filter.dropped == {}
+    assert filtered.reaction_filter is not None
+    dropped = filtered.reaction_filter.get_dropped(False)
+    assert dropped["no_solvents"] > 0 and dropped["too_many_reactants"] > 0
+    assert (
+        filtered.full_table.num_rows + sum(dropped.values())
+        == unfiltered.full_table.num_rows
+    )
+
+    # the reactions that are kept are unchanged and within the limits
+    columns = ["rxn_str", "reactant_000", "product_000", "solvent_000"]
+    unfiltered_rows = set(
+        zip(*(unfiltered.full_table.column(col).to_pylist() for col in columns))
+    )
+    filtered_rows = list(
+        zip(*(filtered.full_table.column(col).to_pylist() for col in columns))
+    )
+    assert all(row in unfiltered_rows for row in filtered_rows)
+    assert "reactant_002" not in filtered.full_table.column_names
+    assert "<missing>" not in filtered.full_table.column("solvent_000").to_pylist()
+
+    # the chunked extraction merges the counts of the workers
+    chunked = get_extractor(reaction_filter=reaction_filter, reaction_chunk_size=500)
+    assert chunked.full_table is not None and chunked.reaction_filter is not None
+    assert chunked.full_table.equals(filtered.full_table)
+    assert chunked.reaction_filter.get_dropped(False) == dropped
+
+    with pytest.raises(ValueError):
+        get_extractor(
+            reaction_filter=reaction_filter,
+            reaction_cache_path=tmp_path / "reaction_cache",
+        )
+
+
+def test_drop_duplicate_reactions(tmp_path: pathlib.Path) -> None:
+    import json
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import orderly.extract.duplicates
+
+    hash_reaction = orderly.extract.duplicates.hash_reaction
+    reaction_hash = hash_reaction(
+        [["CCO", "CC(=O)O"], [], [], ["O", "ClCCl"], []],
+        products=["CCOC(C)=O", "O"],
+        yields=[90.0, None],
+        temperature=25.0,
+        rxn_time=None,
+    )
+    # the order of the molecules doesn't matter, but the conditions do
+    assert reaction_hash == hash_reaction(
+        [["CC(=O)O", "CCO"], [], [], ["ClCCl", "O"], []],
+        products=["O", "CCOC(C)=O"],
+        yields=[None, 90.0],
+        temperature=25.0,
+        rxn_time=None,
+    )
+    assert reaction_hash != hash_reaction(
+        [["CCO", "CC(=O)O"], [], [], ["O", "ClCCl"], []],
+        products=["CCOC(C)=O", "O"],
+        yields=[90.0, None],
+        temperature=80.0,
+        rxn_time=None,
+    )
+
+    # the first occurrence is kept, in the order of the files
+    column = orderly.extract.duplicates.REACTION_HASH_COLUMN
+    first = tmp_path / "a.parquet"
+    second = tmp_path / "b.parquet"
+    pq.write_table(pa.table({column: ["x", "y", "x"], "row": [0, 1, 2]}), first)
+    pq.write_table(pa.table({column: ["y", "z"], "row": [3, 4]}), second)
+    report_path = tmp_path / "duplicate_counts.json"
+    duplicates = orderly.extract.duplicates.drop_duplicate_reactions(
+        [first, second], report_path=report_path
+    )
+    assert duplicates == {str(first): 1, str(second): 1}
+    assert pq.read_table(first).column("row").to_pylist() == [0, 1]
+    assert pq.read_table(second).column("row").to_pylist() == [4]
+    with open(report_path) as f:
+        assert json.load(f)["distinct"] == 3
+
+    # the extractor adds the hash of each reaction
+    extractor = get_extractor(
+        ord_file_path=get_test_ord_file("6a0bfcdf53a64c07987822162ae591e2.pb.gz"),
+        reaction_hashes=True,
+    )
+    assert extractor.full_table is not None
+    hashes = extractor.full_table.column(column).to_pylist()
+    assert len(hashes) == extractor.full_table.num_rows
+    assert all(len(h) == 32 for h in hashes)
+
+
+def test_prefetching_reader(tmp_path: pathlib.Path) -> None:
+    import time
+    import orderly.extract.extractor
+    import orderly.extract.prefetch
+
+    files = [tmp_path / f"{i}.txt" for i in range(5)]
+    for file in files:
+        file.write_text(file.stem)
+    loaded: List[pathlib.Path] = []
+
+    def load(file: pathlib.Path) -> str:
+        loaded.append(file)
+        if file == files[3]:
+            raise ValueError("corrupt file")
+        return file.read_text()
+
+    # the files are loaded in order and raise where they are reached
+    results = []
+    with pytest.raises(ValueError):
+        with orderly.extract.prefetch.PrefetchingReader(
+            files, load=load, depth=1
+        ) as reader:
+            for file, value in reader:
+                results.append((file, value))
+    assert results == [(file, file.stem) for file in files[:3]]
+    assert loaded[:4] == files[:4]
+
+    # only depth files are loaded ahead of the one being processed
+    loaded.clear()
+    with orderly.extract.prefetch.PrefetchingReader(
+        files, load=load, depth=1
+    ) as reader:
+        iterator = iter(reader)
+        assert next(iterator) == (files[0], files[0].stem)
+        time.sleep(0.5)  # let the background thread run ahead
+        assert loaded == files[:2]
+    assert list(orderly.extract.prefetch.PrefetchingReader(files, load, depth=0)) == [
+        (file, None) for file in files
+    ]
+
+    # an extraction from the preloaded file is the same as loading it
+    file = get_test_ord_file("6a0bfcdf53a64c07987822162ae591e2.pb.gz")
+    orderly.extract.prefetch.warm_file(file)
+    preloaded = get_extractor(
+        ord_file_path=file,
+        preloaded_data=orderly.extract.extractor.OrdExtractor.load_data(file),
+    )
+    assert preloaded.full_table is not None
+    assert preloaded.full_table.equals(get_extractor(ord_file_path=file).full_table)
+
+
+def test_sharded_extraction(tmp_path: pathlib.Path) -> None:
+    import json
+    import os
+    import shutil
+    import subprocess
+    import sys
+    import pyarrow.parquet as pq
+    import orderly.extract.main
+    import orderly.extract.shards
+    import orderly.data.test_data
+
+    sizes = {pathlib.Path(name): size for name, size in zip("abcde", [10, 7, 5, 3, 2])}
+    shards = orderly.extract.shards.assign_shards(list(sizes), 2, sizes=sizes)
+    assert shards == [
+        [pathlib.Path("a"), pathlib.Path("d")],
+        [pathlib.Path("b"), pathlib.Path("c"), pathlib.Path("e")],
+    ]
+    with pytest.raises(ValueError):
+        orderly.extract.shards.get_shard(list(sizes), 2, 2, sizes=sizes)
+
+    data_path = tmp_path / "ord"
+    test_ords = orderly.data.test_data.get_path_of_test_ords()
+    for name in [
+        "00/ord_dataset-00005539a1e04c809a9a78647bea649c.pb.gz",
+        "0b/ord_dataset-0bb2e99daa66408fb8dbd6a0781d241c.pb.gz",
+        "0c/ord_dataset-0c75d67751634f0594b24b9f498b77c2.pb.gz",
+        "6a/ord_dataset-6a0bfcdf53a64c07987822162ae591e2.pb.gz",
+    ]:
+        (data_path / name).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(test_ords / name, data_path / name)
+
+    single_path = tmp_path / "single"
+    orderly.extract.main.main(
+        data_path=data_path,
+        ord_file_ending=".pb.gz",
+        trust_labelling=False,
+        consider_molecule_names=True,
+        output_path=single_path,
+        extracted_ord_data_folder="extracted_ords",
+        solvents_path=None,
+        molecule_names_folder="molecule_names",
+        merged_molecules_file="all_molecule_names.csv",
+        use_multiprocessing=False,
+        name_contains_substring=None,
+        inverse_substring=False,
+        overwrite=False,
+        config=orderly.extract.main.ExtractionConfig(drop_duplicates=True),
+    )
+
+    # each shard is extracted by its own process, as it would be on another node
+    sharded_path = tmp_path / "sharded"
+    env = dict(os.environ, PYTHONPATH=str(pathlib.Path(__file__).parents[1]))
+    for shard_index in range(2):
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "orderly.extract",
+                f"--data_path={data_path}",
+                f"--output_path={sharded_path}",
+                "--name_contains_substring=",
+                "--consider_molecule_names=True",
+                "--use_multiprocessing=False",
+                "--drop_duplicates=True",
+                f"--shard_index={shard_index}",
+                "--num_shards=2",
+            ],
+            env=env,
+            check=True,
+        )
+    # the shards are disjoint and together extract every file
+    shard_filenames = [
+        sorted(
+            path.stem
+            for path in (
+                orderly.extract.shards.get_shard_path(sharded_path, i, 2)
+                / "extracted_ords"
+            ).glob("*.parquet")
+        )
+        for i in range(2)
+    ]
+    assert all(len(filenames) > 0 for filenames in shard_filenames)
+    assert set(shard_filenames[0]).isdisjoint(shard_filenames[1])
+
+    filenames = orderly.extract.shards.merge_shards(sharded_path, num_shards=2)
+    assert filenames == sorted(shard_filenames[0] + shard_filenames[1])
+
+    # the merged shards are the same as the single run
+    single_outputs = sorted((single_path / "extracted_ords").glob("*.parquet"))
+    sharded_outputs = sorted((sharded_path / "extracted_ords").glob("*.parquet"))
+    assert [o.name for o in single_outputs] == [o.name for o in sharded_outputs]
+    for single_output, sharded_output in zip(single_outputs, sharded_outputs):
+        # (compared as frames, as the missing temperatures are NaN)
+        assert (
+            pq.read_table(single_output)
+            .to_pandas()
+            .equals(pq.read_table(sharded_output).to_pandas())
+        )
+    for name in ["all_molecule_names.csv", "all_molecule_names.parquet"]:
+        assert (single_path / name).read_bytes() == (sharded_path / name).read_bytes()
+    with open(single_path / "duplicate_counts.json") as f:
+        single_duplicates = json.load(f)
+    with open(sharded_path / "duplicate_counts.json") as f:
+        sharded_duplicates = json.load(f)
+    assert single_duplicates["total"] == sharded_duplicates["total"]
+    assert single_duplicates["distinct"] == sharded_duplicates["distinct"]
+
+    # a missing shard can't be merged
+    with pytest.raises(FileNotFoundError):
+        orderly.extract.shards.merge_shards(sharded_path, num_shards=3)
+
+
+def test_synthetic_ord_data(tmp_path: pathlib.Path) -> None:
+    import orderly.data.synthetic
+    import orderly.data.test_data
+    import orderly.extract.extractor
+    import orderly.extract.main
+
+    test_ords = orderly.data.test_data.get_path_of_test_ords()
+    distribution = orderly.data.synthetic.ReactionDistribution.from_ord_files(
+        [
+            test_ords / "0b" / "ord_dataset-0bb2e99daa66408fb8dbd6a0781d241c.pb.gz",
+            test_ords / "6a" / "ord_dataset-6a0bfcdf53a64c07987822162ae591e2.pb.gz",
+        ],
+        max_procedures=10,
+    )
+    assert distribution.num_mapped > 0
+    assert len(distribution.procedures) == 10
+    distribution_path = tmp_path / "distribution.json"
+    distribution.save(distribution_path)
+    assert (
+        orderly.data.synthetic.ReactionDistribution.load(distribution_path)
+        == distribution
+    )
+
+    files = orderly.data.synthetic.generate_ord_data(
+        tmp_path / "ord",
+        num_reactions=250,
+        reactions_per_file=100,
+        distribution=distribution,
+        seed=1,
+    )
+    assert len(files) == 3
+    # the files only depend on the seed
+    again = orderly.data.synthetic.generate_ord_data(
+        tmp_path / "again",
+        num_reactions=250,
+        reactions_per_file=100,
+        distribution=distribution,
+        seed=1,
+    )
+    assert [f.read_bytes() for f in files] == [f.read_bytes() for f in again]
+    assert orderly.extract.main.get_file_names(tmp_path / "ord") == sorted(files)
+
+    # the files can be streamed and extracted like ORD data
+    header, num_reactions = orderly.extract.extractor.OrdExtractor.load_header(
+        files[-1]
+    )
+    assert header.name == "synthetic_1_2"
+    assert num_reactions == 50
+    data = orderly.extract.extractor.OrdExtractor.load_data(files[0])
+    assert len(data.reactions) == 100
+    assert any(
+        identifier.is_mapped for rxn in data.reactions for identifier in rxn.identifiers
+    )
+    extractor = get_extractor(ord_file_path=files[0], consider_molecule_names=True)
+    assert extractor.full_df is not None
+    assert len(extractor.full_df) > 50
+
+
+def test_procedure_details_sidecar(tmp_path: pathlib.Path) -> None:
+    import pandas as pd
+    import pyarrow.parquet as pq
+    import orderly.clean.cleaner
+    import orderly.extract.extractor
+    import orderly.extract.main
+    import orderly.extract.procedures
+    import orderly.extract.reaction_filter
+    import orderly.data.test_data
+
+    def extract(name: str, **kwargs: Any) -> pd.DataFrame:
+        orderly.extract.main.main(
+            data_path=orderly.data.test_data.get_path_of_test_ords(),
+            ord_file_ending=TEST_ORD_FILE_ENDING,
+            trust_labelling=False,
+            consider_molecule_names=False,
+            output_path=tmp_path / name,
+            extracted_ord_data_folder="extracted_ords",
+            solvents_path=None,
+            molecule_names_folder="molecule_names",
+            merged_molecules_file="all_molecule_names.csv",
+            use_multiprocessing=False,
+            name_contains_substring="uspto",
+            inverse_substring=False,
+            overwrite=False,
+            config=orderly.extract.main.ExtractionConfig(**kwargs),
+        )
+        return pd.read_parquet(
+            tmp_path / name / "extracted_ords" / "uspto-grants-1995_11.parquet"
+        )
+
+    full_df = extract("full")
+    df = extract("sidecar", procedure_details_sidecar=True)
+    streamed_df = extract("streamed", procedure_details_sidecar=True, batch_size=50)
+
+    sidecar_path = tmp_path / "sidecar" / "procedure_details"
+    assert "procedure_details" not in df.columns
+    assert df["row_id"].is_unique
+    assert df.drop(columns="row_id").equals(full_df.drop(columns="procedure_details"))
+    # the row ids don't depend on how the file was extracted
+    assert streamed_df.equals(df)
+    reaction_ids = [
+        rxn.reaction_id
+        for rxn in orderly.extract.extractor.OrdExtractor.iter_reactions(
+            get_test_ord_file()
+        )
+    ]
+    assert set(df["row_id"]) <= set(reaction_ids)
+    # nor on the options of the extraction, e.g. the reactions that are filtered out
+    filtered_df = extract(
+        "filtered",
+        procedure_details_sidecar=True,
+        reaction_filter=orderly.extract.reaction_filter.ReactionFilter(num_reactant=1),
+    )
+    assert 0 < len(filtered_df) < len(df)
+    assert filtered_df.set_index("row_id")["rxn_str"].equals(
+        df.set_index("row_id")["rxn_str"].loc[filtered_df["row_id"]]
+    )
+    sidecar = pq.ParquetFile(sidecar_path / "uspto-grants-1995_11.parquet")
+    assert sidecar.metadata.row_group(0).column(1).compression == "ZSTD"
+    assert sidecar.read().equals(
+        pq.read_table(
+            tmp_path / "streamed" / "procedure_details" / "uspto-grants-1995_11.parquet"
+        )
+    )
+
+    joined = orderly.extract.procedures.join_procedure_details(
+        df.iloc[::-1], sidecar_path
+    )
+    assert joined.index.equals(df.index[::-1])
+    assert joined["procedure_details"].sort_index().equals(full_df["procedure_details"])
+
+    def clean(name: str, include_procedure_details: bool) -> pd.DataFrame:
+        output_path = tmp_path / name / f"cleaned_{include_procedure_details}.parquet"
+        orderly.clean.cleaner.main(
+            output_path=output_path,
+            ord_extraction_path=tmp_path / name / "extracted_ords",
+            molecules_to_remove_path=tmp_path / name / "all_molecule_names.csv",
+            consistent_yield=False,
+            num_reactant=5,
+            num_product=5,
+            num_solv=2,
+            num_agent=3,
+            num_cat=0,
+            num_reag=0,
+            min_frequency_of_occurrence=0,
+            map_rare_molecules_to_other=False,
+            set_unresolved_names_to_none_if_mapped_rxn_str_exists_else_del_rxn=False,
+            set_unresolved_names_to_none=False,
+            remove_rxn_with_unresolved_names=False,
+            remove_reactions_with_no_reactants=False,
+            remove_reactions_with_no_products=False,
+            remove_reactions_with_no_solvents=False,
+            remove_reactions_with_no_agents=False,
+            remove_reactions_with_no_conditions=False,
+            scramble=False,
+            train_size=0,
+            drop_duplicates=False,
+            disable_tqdm=True,
+            overwrite=False,
+            include_procedure_details=include_procedure_details,
+        )
+        return pd.read_parquet(output_path)
+
+    # the procedure details are only read for the reactions that are kept, once the cleaning is done, or joined from the sidecar
+    cleaned_full = clean("full", include_procedure_details=True)
+    assert cleaned_full["procedure_details"].tolist() == [
+        None if details == "<missing>" else details
+        for details in full_df["procedure_details"].loc[cleaned_full["original_index"]]
+    ]
+    assert "procedure_details" not in clean("full", False).columns
+    assert sorted(clean("sidecar", False).columns) == sorted(
+        [col for col in cleaned_full.columns if col != "procedure_details"] + ["row_id"]
+    )
+    cleaned = clean("sidecar", include_procedure_details=True)
+    assert cleaned[cleaned_full.columns].equals(cleaned_full)